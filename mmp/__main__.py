@@ -1,7 +1,8 @@
 #!/usr/bin/env python3
 # __main__.py - minimacropad driver python pkg
+from mmp.startup import STARTUP
 from argparse import ArgumentParser
-import mmp.minimacropad
+import atexit
 
 # https://stackoverflow.com/a/23891673
 import sys
@@ -14,6 +15,19 @@ def main():
     gui_only_help = "Don't try to connect to a Serial hardware device, but still open the GUI MacroPad."
     monitor_help = "Which monitor to show the gui on."
     verbose_help = "Add verbose output. Useful for debugging."
+    headless_help = ("Run without the GUI (no tkinter), just serial -> keystrokes. "
+                     "SIGINT / SIGTERM quit, SIGHUP reloads the config file.")
+    startup_timing_help = "Print how long each startup phase took & what it imported."
+    asyncio_help = ("Run serial reading, macros & delays on 1 asyncio event loop instead of threads. "
+                    "Lots of timed macros can run at once without a thread each.")
+    record_mouse_help = ("Record the mouse (no GUI / serial) until --stop-hotkey is pressed & save it to the config "
+                         "file as a MOUSE_PLAYBACK action with this name.")
+    record_keys_help = ("Record the keyboard (no GUI / serial) until --stop-hotkey is pressed & save it to the config "
+                        "file as an action with this name. Typing becomes KB_SEND_STR, shortcuts KB_SEND_HOTKEY.")
+    max_gap_help = "With --record-keys, shorten pauses between keys to at most this many seconds."
+    stop_hotkey_help = "Hotkey that stops recording. Default esc."
+    trace_out_help = ("Trace press -> keystroke latency & write p50/p95/p99 histograms to this file on exit. "
+                      "(.csv for CSV, otherwise JSON) With --verbose, also print each press as it happens.")
 
     parser = ArgumentParser(description="MiniMacroPad - GUI")
     parser.add_argument(
@@ -29,8 +43,66 @@ def main():
         action="store_true", help=verbose_help, default=False
     )
 
+    parser.add_argument(
+        "--headless",
+        action="store_true", help=headless_help, default=False
+    )
+
+    parser.add_argument(
+        "--asyncio",
+        action="store_true", help=asyncio_help, default=False
+    )
+
+    parser.add_argument(
+        "--record-mouse", metavar="ACTION_NAME",
+        action="store", help=record_mouse_help, default=None
+    )
+
+    parser.add_argument(
+        "--record-keys", metavar="ACTION_NAME",
+        action="store", help=record_keys_help, default=None
+    )
+
+    parser.add_argument(
+        "--max-gap", type=float,
+        action="store", help=max_gap_help, default=None
+    )
+
+    parser.add_argument(
+        "--stop-hotkey",
+        action="store", help=stop_hotkey_help, default="esc"
+    )
+
+    parser.add_argument(
+        "--trace-out",
+        action="store", help=trace_out_help, default=None
+    )
+
+    parser.add_argument(
+        "--startup-timing",
+        action="store_true", help=startup_timing_help, default=False
+    )
+
     args = parser.parse_args()
-    mmp.minimacropad.run(is_gui_only=args.gui_only, monitor_num=args.monitor, is_verbose=args.verbose)
+
+    with STARTUP.phase("core import"):
+        import mmp.minimacropad
+        from mmp.tracer import TRACER
+
+    if args.trace_out:
+        TRACER.enable(live=args.verbose)
+        atexit.register(TRACER.dump, args.trace_out)
+    if args.record_mouse and args.record_keys:
+        parser.error("--record-mouse & --record-keys can't be used together")
+    if args.record_mouse or args.record_keys:
+        sys.exit(mmp.minimacropad.run_recorder(args.record_mouse or args.record_keys, is_verbose=args.verbose,
+                                               stop_hotkey=args.stop_hotkey, record_keys=bool(args.record_keys),
+                                               max_gap=args.max_gap))
+    if args.headless and args.gui_only:
+        parser.error("--headless needs a serial device, it can't be used with --gui-only")
+    sys.exit(mmp.minimacropad.run(is_gui_only=args.gui_only, monitor_num=args.monitor, is_verbose=args.verbose,
+                                  startup_timing=args.startup_timing, is_headless=args.headless,
+                                  use_asyncio=args.asyncio))
 # run
 
 
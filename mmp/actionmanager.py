@@ -1,16 +1,28 @@
 #!/usr/bin/env python3
 # actionmanager.py - Manager for the actions to run. (keyboard & mouse operations)
-import keyboard
-import mouse
+import inspect
+import threading
 import time
 
-from datetime import datetime
-from enum import Enum, auto
-from tkinter import Tk
-from typing import Tuple, Dict, List
+from contextvars import ContextVar
+from functools import wraps
+from types import ModuleType
+from typing import Any, Callable, Tuple, Dict, List, Optional
 
 from mmp.config import Config
 from mmp.stringlooper import StringLooper
+from mmp.mappedlines import MappedLines, load_data, is_same_data
+from mmp.looperstate import LooperStateStore, get_state_path
+from mmp.outputbackend import OutputBackend, get_output_backend
+from mmp.actiontimer import ActionTimer
+from mmp.canceltoken import CancelToken
+from mmp.mousepath import get_deltas, get_fractions, parse_duration, parse_point, scale_path
+from mmp.mouserecorder import decode_timeline, MOVE, DOWN, UP, BUTTONS, WHEEL_UNIT
+from mmp.pages import PageManager
+
+# CancelToken of the running macro. A ContextVar instead of a threading.local so it's per thread
+# for ActionQueue workers AND per task for the asyncio engine (many macros on 1 thread)
+_current_token: ContextVar[Optional[CancelToken]] = ContextVar("mmp_cancel_token", default=None)
 
 
 class ActionManager():
@@ -23,14 +35,51 @@ class ActionManager():
         "KB_SEND_LOOP_RAND"
     ]
 
-    def __init__(self, config: Config, default_delay: float = 0.2, verbose: bool = False):
+    # Actions that type text, KB_PACING in a macro sets their delay between characters
+    PACED_ACTIONS: List[str] = [
+        "KB_SEND_STR",
+        "KB_SEND_LOOP_UP",
+        "KB_SEND_LOOP_DOWN",
+        "KB_SEND_LOOP_RAND"
+    ]
+
+    # Names the mouse module uses
+    MOUSE_BUTTONS: List[str] = ["left", "right", "middle", "x", "x2"]
+
+    def __init__(self, config: Config, default_delay: float = 0.2, verbose: bool = False, output: OutputBackend = None):
         """
-        REPLACE_ME
+        Params:
+            config - Config, config with the ACTIONS & DATA
+            default_delay - float [0.2], delay used when an action doesn't set one
+            verbose - bool [False], verbosity
+            output - OutputBackend [None], sends the keyboard events. Default to CONFIG.OUTPUT (KEYBOARD if not set)
         """
         self.verbose: bool = verbose
         self.config: Config = config
         self.default_delay: float = default_delay
-        self.loopers: Dict[StringLooper] = self._parse_loopers()
+        self.timer: ActionTimer = ActionTimer(spin=config.config.get("TIMER_SPIN"))
+        # Points per second for mouse moves & drags with a DURATION, paths are precomputed at this rate
+        self.mouse_rate: float = float(config.config.get("MOUSE_RATE", 120))
+        if self.mouse_rate <= 0:
+            raise ValueError(f"CONFIG.MOUSE_RATE must be > 0, got {self.mouse_rate}")
+        self.output: OutputBackend = output if output is not None else get_output_backend(
+            config.config.get("OUTPUT", "KEYBOARD"), verbose=verbose
+        )
+        # Looper positions from the last run, changes are saved in the background (CONFIG.LOOPER_STATE)
+        self.looper_state: Optional[LooperStateStore] = LooperStateStore(
+            get_state_path(config.get_path()), verbose=verbose
+        ) if config.config.get("LOOPER_STATE", True) else None
+        self.loopers: Dict[str, StringLooper] = self.build_loopers(config)
+        # Which page is on, the PAGE_* actions switch it. MacroManager gives it the compiled PAGES
+        self.pages: PageManager = PageManager(release=self.get_page_release(config), verbose=verbose)
+
+        # Keys / mouse buttons that are held down right now -> CancelToken of the macro that pressed them
+        # Released on cancel, error, panic or shutdown so nothing is left stuck down
+        self.held_keys: Dict[str, Optional[CancelToken]] = {}
+        self.held_buttons: Dict[str, Optional[CancelToken]] = {}
+        self._held_lock: threading.Lock = threading.Lock()
+        # mouse module, only imported once a MOUSE_* action is compiled (see the mouse property)
+        self._mouse: Optional[ModuleType] = None
 
         # ACTION_NAME:function mapping
         self.actions = {
@@ -38,53 +87,445 @@ class ActionManager():
             "KB_SEND_HOTKEY": self.do_kb_send_hotkey,
             "KB_SEND_STR": self.do_kb_send_str,
             "KB_SEND_LOOP_UP": self.do_kb_loop_up,
+            "KB_SEND_LOOP_DOWN": self.do_kb_loop_down,
+            "KB_SEND_LOOP_RAND": self.do_kb_loop_rand,
             "KB_KEY_PRESS": self.do_kb_key_press,
             "KB_KEY_DOWN": self.do_kb_key_down,
             "KB_KEY_UP": self.do_kb_key_up,
-            # "MOUSE_CLICK": replace,
-            # "MOUSE_DOWN": replace,
-            # "MOUSE_UP": replace,
-            # "MOUSE_MOVE_TO": replace,
-            # "MOUSE_RECORD": replace,
+            "MOUSE_CLICK": self.do_mouse_click,
+            "MOUSE_DOWN": self.do_mouse_down,
+            "MOUSE_UP": self.do_mouse_up,
+            "MOUSE_MOVE_TO": self.do_mouse_move_to,
+            "MOUSE_MOVE_BY": self.do_mouse_move_by,
+            "MOUSE_DRAG": self.do_mouse_drag,
+            "MOUSE_PLAYBACK": self.do_mouse_playback,
+            "PAGE_TO": self.do_page_step,
+            "PAGE_TOGGLE": self.do_page_step,
+            "PAGE_MOMENTARY": self.do_page_step,
+        }
+
+        # ACTION_NAME:coroutine mapping for the asyncio engine, for actions that wait (await instead of sleep)
+        # Takes the same args as the function in self.actions. Actions not in here are run as is
+        self.async_actions = {
+            "DELAY": self.do_delay_async,
+            "KB_SEND_HOTKEY": self.do_kb_send_hotkey_async,
+            "KB_SEND_STR": self.do_kb_send_str_async,
+            "KB_SEND_LOOP_UP": self.do_kb_loop_up_async,
+            "KB_SEND_LOOP_DOWN": self.do_kb_loop_down_async,
+            "KB_SEND_LOOP_RAND": self.do_kb_loop_rand_async,
+            "MOUSE_MOVE_TO": self.do_mouse_move_to_async,
+            "MOUSE_MOVE_BY": self.do_mouse_move_by_async,
+            "MOUSE_DRAG": self.do_mouse_drag_async,
+            "MOUSE_PLAYBACK": self.do_mouse_playback_async,
+        }
+
+        # ACTION_NAME:arg parser mapping, turns the JSON value into validated args for the action function
+        self.arg_parsers = {
+            "DELAY": self._parse_delay,
+            "KB_SEND_HOTKEY": self._parse_hotkey,
+            "KB_SEND_STR": self._parse_str,
+            "KB_KEY_PRESS": self._parse_str,
+            "KB_KEY_DOWN": self._parse_str,
+            "KB_KEY_UP": self._parse_str,
+            "MOUSE_CLICK": self._parse_mouse_button,
+            "MOUSE_DOWN": self._parse_mouse_button,
+            "MOUSE_UP": self._parse_mouse_button,
+            "MOUSE_MOVE_TO": self._parse_mouse_move_to,
+            "MOUSE_MOVE_BY": self._parse_mouse_move_by,
+            "MOUSE_DRAG": self._parse_mouse_drag,
+            "MOUSE_PLAYBACK": self._parse_mouse_playback,
+            "PAGE_TO": self._parse_page,
+            "PAGE_TOGGLE": self._parse_page,
+            "PAGE_MOMENTARY": self._parse_page,
         }
     # __init__
 
+    def compile_step(self, func_name: str, value: Any, loopers: Dict[str, StringLooper] = None) -> Tuple[Callable, tuple]:
+        """Look up an action function & validate / convert its value once, so it can be called later
+        Params:
+            func_name - str, ACTION_NAME (e.g. KB_SEND_STR)
+            value - Any, value from the JSON config
+            loopers - Dict[str, StringLooper] [None], loopers to bind to, default to self.loopers
+        Returns:
+            Tuple[Callable, tuple] - the function and the args to call it with
+        Raises:
+            ValueError if func_name is unknown or value is invalid
+        """
+        if func_name not in self.actions:
+            raise ValueError(f"Unknown action {func_name}")
+        if func_name.startswith("MOUSE_"):
+            # Load the mouse backend now, not on the first press
+            self.load_mouse()
+        if func_name in ActionManager.LOOPER_ACTIONS:
+            return (self.actions[func_name], self._parse_looper(value, loopers))
+        parser = self.arg_parsers.get(func_name, lambda v: (v,))
+        return (self.actions[func_name], parser(value))
+    # compile_step
+
+    def _parse_delay(self, value: Any) -> tuple:
+        """Validate a delay in seconds, null uses the default delay"""
+        if value is None:
+            return (self.default_delay,)
+        if isinstance(value, bool) or not isinstance(value, (int, float)) or value < 0:
+            raise ValueError(f"Expected a number >= 0, got {value!r}")
+        return (float(value),)
+    # _parse_delay
+
+    def _parse_hotkey(self, value: Any) -> tuple:
+        """Validate a List[str] hotkey, bind the default delay as how long to hold it"""
+        return self._parse_str_list(value) + (self.default_delay,)
+    # _parse_hotkey
+
+    def _parse_str(self, value: Any) -> tuple:
+        """Validate a str value"""
+        if not isinstance(value, str):
+            raise ValueError(f"Expected a str, got {value!r}")
+        return (value,)
+    # _parse_str
+
+    def _parse_str_list(self, value: Any) -> tuple:
+        """Validate a List[str] value"""
+        if not isinstance(value, list) or not all(isinstance(v, str) for v in value):
+            raise ValueError(f"Expected a list of str, got {value!r}")
+        return (tuple(value),)
+    # _parse_str_list
+
+    def _parse_mouse_button(self, value: Any) -> tuple:
+        """Validate a mouse button name, null is left"""
+        if value is None:
+            return ("left",)
+        if value not in ActionManager.MOUSE_BUTTONS:
+            raise ValueError(f"Expected a mouse button {ActionManager.MOUSE_BUTTONS}, got {value!r}")
+        return (value,)
+    # _parse_mouse_button
+
+    def _parse_mouse_options(self, value: Any, point_key: str, keys: List[str],
+                             default_duration: float = 0.0) -> Tuple[dict, Tuple[float, ...], float]:
+        """Validate a mouse move / drag value, [x, y] or {point_key: [x, y], "DURATION": ..., "EASING": ...}
+        & precompute its eased path at self.mouse_rate
+        Returns:
+            Tuple[dict, Tuple[float, ...], float], (the value as a dict, path fractions, seconds between points)
+        """
+        if not isinstance(value, dict):
+            value = {point_key: value}
+        unknown = set(value) - set(keys)
+        if unknown:
+            raise ValueError(f"Unknown keys {sorted(unknown)}, expected some of {keys}")
+        duration = parse_duration(value.get("DURATION", default_duration))
+        fractions, interval = get_fractions(duration, self.mouse_rate, value.get("EASING", "EASE_IN_OUT"))
+        return (value, fractions, interval)
+    # _parse_mouse_options
+
+    def _parse_mouse_move_to(self, value: Any) -> tuple:
+        """Validate MOUSE_MOVE_TO, bind the target & the precomputed path"""
+        value, fractions, interval = self._parse_mouse_options(value, "TO", ["TO", "DURATION", "EASING"])
+        return parse_point(value.get("TO"), "TO") + (fractions, interval)
+    # _parse_mouse_move_to
+
+    def _parse_mouse_move_by(self, value: Any) -> tuple:
+        """Validate MOUSE_MOVE_BY, bind the precomputed relative moves"""
+        value, fractions, interval = self._parse_mouse_options(value, "BY", ["BY", "DURATION", "EASING"])
+        dx, dy = parse_point(value.get("BY"), "BY")
+        return get_deltas(dx, dy, fractions) + (interval,)
+    # _parse_mouse_move_by
+
+    def _parse_mouse_drag(self, value: Any) -> tuple:
+        """Validate MOUSE_DRAG, bind the button, start, target & the precomputed path"""
+        if not isinstance(value, dict):
+            raise ValueError(f"Expected {{\"TO\": [x, y], ...}}, got {value!r}")
+        value, fractions, interval = self._parse_mouse_options(
+            value, "TO", ["FROM", "TO", "BUTTON", "DURATION", "EASING"], default_duration=self.default_delay
+        )
+        start = parse_point(value["FROM"], "FROM") if value.get("FROM") is not None else None
+        return self._parse_mouse_button(value.get("BUTTON")) + (start,) + parse_point(value.get("TO"), "TO") \
+            + (fractions, interval)
+    # _parse_mouse_drag
+
+    def _parse_mouse_playback(self, value: Any) -> tuple:
+        """Validate & decode a recorded timeline (see MouseRecorder), bind the start & the decoded events"""
+        if not isinstance(value, dict) or not isinstance(value.get("TIMELINE"), str):
+            raise ValueError(f"Expected a recording {{\"START\": [x, y], \"TIMELINE\": ...}}, got {value!r}")
+        speed = value.get("SPEED", 1.0)
+        if isinstance(speed, bool) or not isinstance(speed, (int, float)) or speed <= 0:
+            raise ValueError(f"Expected SPEED to be a number > 0, got {speed!r}")
+        start = parse_point(value.get("START"), "START")
+        return (start,) + decode_timeline(dict(value, START=start), speed)
+    # _parse_mouse_playback
+
+    def _parse_page(self, value: Any) -> tuple:
+        """Validate a PAGES name, compile_pages checks it's there"""
+        if not isinstance(value, str):
+            raise ValueError(f"Expected a PAGES name, got {value!r}")
+        return (value,)
+    # _parse_page
+
+    @staticmethod
+    def get_page_release(config: Config) -> float:
+        """Get CONFIG.PAGE_RELEASE, seconds a PAGE_MOMENTARY page stays after its button stops repeating"""
+        release = config.config.get("PAGE_RELEASE", 0.4)
+        if isinstance(release, bool) or not isinstance(release, (int, float)) or release <= 0:
+            raise ValueError(f"CONFIG.PAGE_RELEASE must be a number > 0, got {release!r}")
+        return float(release)
+    # get_page_release
+
+    def _parse_looper(self, value: Any, loopers: Dict[str, StringLooper] = None) -> tuple:
+        """Validate a DATA name that has a looper, the looper itself is bound as the arg"""
+        loopers = self.loopers if loopers is None else loopers
+        if not isinstance(value, str) or value not in loopers:
+            raise ValueError(f"Failed to find {value!r} in DATA")
+        return (loopers[value],)
+    # _parse_looper
+
+    @property
+    def mouse(self) -> ModuleType:
+        """The mouse module, imported on first use so configs without MOUSE_* actions never load it"""
+        if self._mouse is None:
+            self.load_mouse()
+        return self._mouse
+    # mouse
+
+    def load_mouse(self) -> None:
+        """Import the mouse module if it's not yet, e.g. when a MOUSE_* action is compiled instead of on its 1st press"""
+        if self._mouse is None:
+            import mouse
+            self._mouse = mouse
+    # load_mouse
+
+    def set_token(self, token: Optional[CancelToken]) -> None:
+        """Set the CancelToken for the macro running on this thread / asyncio task, actions & delays check it
+        Params:
+            token - Optional[CancelToken], None once the macro is done
+        """
+        _current_token.set(token)
+    # set_token
+
+    def get_token(self) -> Optional[CancelToken]:
+        """Get the CancelToken for the macro running on this thread / asyncio task"""
+        return _current_token.get()
+    # get_token
+
+    def _press(self, key: str) -> None:
+        """Press a key & remember it's held"""
+        self.output.press(key)
+        with self._held_lock:
+            self.held_keys[key] = self.get_token()
+    # _press
+
+    def _release(self, key: str) -> None:
+        """Release a key & forget it's held"""
+        self.output.release(key)
+        with self._held_lock:
+            self.held_keys.pop(key, None)
+    # _release
+
+    def _press_keys(self, keys: List[str]) -> None:
+        """Press keys (1 batch if the backend can) & remember they're held"""
+        self.output.press_keys(keys)
+        token = self.get_token()
+        with self._held_lock:
+            for key in keys:
+                self.held_keys[key] = token
+    # _press_keys
+
+    def _release_keys(self, keys: List[str]) -> None:
+        """Release keys (1 batch if the backend can) & forget they're held"""
+        self.output.release_keys(keys)
+        with self._held_lock:
+            for key in keys:
+                self.held_keys.pop(key, None)
+    # _release_keys
+
+    def _mouse_press(self, button: str) -> None:
+        """Press a mouse button & remember it's held"""
+        self.mouse.press(button)
+        with self._held_lock:
+            self.held_buttons[button] = self.get_token()
+    # _mouse_press
+
+    def _mouse_release(self, button: str) -> None:
+        """Release a mouse button & forget it's held"""
+        self.mouse.release(button)
+        with self._held_lock:
+            self.held_buttons.pop(button, None)
+    # _mouse_release
+
+    def _emit_path(self, points: List[Tuple[int, int]], interval: float, absolute: bool = True) -> None:
+        """Move the mouse thru points, 1 every interval seconds. Each point has its own deadline from the start,
+        so a slow move() never pushes back the rest of the path
+        """
+        token = self.get_token()
+        move = self.mouse.move
+        start = time.perf_counter()
+        for idx, (x, y) in enumerate(points, start=1):
+            if interval:
+                self.timer.sleep_until(start + idx * interval, "MOUSE_MOVE", token)
+            if absolute or x or y:
+                move(x, y, absolute=absolute)
+    # _emit_path
+
+    async def _emit_path_async(self, points: List[Tuple[int, int]], interval: float, absolute: bool = True) -> None:
+        """_emit_path for the asyncio engine"""
+        token = self.get_token()
+        move = self.mouse.move
+        start = time.perf_counter()
+        for idx, (x, y) in enumerate(points, start=1):
+            if interval:
+                await self.timer.sleep_until_async(start + idx * interval, "MOUSE_MOVE", token)
+            if absolute or x or y:
+                move(x, y, absolute=absolute)
+    # _emit_path_async
+
+    def _play_event(self, kind: int, a: int, b: int) -> None:
+        """Replay 1 recorded mouse event"""
+        if kind == MOVE:
+            self.mouse.move(a, b)
+        elif kind == DOWN:
+            self._mouse_press(BUTTONS[a])
+        elif kind == UP:
+            self._mouse_release(BUTTONS[a])
+        else:
+            self.mouse.wheel(a / WHEEL_UNIT)
+    # _play_event
+
+    def _release_recording(self, kinds: Tuple[int, ...], xs: Tuple[int, ...], token: Optional[CancelToken]) -> None:
+        """Release the buttons a recording pressed & is still holding once it's done (it was stopped mid click)"""
+        pressed = {BUTTONS[a] for kind, a in zip(kinds, xs) if kind == DOWN}
+        with self._held_lock:
+            buttons = [b for b in pressed if b in self.held_buttons and self.held_buttons[b] is token]
+        for button in buttons:
+            self._mouse_release(button)
+    # _release_recording
+
+    def _write(self, text: str, pacing: float = 0) -> None:
+        """Type text, with pacing seconds between characters (checking for cancel between them)"""
+        token = self.get_token()
+        if not pacing:
+            if token is not None:
+                token.check()
+            self.output.write(text)
+            return
+        for char in text:
+            if token is not None:
+                token.check()
+            self.output.write(char)
+            self.timer.sleep(pacing, "KB_PACING", token)
+    # _write
+
+    async def _write_async(self, text: str, pacing: float = 0) -> None:
+        """_write for the asyncio engine, awaits between characters"""
+        if not pacing:
+            self._write(text)
+            return
+        token = self.get_token()
+        for char in text:
+            if token is not None:
+                token.check()
+            self.output.write(char)
+            await self.timer.sleep_async(pacing, "KB_PACING", token)
+    # _write_async
+
+    def release_held(self, token: Optional[CancelToken] = None) -> None:
+        """Release held keys / mouse buttons
+        Params:
+            token - Optional[CancelToken] [None], only release what that macro pressed. None releases everything
+        """
+        with self._held_lock:
+            keys = [k for k, owner in self.held_keys.items() if token is None or owner is token]
+            buttons = [b for b, owner in self.held_buttons.items() if token is None or owner is token]
+            for key in keys:
+                del self.held_keys[key]
+            for button in buttons:
+                del self.held_buttons[button]
+        for key in keys:
+            try:
+                self.output.release(key)
+            except Exception as e:
+                print(f"Failed to release {key}: {e}")
+        for button in buttons:
+            try:
+                self.mouse.release(button)
+            except Exception as e:
+                print(f"Failed to release mouse {button}: {e}")
+        if self.verbose and (keys or buttons):
+            print(f"Released held keys: {keys}, mouse buttons: {buttons}")
+    # release_held
+
     # TODO: Create another wrapper for logging actions
     def set_delay(func):
-        """wrapper function that sets the default delay if none has been set"""
-        def outware(*args, **kwargs):
-            self = args[0]
-            _arg_delay = None
-            # Set the default delay if the func param doesn't use it
-            if "delay" in kwargs:
-                _arg_delay = kwargs["delay"]
-            _delay = _arg_delay if _arg_delay else self.default_delay
-            func(*args)  # TODO: FIX pass delay to the func
+        """wrapper function that sets the default delay if none has been set
+        (delay can be passed by position or keyword, None / missing means use self.default_delay)
+        """
+        # Position of the delay param, not counting self
+        _delay_idx = list(inspect.signature(func).parameters).index("delay") - 1
+
+        @wraps(func)
+        def outware(self, *args, **kwargs):
+            if len(args) > _delay_idx:
+                if args[_delay_idx] is None:
+                    args = args[:_delay_idx] + (self.default_delay,) + args[_delay_idx + 1:]
+            elif kwargs.get("delay") is None:
+                kwargs["delay"] = self.default_delay
+            return func(self, *args, **kwargs)
         return outware
 
-    def _parse_loopers(self) -> dict:
+    def build_loopers(self, config: Config, keep: Dict[str, StringLooper] = None) -> dict:
         """parse config json to create string loopers
         (Instantiates StringLooper objects)
+        Params:
+            config - Config, config to get ACTIONS & DATA from
+            keep - Dict[str, StringLooper] [None], existing loopers. Reused (keeping their position) if their DATA list
+                   (or DATA FILE) didn't change
         Returns:
             dict[str, StringLooper]
         """
-        # TODO: fix the exception handling! make it return an error instead of raising here
         _looper = {}
-        # TODO: redocument / cleanup
+        keep = keep or {}
+        data_dir = config.get_data_dir()
 
         # Go thru all actions, find the ones with loopers, and instantiate StringLoopers from that
-        for _action_name, _action_item in self.config.actions.items():
+        # Bad steps / missing DATA are skipped here, compile_actions reports them
+        for _action_name, _action_item in config.actions.items():
+            if not isinstance(_action_item, list):
+                continue
             # For the actual action within the _action_item list
             for _action in _action_item:
+                if not isinstance(_action, dict) or len(_action) != 1:
+                    continue
                 func_name, func_value = next(iter(_action.items()))
                 if func_name in ActionManager.LOOPER_ACTIONS:
                     # Found a looper!
-
-                    # Check func_value, make sure that exists within config.DATA
-                    if func_value not in self.config.data.keys():
-                        raise Exception(f"Failed to find {func_value} in {self.config.data}")
-
-                    _looper[func_value] = StringLooper(self.config.data[func_value])
+                    if not isinstance(func_value, str) or func_value not in config.data:
+                        continue
+                    if func_value in _looper:
+                        continue
+                    _value = config.data[func_value]
+                    _old = keep.get(func_value)
+                    _strings = _options = None
+                    try:
+                        if _old is not None and is_same_data(_old.strings, _value, data_dir):
+                            _strings = _old.strings
+                        else:
+                            # Inline lists as is, {"FILE": path} entries are memory-mapped
+                            _strings = load_data(_value, data_dir)
+                        _options = self._parse_looper_options(_value, data_dir, _old)
+                        _new = StringLooper(_strings, name=func_value, **_options)
+                        if _old is not None and _old.strings is _strings and _old.same_options(_new):
+                            _looper[func_value] = _old
+                            continue
+                        if self.looper_state is not None:
+                            # Pick up where the last run (or the looper this replaces) left off
+                            _new.pos = self.looper_state.get(func_value, len(_strings))
+                        # Build the RANDOM tables now instead of on the 1st press, bad WEIGHTS show up here too
+                        _new.prepare()
+                    except (OSError, ValueError) as e:
+                        print(f"Failed to load DATA {func_value}: {e}")
+                        # Unmap the files just opened for it, the ones _old still reads stay open
+                        _kept = [id(mapped) for mapped in _old.get_mapped()] if _old is not None else []
+                        for _data in (_strings, (_options or {}).get("weights")):
+                            if isinstance(_data, MappedLines) and id(_data) not in _kept:
+                                _data.close()
+                        continue
+                    _looper[func_value] = _new
 
         if self.verbose:
             print("loopers:")
@@ -93,81 +534,186 @@ class ActionManager():
 
         # Return new dict
         return _looper
-    # _parse_loopers
+    # build_loopers
+
+    def _parse_looper_options(self, value: Any, data_dir: str, old: StringLooper = None) -> Dict[str, Any]:
+        """Get the StringLooper options (RANDOM, NO_REPEAT, WEIGHTS) of a DATA entry
+        Params:
+            value - Any, the DATA entry, only {"ITEMS" / "FILE": ..., "RANDOM": ...} style entries have options
+            data_dir - str, relative FILE paths are relative to this
+            old - StringLooper [None], looper this replaces, its WEIGHTS FILE is reused if it didn't change
+        Returns:
+            Dict[str, Any], kwargs for StringLooper
+        Raises:
+            ValueError if an option is invalid, OSError if the WEIGHTS FILE can't be opened
+        """
+        if not isinstance(value, dict):
+            return {}
+        options = {
+            "mode": value.get("RANDOM", "UNIFORM"),
+            "no_repeat": value.get("NO_REPEAT", 0),
+        }
+        weights = value.get("WEIGHTS")
+        if isinstance(weights, list):
+            if not all(isinstance(w, (int, float)) and not isinstance(w, bool) and w >= 0 for w in weights):
+                raise ValueError(f"Expected WEIGHTS to be numbers >= 0, got {weights!r}")
+            options["weights"] = weights
+        elif old is not None and old.weights is not None and is_same_data(old.weights, weights, data_dir):
+            options["weights"] = old.weights
+        elif weights is not None:
+            # {"FILE": path}, 1 weight per line. Memory-mapped too, read once when the alias table is built
+            options["weights"] = load_data(weights, data_dir)
+        return options
+    # _parse_looper_options
+
+    def _save_pos(self, looper: StringLooper) -> None:
+        """Save a looper's new position (in the background, see LooperStateStore)"""
+        if self.looper_state is not None:
+            self.looper_state.record(looper.name, looper.pos)
+    # _save_pos
+
+    def close(self) -> None:
+        """Shutting down: close the output backend, write the looper positions that haven't been saved yet
+        & unmap the DATA FILEs
+        """
+        self.output.close()
+        if self.looper_state is not None:
+            self.looper_state.close()
+        for looper in self.loopers.values():
+            for mapped in looper.get_mapped():
+                mapped.close()
+    # close
+
+    def _send_looper(self, looper: StringLooper, moved: str, pacing: float = 0) -> None:
+        """Save a looper's new position & write its string
+        Params:
+            looper - StringLooper, the looper that moved
+            moved - str, how it moved, for verbosity (e.g. loop_up)
+            pacing - float [0], seconds between characters
+        """
+        self._save_pos(looper)
+        if self.verbose:
+            print(
+                f"{moved}: {looper.get_str()}, list: {looper.name}")
+        self._write(looper.get_str(), pacing)
+    # _send_looper
 
-    def do_kb_loop_up(self, data_name: List[str]):
-        """TODO: document"""
-        self.loopers[data_name].loop_up()
+    async def _send_looper_async(self, looper: StringLooper, moved: str, pacing: float = 0) -> None:
+        """_send_looper for the asyncio engine"""
+        self._save_pos(looper)
         if self.verbose:
             print(
-                f"loop_up: {self.loopers[data_name].get_str()}, list: {data_name}")
-        keyboard.write(self.loopers[data_name].get_str())
+                f"{moved}: {looper.get_str()}, list: {looper.name}")
+        await self._write_async(looper.get_str(), pacing)
+    # _send_looper_async
+
+    def do_kb_loop_up(self, looper: StringLooper, pacing: float = 0):
+        """Loop up thru a DATA list & write the string
+        Params:
+            looper - StringLooper, the looper for the DATA list (bound by compile_step)
+            pacing - float [0], seconds between characters
+        """
+        looper.loop_up()
+        self._send_looper(looper, "loop_up", pacing)
     # do_kb_loop_up
 
-    def _press_and_hold(self, keys: List[str], delay: float = None):
-        """Takes a list of keys to hold at the same time
+    async def do_kb_loop_up_async(self, looper: StringLooper, pacing: float = 0):
+        """do_kb_loop_up for the asyncio engine"""
+        looper.loop_up()
+        await self._send_looper_async(looper, "loop_up", pacing)
+    # do_kb_loop_up_async
+
+    def do_kb_loop_down(self, looper: StringLooper, pacing: float = 0):
+        """Loop down thru a DATA list & write the string
         Params:
-            keys - List[str], list of keys to hold simultaneously
-            delay - float, how long in seconds to hold the keys down. Default to self.default_delay
+            looper - StringLooper, the looper for the DATA list (bound by compile_step)
+            pacing - float [0], seconds between characters
         """
-        # Press all keys down
-        for key in keys:
-            # If we are sending a string, use write instead
-            if key.startswith("TXT="):
-                keyboard.write(key[4:])
-                time.sleep(delay)
-            else:
-                keyboard.press(key)
-        # Wait
-        time.sleep(delay)
-        # Release all keys
-        for key in keys:
-            # Ignore if sending a string
-            if not key.startswith("TXT="):
-                keyboard.release(key)
-    # _press_and_hold
+        looper.loop_down()
+        self._send_looper(looper, "loop_down", pacing)
+    # do_kb_loop_down
+
+    async def do_kb_loop_down_async(self, looper: StringLooper, pacing: float = 0):
+        """do_kb_loop_down for the asyncio engine"""
+        looper.loop_down()
+        await self._send_looper_async(looper, "loop_down", pacing)
+    # do_kb_loop_down_async
+
+    def do_kb_loop_rand(self, looper: StringLooper, pacing: float = 0):
+        """Pick a random string from a DATA list (see StringLooper.RANDOM_MODES) & write it
+        Params:
+            looper - StringLooper, the looper for the DATA list (bound by compile_step)
+            pacing - float [0], seconds between characters
+        """
+        looper.loop_rand()
+        self._send_looper(looper, "loop_rand", pacing)
+    # do_kb_loop_rand
+
+    async def do_kb_loop_rand_async(self, looper: StringLooper, pacing: float = 0):
+        """do_kb_loop_rand for the asyncio engine"""
+        looper.loop_rand()
+        await self._send_looper_async(looper, "loop_rand", pacing)
+    # do_kb_loop_rand_async
 
     @set_delay
     def do_delay(self, delay: float = None):
-        """Run time.sleep for delay, or default delay"""
-        time.sleep(delay)
+        """Sleep for delay, or default delay (see ActionTimer)"""
+        self.timer.sleep(delay, "DELAY", self.get_token())
     # do_delay
 
     @set_delay
-    def do_kb_send_hotkey(self, hotkey: List[str], delay: float = 0.2):
+    async def do_delay_async(self, delay: float = None):
+        """do_delay for the asyncio engine"""
+        await self.timer.sleep_async(delay, "DELAY", self.get_token())
+    # do_delay_async
+
+    @set_delay
+    def do_kb_send_hotkey(self, hotkey: List[str], delay: float = None):
         """Takes a list of keys and holds at the same time
         Params:
             keys - List[str], list of keys to hold simultaneously
-            delay - float, how long in seconds to hold the keys down. Default to 0.2s
+            delay - float, how long in seconds to hold the keys down. Default to self.default_delay
         """
         # Press all keys down
-        for key in hotkey:
-            keyboard.press(key)
+        self._press_keys(hotkey)
 
         # Wait
         if delay:
-            time.sleep(delay)
+            self.timer.sleep(delay, "KB_SEND_HOTKEY", self.get_token())
 
         # Release all keys
-        for key in hotkey:
-            keyboard.release(key)
+        self._release_keys(hotkey)
     # do_kb_send_hotkey
 
     @set_delay
-    def do_kb_send_str(self, string_to_send: str, delay: float = None):
+    async def do_kb_send_hotkey_async(self, hotkey: List[str], delay: float = None):
+        """do_kb_send_hotkey for the asyncio engine"""
+        self._press_keys(hotkey)
+        if delay:
+            await self.timer.sleep_async(delay, "KB_SEND_HOTKEY", self.get_token())
+        self._release_keys(hotkey)
+    # do_kb_send_hotkey_async
+
+    def do_kb_send_str(self, string_to_send: str, pacing: float = 0):
         """Write string_to_send using the keyboard
         Params:
             string_to_send - str, The string to write with the keyboard
+            pacing - float [0], seconds between characters. 0 lets the backend send it all at once
         """
-        keyboard.write(string_to_send, delay)
+        self._write(string_to_send, pacing)
     # do_kb_send_str
 
+    async def do_kb_send_str_async(self, string_to_send: str, pacing: float = 0):
+        """do_kb_send_str for the asyncio engine"""
+        await self._write_async(string_to_send, pacing)
+    # do_kb_send_str_async
+
     def do_kb_key_press(self, key_to_press: str):
         """Press and release a keyboard button
         Params:
             key_to_press - str, The keyboard button to press and release
         """
-        keyboard.press_and_release(key_to_press)
+        self.output.press_and_release(key_to_press)
     # do_kb_key_press
 
     def do_kb_key_down(self, key_to_press: str):
@@ -175,7 +721,7 @@ class ActionManager():
         Params:
             key_to_press - str, The keyboard button to press
         """
-        keyboard.press(key_to_press)
+        self._press(key_to_press)
     # do_kb_key_down
 
     def do_kb_key_up(self, key_to_release: str):
@@ -183,5 +729,153 @@ class ActionManager():
         Params:
             key_to_release - str, The keyboard button to release
         """
-        keyboard.release(key_to_release)
+        self._release(key_to_release)
     # do_kb_key_up
+
+    def do_page_step(self, name: str):
+        """PAGE_TO / PAGE_TOGGLE / PAGE_MOMENTARY step. The page already switched when the button was pressed
+        (PageManager.resolve / press), before the macro was queued, so there's nothing left to do.
+        Run on its own (run_action(action_name=...)) it's do_page_switch instead
+        Params:
+            name - str, PAGES name
+        """
+        pass
+    # do_page_step
+
+    def do_page_switch(self, action: str, name: str):
+        """Run a PAGE_* action on its own (run_action(action_name=...)), no button was resolved so switch here
+        Params:
+            action - str, PAGE_TO, PAGE_TOGGLE or PAGE_MOMENTARY
+            name - str, PAGES name
+        Raises:
+            ValueError if name isn't in PAGES
+        """
+        if name not in self.pages.pages:
+            raise ValueError(f"{action}: {name!r} isn't in PAGES")
+        if action == "PAGE_TO":
+            self.pages.switch(name)
+        elif action == "PAGE_TOGGLE":
+            self.pages.toggle(name)
+        else:
+            self.pages.hold(name)
+    # do_page_switch
+
+    def do_mouse_click(self, button: str):
+        """Click a mouse button
+        Params:
+            button - str, left, right, middle, x or x2
+        """
+        self.mouse.click(button)
+    # do_mouse_click
+
+    def do_mouse_down(self, button: str):
+        """Press down a mouse button
+        Params:
+            button - str, left, right, middle, x or x2
+        """
+        self._mouse_press(button)
+    # do_mouse_down
+
+    def do_mouse_up(self, button: str):
+        """Release a mouse button
+        Params:
+            button - str, left, right, middle, x or x2
+        """
+        self._mouse_release(button)
+    # do_mouse_up
+
+    def do_mouse_move_to(self, x: int, y: int, fractions: Tuple[float, ...], interval: float):
+        """Move the mouse to x, y along a precomputed eased path
+        Params:
+            x - int, screen x to move to
+            y - int, screen y to move to
+            fractions - Tuple[float, ...], how far along the path each point is (bound by compile_step)
+            interval - float, seconds between points
+        """
+        self._emit_path(scale_path(self.mouse.get_position(), (x, y), fractions), interval)
+    # do_mouse_move_to
+
+    async def do_mouse_move_to_async(self, x: int, y: int, fractions: Tuple[float, ...], interval: float):
+        """do_mouse_move_to for the asyncio engine"""
+        await self._emit_path_async(scale_path(self.mouse.get_position(), (x, y), fractions), interval)
+    # do_mouse_move_to_async
+
+    def do_mouse_move_by(self, xs: Tuple[int, ...], ys: Tuple[int, ...], interval: float):
+        """Move the mouse by precomputed relative moves
+        Params:
+            xs - Tuple[int, ...], pixels right for each point (bound by compile_step)
+            ys - Tuple[int, ...], pixels down for each point
+            interval - float, seconds between points
+        """
+        self._emit_path(list(zip(xs, ys)), interval, absolute=False)
+    # do_mouse_move_by
+
+    async def do_mouse_move_by_async(self, xs: Tuple[int, ...], ys: Tuple[int, ...], interval: float):
+        """do_mouse_move_by for the asyncio engine"""
+        await self._emit_path_async(list(zip(xs, ys)), interval, absolute=False)
+    # do_mouse_move_by_async
+
+    def do_mouse_drag(self, button: str, start: Optional[Tuple[int, int]], x: int, y: int,
+                      fractions: Tuple[float, ...], interval: float):
+        """Hold a mouse button while moving the mouse to x, y. Released even if the macro is cancelled (release_held)
+        Params:
+            button - str, left, right, middle, x or x2
+            start - Optional[Tuple[int, int]], jump here first, None drags from where the mouse is
+            x - int, screen x to drag to
+            y - int, screen y to drag to
+            fractions - Tuple[float, ...], how far along the path each point is (bound by compile_step)
+            interval - float, seconds between points
+        """
+        if start is not None:
+            self.mouse.move(*start)
+        points = scale_path(start or self.mouse.get_position(), (x, y), fractions)
+        self._mouse_press(button)
+        self._emit_path(points, interval)
+        self._mouse_release(button)
+    # do_mouse_drag
+
+    async def do_mouse_drag_async(self, button: str, start: Optional[Tuple[int, int]], x: int, y: int,
+                                  fractions: Tuple[float, ...], interval: float):
+        """do_mouse_drag for the asyncio engine"""
+        if start is not None:
+            self.mouse.move(*start)
+        points = scale_path(start or self.mouse.get_position(), (x, y), fractions)
+        self._mouse_press(button)
+        await self._emit_path_async(points, interval)
+        self._mouse_release(button)
+    # do_mouse_drag_async
+
+    def do_mouse_playback(self, start: Tuple[int, int], times: Tuple[float, ...], kinds: Tuple[int, ...],
+                          xs: Tuple[int, ...], ys: Tuple[int, ...]):
+        """Replay a mouse recording with its original timing. Every event has its own deadline from the start,
+        so the timing doesn't drift over long recordings. Held buttons are released if it's cancelled (release_held),
+        or once it's done if the recording ended with them down
+        Params:
+            start - Tuple[int, int], (x, y) the recording starts at
+            times - Tuple[float, ...], seconds after the start of each event (decoded by compile_step)
+            kinds - Tuple[int, ...], MOVE, DOWN, UP or WHEEL
+            xs - Tuple[int, ...], x for MOVE, button for DOWN / UP, wheel delta for WHEEL
+            ys - Tuple[int, ...], y for MOVE
+        """
+        token = self.get_token()
+        sleep_until = self.timer.sleep_until
+        self.mouse.move(*start)
+        t0 = time.perf_counter()
+        for t, kind, a, b in zip(times, kinds, xs, ys):
+            sleep_until(t0 + t, "MOUSE_PLAYBACK", token)
+            self._play_event(kind, a, b)
+        self._release_recording(kinds, xs, token)
+    # do_mouse_playback
+
+    async def do_mouse_playback_async(self, start: Tuple[int, int], times: Tuple[float, ...], kinds: Tuple[int, ...],
+                                      xs: Tuple[int, ...], ys: Tuple[int, ...]):
+        """do_mouse_playback for the asyncio engine"""
+        token = self.get_token()
+        sleep_until = self.timer.sleep_until_async
+        self.mouse.move(*start)
+        t0 = time.perf_counter()
+        for t, kind, a, b in zip(times, kinds, xs, ys):
+            await sleep_until(t0 + t, "MOUSE_PLAYBACK", token)
+            self._play_event(kind, a, b)
+        self._release_recording(kinds, xs, token)
+    # do_mouse_playback_async
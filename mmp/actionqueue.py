@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+# actionqueue.py - Queue + worker threads that run macros so the serial reader never waits on them
+import queue
+import threading
+
+from typing import Callable, Dict, List, Optional
+
+from mmp.macromanager import MacroManager
+from mmp.canceltoken import CancelToken
+from mmp.tracer import TRACER
+
+
+class ActionQueue():
+    """Bounded queue of button presses with worker threads running the macros.
+    The serial reader only calls submit(), which never blocks.
+    Per button policies:
+        SERIALIZE - run every press, one after another
+        COALESCE - presses while one is already waiting in the queue are merged into it
+        DROP - presses while the macro is waiting or running are dropped
+        RESTART - cancel the running macro and start it again
+    Params:
+        macro_manager - MacroManager, runs the actual actions
+        size - int [32], max presses waiting in the queue, extra presses are dropped
+        workers - int [1], how many worker threads run macros
+        default_policy - str ["SERIALIZE"], policy for buttons not in policies
+        policies - Dict[str, str] [None], ACTIONS name to policy
+        on_done - Callable[[int], None] [None], called with the position once its macro finished
+        verbose - bool [False], verbosity
+    Methods:
+        start
+        submit
+        stop
+    """
+    POLICIES: List[str] = ["SERIALIZE", "COALESCE", "DROP", "RESTART"]
+
+    def __init__(self, macro_manager: MacroManager, size: int = 32, workers: int = 1,
+                 default_policy: str = "SERIALIZE", policies: Dict[str, str] = None,
+                 on_done: Callable[[int], None] = None, verbose: bool = False):
+        """Create ActionQueue, call start() to run the workers"""
+        self.verbose: bool = verbose
+        self.macro_manager: MacroManager = macro_manager
+        self.on_done: Optional[Callable[[int], None]] = on_done
+        self.num_workers: int = max(1, workers)
+        self.default_policy: str = self._check_policy(default_policy)
+        self.policy_names: Dict[str, str] = {
+            name: self._check_policy(policy) for name, policy in (policies or {}).items()
+        }
+        self.policies: Dict[int, str] = {}
+        self.refresh_policies()
+
+        self.size: int = size
+        self._queue: queue.Queue = queue.Queue(maxsize=size)
+        self._lock: threading.Lock = threading.Lock()
+        # position -> presses waiting in the queue
+        self._pending: Dict[int, int] = {}
+        # position -> cancel token of the running macro
+        self._running: Dict[int, CancelToken] = {}
+        # position -> lock so the same button never runs on 2 workers at once
+        self._button_locks: Dict[int, threading.Lock] = {}
+        self._workers: List[threading.Thread] = []
+
+        self.dropped: int = 0
+        self.coalesced: int = 0
+
+        # Button positions / policies can change when the config file is reloaded
+        self.macro_manager.reload_listeners.append(self._on_reload)
+        # Drop queued presses on panic
+        self.macro_manager.panic_listeners.append(self.clear)
+    # __init__
+
+    @classmethod
+    def from_config(cls, macro_manager: MacroManager, on_done: Callable[[int], None] = None) -> "ActionQueue":
+        """Create an ActionQueue using CONFIG.QUEUE (every key is optional)
+        Params:
+            macro_manager - MacroManager, runs the actual actions
+            on_done - Callable[[int], None] [None], called with the position once its macro finished
+        Returns:
+            ActionQueue
+        """
+        _cfg = macro_manager.config.config.get("QUEUE", {})
+        return cls(
+            macro_manager,
+            size=_cfg.get("SIZE", 32),
+            workers=_cfg.get("WORKERS", 1),
+            default_policy=_cfg.get("POLICY", "SERIALIZE"),
+            policies=_cfg.get("BUTTON_POLICIES", {}),
+            on_done=on_done,
+            verbose=macro_manager.verbose,
+        )
+    # from_config
+
+    def _check_policy(self, policy: str) -> str:
+        """Make sure policy is in POLICIES
+        Returns:
+            str, upper case policy
+        """
+        policy = policy.upper()
+        if policy not in ActionQueue.POLICIES:
+            raise Exception(f"Unknown queue policy: {policy}, expected one of {ActionQueue.POLICIES}")
+        return policy
+    # _check_policy
+
+    def _on_reload(self, changed: set) -> None:
+        """Reload listener, re-read CONFIG.QUEUE policies (SIZE / WORKERS need a restart) & remap positions
+        Params:
+            changed - set, changed config sections
+        """
+        if "CONFIG" in changed:
+            _cfg = self.macro_manager.config.config.get("QUEUE", {})
+            try:
+                default_policy = self._check_policy(_cfg.get("POLICY", "SERIALIZE"))
+                policy_names = {
+                    name: self._check_policy(policy) for name, policy in _cfg.get("BUTTON_POLICIES", {}).items()
+                }
+            except Exception as e:
+                print(e)
+                return
+            self.default_policy = default_policy
+            self.policy_names = policy_names
+        if "CONFIG" in changed or "ACTIONS" in changed:
+            self.refresh_policies()
+    # _on_reload
+
+    def refresh_policies(self) -> None:
+        """Map policy_names (ACTIONS names) to button positions. Call after ACTIONS changed"""
+        self.policies = {
+            idx: self.policy_names.get(name, self.default_policy)
+            for idx, name in enumerate(self.macro_manager.config.actions.keys(), start=1)
+        }
+    # refresh_policies
+
+    def start(self) -> None:
+        """Start the worker threads"""
+        for i in range(self.num_workers):
+            worker = threading.Thread(target=self._work, name=f"mmp-action-{i}", daemon=True)
+            worker.start()
+            self._workers.append(worker)
+    # start
+
+    def clear(self) -> None:
+        """Drop every press waiting in the queue"""
+        with self._lock:
+            stops = 0
+            while True:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    stops += 1
+                    continue
+                self._pending[item[0]] -= 1
+                self.dropped += 1
+            # Keep stop() requests
+            for _ in range(stops):
+                self._queue.put_nowait(None)
+    # clear
+
+    def stop(self) -> None:
+        """Cancel running macros, drop the waiting presses, release held keys & tell the workers to quit"""
+        with self._lock:
+            for cancel in self._running.values():
+                cancel.cancel()
+        # Nothing waiting runs during shutdown, & there's room for every worker's sentinel
+        self.clear()
+        for _ in self._workers:
+            # Blocks only if presses came in since clear(), the workers make room
+            self._queue.put(None)
+        self.macro_manager.action_manager.release_held()
+    # stop
+
+    def submit(self, position: int, t_recv: int = 0, t_decode: int = 0) -> bool:
+        """Queue a button press, never blocks.
+        Params:
+            position - int, 1 indexed button position
+            t_recv - int [0], TRACER timestamp of when the serial bytes were read
+            t_decode - int [0], TRACER timestamp of when the press was decoded
+        Returns:
+            bool, False if the press was dropped or merged into one that's already waiting
+        """
+        policy = self.policies.get(position, self.default_policy)
+        with self._lock:
+            pending = self._pending.get(position, 0)
+            running = self._running.get(position)
+
+            if policy == "COALESCE" and pending > 0:
+                self.coalesced += 1
+                if self.verbose:
+                    print(f"Coalesced press for {position}")
+                return False
+            if policy == "DROP" and (pending > 0 or running is not None):
+                self.dropped += 1
+                if self.verbose:
+                    print(f"Dropped press for {position}, macro is busy")
+                return False
+            if policy == "RESTART":
+                if running is not None:
+                    running.cancel()
+                if pending > 0:
+                    # The press that's already waiting will be the restart
+                    return False
+
+            try:
+                self._queue.put_nowait((position, t_recv, t_decode))
+            except queue.Full:
+                self.dropped += 1
+                print(f"Action queue is full, dropped press for {position}")
+                return False
+            self._pending[position] = pending + 1
+        return True
+    # submit
+
+    def _work(self) -> None:
+        """Worker thread loop, run macros from the queue until stop() is called"""
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            position, t_recv, t_decode = item
+
+            with self._lock:
+                self._pending[position] -= 1
+                button_lock = self._button_locks.setdefault(position, threading.Lock())
+
+            with button_lock:
+                cancel = CancelToken()
+                with self._lock:
+                    self._running[position] = cancel
+                t_dispatch = TRACER.now() if TRACER.enabled else 0
+                try:
+                    self.macro_manager.run_action(position=position, cancel=cancel)
+                    if TRACER.enabled:
+                        TRACER.done(position, t_recv, t_decode, t_dispatch)
+                except Exception as e:
+                    print(f"Failed to run action at pos: {position}")
+                    print(e)
+                finally:
+                    with self._lock:
+                        self._running.pop(position, None)
+
+            if self.on_done is not None and not cancel.is_set():
+                self.on_done(position)
+    # _work
+
+# ActionQueue
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+# actiontimer.py - High precision sleeps for action delays / holds
+import asyncio
+import sys
+import time
+
+from mmp.canceltoken import CancelToken
+from mmp.tracer import TRACER
+
+# Most the asyncio sleeps may spin, the spin blocks every other task on the loop
+ASYNC_SPIN_MAX: float = 0.0005
+
+
+class ActionTimer():
+    """Sleeps with time.sleep until close to the target, then spins on perf_counter for the last stretch.
+    time.sleep can overshoot by a few ms (up to ~15ms on Windows), spinning gets sub-millisecond accuracy.
+    How far each sleep drifted from its target is kept in last_drift, and in the TRACER "drift:<name>" histograms.
+    Params:
+        spin - float [None], seconds to spin at the end of each sleep. Default 0.002, 0.016 on Windows
+    Methods:
+        sleep
+        sleep_until
+        sleep_async
+        sleep_until_async
+    """
+
+    def __init__(self, spin: float = None):
+        """Create ActionTimer"""
+        if spin is None:
+            spin = 0.016 if sys.platform.startswith("win") else 0.002
+        self.spin: float = max(0.0, spin)
+        # Seconds the last sleep ended after its target
+        self.last_drift: float = 0.0
+    # __init__
+
+    def sleep(self, seconds: float, name: str = "sleep", cancel: CancelToken = None) -> float:
+        """Sleep for seconds
+        Params:
+            seconds - float, how long to sleep
+            name - str ["sleep"], what this sleep is for (e.g. DELAY), for the drift histogram
+            cancel - CancelToken [None], wake up & raise MacroCancelled as soon as it's cancelled
+        Returns:
+            float, drift in seconds (how late it woke up)
+        """
+        return self.sleep_until(time.perf_counter() + seconds, name, cancel)
+    # sleep
+
+    def sleep_until(self, deadline: float, name: str = "sleep", cancel: CancelToken = None) -> float:
+        """Sleep until time.perf_counter() reaches deadline
+        Params:
+            deadline - float, time.perf_counter() value to wake up at
+            name - str ["sleep"], what this sleep is for (e.g. DELAY), for the drift histogram
+            cancel - CancelToken [None], wake up & raise MacroCancelled as soon as it's cancelled
+        Returns:
+            float, drift in seconds (how late it woke up)
+        Raises:
+            MacroCancelled if cancel was cancelled before / while sleeping
+        """
+        coarse = deadline - time.perf_counter() - self.spin
+        if cancel is None:
+            if coarse > 0:
+                time.sleep(coarse)
+            now = time.perf_counter()
+            while now < deadline:
+                now = time.perf_counter()
+        else:
+            if coarse > 0:
+                cancel.wait(coarse)
+            now = time.perf_counter()
+            while now < deadline and not cancel.is_set():
+                now = time.perf_counter()
+            cancel.check()
+
+        return self._done(now, deadline, name)
+    # sleep_until
+
+    async def sleep_async(self, seconds: float, name: str = "sleep", cancel: CancelToken = None) -> float:
+        """sleep for the asyncio engine, other tasks run while it waits"""
+        return await self.sleep_until_async(time.perf_counter() + seconds, name, cancel)
+    # sleep_async
+
+    async def sleep_until_async(self, deadline: float, name: str = "sleep", cancel: CancelToken = None) -> float:
+        """sleep_until for the asyncio engine. Awaits asyncio.sleep, then spins for at most ASYNC_SPIN_MAX seconds,
+        since the spin blocks the loop. Drift is higher than sleep_until, especially on Windows.
+        Cancel the task to wake it up right away, cancel is checked once it's done
+        """
+        coarse = deadline - time.perf_counter() - min(self.spin, ASYNC_SPIN_MAX)
+        if coarse > 0:
+            await asyncio.sleep(coarse)
+        now = time.perf_counter()
+        spin_until = min(deadline, now + ASYNC_SPIN_MAX)
+        while now < spin_until:
+            now = time.perf_counter()
+        if cancel is not None:
+            cancel.check()
+        return self._done(now, deadline, name)
+    # sleep_until_async
+
+    def _done(self, now: float, deadline: float, name: str) -> float:
+        """Keep & trace the drift of a sleep that just ended"""
+        self.last_drift = now - deadline
+        if TRACER.enabled:
+            TRACER.record(f"drift:{name}", int(self.last_drift * 1e9))
+        return self.last_drift
+    # _done
+
+# ActionTimer
@@ -0,0 +1,330 @@
+#!/usr/bin/env python3
+# asynccore.py - asyncio engine: serial reading, macros, delays & timed events on 1 event loop
+import asyncio
+import signal
+import threading
+
+from functools import partial
+from typing import Dict, Optional, Set, TYPE_CHECKING
+
+from mmp.actionqueue import ActionQueue
+from mmp.canceltoken import CancelToken
+from mmp.macropadcore import BaseMacroPadCore
+from mmp.tracer import TRACER
+
+if TYPE_CHECKING:
+    from tkinter import Tk
+
+
+class AsyncActionQueue(ActionQueue):
+    """ActionQueue for the asyncio engine: every press is a task on the event loop instead of an item for a worker thread.
+    Same policies & CONFIG.QUEUE. WORKERS is how many macros can run at the same time (a semaphore, not threads),
+    SIZE is how many presses can wait for their turn.
+    submit, clear & stop hop over to the loop's thread if they're called from another thread.
+    Methods:
+        start
+        submit
+        clear
+        stop
+        join
+    """
+
+    def __init__(self, *args, **kwargs):
+        """Create AsyncActionQueue, call start() from the event loop"""
+        super().__init__(*args, **kwargs)
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread: Optional[int] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        # position -> lock so the same button never runs twice at once
+        self._button_alocks: Dict[int, asyncio.Lock] = {}
+        # position -> task of the running macro
+        self._running_tasks: Dict[int, asyncio.Task] = {}
+        self._tasks: Set[asyncio.Task] = set()
+        # Tasks that got their turn, the rest are still waiting
+        self._started: Set[asyncio.Task] = set()
+        self._waiting: int = 0
+    # __init__
+
+    def start(self) -> None:
+        """Bind to the running event loop"""
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread = threading.get_ident()
+        self._semaphore = asyncio.Semaphore(self.num_workers)
+    # start
+
+    def _on_loop(self) -> bool:
+        """True if called on the loop's thread"""
+        return threading.get_ident() == self._loop_thread
+    # _on_loop
+
+    def submit(self, position: int, t_recv: int = 0, t_decode: int = 0) -> bool:
+        """Queue a button press, never blocks.
+        Params:
+            position - int, 1 indexed button position
+            t_recv - int [0], TRACER timestamp of when the serial bytes were read
+            t_decode - int [0], TRACER timestamp of when the press was decoded
+        Returns:
+            bool, False if the press was dropped or merged into one that's already waiting
+        """
+        if self._loop is None:
+            print(f"Action queue isn't running, dropped press for {position}")
+            return False
+        if not self._on_loop():
+            self._loop.call_soon_threadsafe(self.submit, position, t_recv, t_decode)
+            return True
+
+        policy = self.policies.get(position, self.default_policy)
+        pending = self._pending.get(position, 0)
+        running = self._running.get(position)
+
+        if policy == "COALESCE" and pending > 0:
+            self.coalesced += 1
+            if self.verbose:
+                print(f"Coalesced press for {position}")
+            return False
+        if policy == "DROP" and (pending > 0 or running is not None):
+            self.dropped += 1
+            if self.verbose:
+                print(f"Dropped press for {position}, macro is busy")
+            return False
+        if policy == "RESTART":
+            if running is not None:
+                running.cancel()
+                self._running_tasks[position].cancel()
+            if pending > 0:
+                # The press that's already waiting will be the restart
+                return False
+
+        if self._waiting >= self.size:
+            self.dropped += 1
+            print(f"Action queue is full, dropped press for {position}")
+            return False
+        self._pending[position] = pending + 1
+        self._waiting += 1
+        task = self._loop.create_task(self._run(position, t_recv, t_decode))
+        self._tasks.add(task)
+        task.add_done_callback(partial(self._task_done, position))
+        return True
+    # submit
+
+    def _task_done(self, position: int, task: asyncio.Task) -> None:
+        """Forget a finished task"""
+        self._tasks.discard(task)
+        if task in self._started:
+            self._started.discard(task)
+        else:
+            # Cancelled while waiting for its turn
+            self._pending[position] -= 1
+            self._waiting -= 1
+    # _task_done
+
+    async def _run(self, position: int, t_recv: int, t_decode: int) -> None:
+        """Wait for the button & a free slot, then run the macro"""
+        cancel = CancelToken()
+        button_lock = self._button_alocks.setdefault(position, asyncio.Lock())
+        async with button_lock, self._semaphore:
+            task = asyncio.current_task()
+            self._started.add(task)
+            self._pending[position] -= 1
+            self._waiting -= 1
+            self._running[position] = cancel
+            self._running_tasks[position] = task
+            t_dispatch = TRACER.now() if TRACER.enabled else 0
+            try:
+                await self.macro_manager.run_action_async(position=position, cancel=cancel)
+                if TRACER.enabled:
+                    TRACER.done(position, t_recv, t_decode, t_dispatch)
+            except Exception as e:
+                print(f"Failed to run action at pos: {position}")
+                print(e)
+            finally:
+                self._running.pop(position, None)
+                self._running_tasks.pop(position, None)
+
+        if self.on_done is not None and not cancel.is_set():
+            self.on_done(position)
+    # _run
+
+    def clear(self) -> None:
+        """Drop every press waiting for its turn & wake up macros whose CancelToken was cancelled (e.g. by panic)"""
+        if self._loop is None:
+            return
+        if not self._on_loop():
+            self._loop.call_soon_threadsafe(self.clear)
+            return
+        for task in self._tasks:
+            if task not in self._started:
+                task.cancel()
+                self.dropped += 1
+        for position, cancel in list(self._running.items()):
+            if cancel.is_set():
+                self._running_tasks[position].cancel()
+    # clear
+
+    def stop(self) -> None:
+        """Cancel every waiting & running macro & release held keys, await join() to wait for them"""
+        if self._loop is None:
+            return
+        if not self._on_loop():
+            self._loop.call_soon_threadsafe(self.stop)
+            return
+        for cancel in self._running.values():
+            cancel.cancel()
+        for task in self._tasks:
+            task.cancel()
+        self.macro_manager.action_manager.release_held()
+    # stop
+
+    async def join(self) -> None:
+        """Wait until every macro task is done"""
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+    # join
+
+# AsyncActionQueue
+
+
+class AsyncMacroPadCore(BaseMacroPadCore):
+    """The core on an asyncio event loop instead of threads (python -m mmp --asyncio), MacroPadCore's counterpart.
+    Serial reading, macros (DELAY / holds / pacing are awaited), config polling & the Tk window all run on 1 loop,
+    so lots of timed macros can run at once without a thread each. Blocking bits (opening ports, loading the
+    config file) run in the loop's default executor.
+    The Tk window (if any) is pumped from the loop every TK_INTERVAL seconds instead of running mainloop().
+    Shutdown: stop() ends run(), which cancels the serial & macro tasks, waits for them & releases held keys.
+    Methods:
+        attach
+        run
+        stop
+        reload
+        handle_gui_press
+    """
+    queue_class = AsyncActionQueue
+    # Seconds between Tk updates, ~120 fps
+    TK_INTERVAL: float = 0.008
+
+    def __init__(self, *args, **kwargs):
+        """Create AsyncMacroPadCore, await run() to run it"""
+        super().__init__(*args, **kwargs)
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._stop_event: Optional[asyncio.Event] = None
+    # __init__
+
+    async def run(self, use_serial: bool = True, tk_root: Optional["Tk"] = None, handle_signals: bool = False) -> None:
+        """Run until stop() is called
+        Params:
+            use_serial - bool [True], False for GUI only mode
+            tk_root - Optional[Tk] [None], Tk window to pump, closing it stops the core
+            handle_signals - bool [False], SIGINT / SIGTERM stop, SIGHUP reloads the config
+        """
+        self._loop = asyncio.get_running_loop()
+        self._stop_event = asyncio.Event()
+        if self._stopped.is_set():
+            # stop() came in before the loop was running
+            return
+
+        self.action_queue.start()
+        tasks = []
+        if self.reload_interval:
+            tasks.append(asyncio.create_task(self._watch_config()))
+        if use_serial:
+            tasks.extend(asyncio.create_task(supervisor.supervise_async()) for supervisor in self.supervisors)
+        if tk_root is not None:
+            tk_root.protocol("WM_DELETE_WINDOW", self.stop)
+            tasks.append(asyncio.create_task(self._pump_tk(tk_root)))
+        if handle_signals:
+            self._add_signal_handlers()
+
+        try:
+            await self._stop_event.wait()
+        finally:
+            # Stop reading first so nothing new comes in, then cancel the macros & wait for all of it
+            for task in tasks:
+                task.cancel()
+            self.action_queue.stop()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            await self.action_queue.join()
+            self.macro_manager.action_manager.release_held()
+            self.macro_manager.close()
+            if tk_root is not None:
+                from tkinter import TclError
+                try:
+                    tk_root.destroy()
+                except TclError:
+                    # Already gone
+                    pass
+    # run
+
+    def stop(self) -> None:
+        """End run(). Safe to call more than once, from any thread & from a signal handler"""
+        if self._stopped.is_set():
+            return
+        self._stopped.set()
+        if self.verbose:
+            print("Stopping")
+        self.config_watcher.stop()
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._stop_event.set)
+    # stop
+
+    def reload(self) -> None:
+        """Load the config file again (in the executor), e.g. on SIGHUP"""
+        if self._loop is not None:
+            self._loop.run_in_executor(None, self.config_watcher.reload)
+    # reload
+
+    def handle_gui_press(self, position: int, do_alt_tab: bool = False) -> None:
+        """Run a button clicked in the GUI through the queue, instead of blocking the loop (MacroDisplay.gui_press_handler)
+        Params:
+            position - int, 1 indexed button position
+            do_alt_tab - bool [False], run alt + tab before the macro
+        """
+        if self._loop is None:
+            return
+        self._loop.create_task(self._gui_press(position, do_alt_tab))
+    # handle_gui_press
+
+    async def _gui_press(self, position: int, do_alt_tab: bool) -> None:
+        """alt + tab back to whatever the user was doing before, then queue the press"""
+        if do_alt_tab:
+            await self.macro_manager.run_action_async(action_name="KB_SEND_HOTKEY", value=["alt", "tab"])
+        self.action_queue.submit(position)
+    # _gui_press
+
+    def _add_signal_handlers(self) -> None:
+        """SIGINT / SIGTERM stop, SIGHUP reloads the config"""
+        def _on_stop_signal(signum: int):
+            print(f"Got {signal.Signals(signum).name}, shutting down")
+            self.stop()
+
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            try:
+                self._loop.add_signal_handler(signum, _on_stop_signal, signum)
+            except NotImplementedError:
+                # Windows event loops can't, stop from a plain handler instead
+                signal.signal(signum, lambda _signum, frame: _on_stop_signal(_signum))
+        if hasattr(signal, "SIGHUP"):
+            self._loop.add_signal_handler(signal.SIGHUP, self.reload)
+    # _add_signal_handlers
+
+    async def _watch_config(self) -> None:
+        """Poll the config file every RELOAD_INTERVAL seconds, loading it in the executor"""
+        while True:
+            await asyncio.sleep(self.reload_interval)
+            await self._loop.run_in_executor(None, self.config_watcher.check)
+    # _watch_config
+
+    async def _pump_tk(self, tk_root: "Tk") -> None:
+        """Handle Tk events every TK_INTERVAL seconds, instead of Tk's mainloop"""
+        from tkinter import TclError
+
+        while True:
+            try:
+                tk_root.update()
+            except TclError:
+                # Window is gone
+                self.stop()
+                return
+            await asyncio.sleep(AsyncMacroPadCore.TK_INTERVAL)
+    # _pump_tk
+
+# AsyncMacroPadCore
@@ -0,0 +1,288 @@
+#!/usr/bin/env python3
+# benchmark.py - Headless benchmark of the serial -> macro path, using a fake serial device & keyboard
+# Run with: python -m mmp.benchmark --help
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+
+from argparse import ArgumentParser
+from collections import deque
+from typing import Deque, Dict, List, Tuple
+
+from mmp.actionqueue import ActionQueue
+from mmp.macromanager import MacroManager
+from mmp.minimacropad import arduino_listen_loop
+from mmp.outputbackend import RecordingBackend
+from mmp.tracer import TRACER, LatencyHistogram
+
+
+class LoopbackSerial():
+    """In memory stand in for serial.Serial. The benchmark writes "device" bytes with feed(),
+    arduino_listen_loop reads them with read() / in_waiting like a real port.
+    Params:
+        timeout - float [0.1], read timeout in seconds (like SERIAL.TIMEOUT)
+    """
+
+    def __init__(self, timeout: float = 0.1):
+        self.timeout: float = timeout
+        self._buf: bytearray = bytearray()
+        self._cond: threading.Condition = threading.Condition()
+    # __init__
+
+    @property
+    def in_waiting(self) -> int:
+        """Bytes waiting to be read"""
+        with self._cond:
+            return len(self._buf)
+    # in_waiting
+
+    def feed(self, data: bytes) -> None:
+        """Send bytes from the fake device"""
+        with self._cond:
+            self._buf.extend(data)
+            self._cond.notify()
+    # feed
+
+    def read(self, size: int = 1) -> bytes:
+        """Read up to size bytes, wait up to self.timeout for the first one"""
+        with self._cond:
+            if not self._buf:
+                self._cond.wait(self.timeout)
+            data = bytes(self._buf[:size])
+            del self._buf[:size]
+            return data
+    # read
+
+    def close(self) -> None:
+        """Nothing to close, here so it can stand in for serial.Serial everywhere"""
+        pass
+    # close
+
+# LoopbackSerial
+
+
+class PtySerial():
+    """Fake device on a pseudo terminal, the driver side is a real serial.Serial on the pty.
+    POSIX only.
+    Params:
+        timeout - float [0.1], read timeout in seconds (like SERIAL.TIMEOUT)
+    """
+
+    def __init__(self, timeout: float = 0.1):
+        from serial import Serial
+        import tty
+
+        self._master, slave = os.openpty()
+        tty.setraw(self._master)
+        tty.setraw(slave)
+        self.port: Serial = Serial(os.ttyname(slave), timeout=timeout)
+    # __init__
+
+    def feed(self, data: bytes) -> None:
+        """Send bytes from the fake device"""
+        os.write(self._master, data)
+    # feed
+
+# PtySerial
+
+
+def make_config(path: str, buttons: int, queue_size: int) -> None:
+    """Write a config where button N does KB_KEY_PRESS "fN", so every event can be matched to its press
+    Params:
+        path - str, where to save the config
+        buttons - int, how many buttons (1 - 9, the firmware sends 1 digit)
+        queue_size - int, CONFIG.QUEUE.SIZE
+    """
+    _config = {
+        "CONFIG": {
+            "SIZE": {"x": 3, "y": 3},
+            "GUI_SIZE": "400x300",
+            "MONITOR": 1,
+            "SERIAL": {"QUERY": "bench", "BAUDRATE": 9600, "TIMEOUT": 0.1, "FRAMING": "RAW"},
+            "RETRY_COUNT": 1,
+            "RELOAD_INTERVAL": 0,
+            "QUEUE": {"SIZE": queue_size, "WORKERS": 1, "POLICY": "SERIALIZE"},
+        },
+        "DATA": {},
+        "ACTIONS": {f"B{b}": [{"KB_KEY_PRESS": f"f{b}"}] for b in range(1, buttons + 1)},
+    }
+    with open(path, "w") as f:
+        f.write(json.dumps(_config))
+# make_config
+
+
+def synthetic_stream(count: int, rate: float, buttons: int, burst: int = 1, seed: int = 0) -> List[Tuple[float, bytes]]:
+    """Make a press stream
+    Params:
+        count - int, total presses
+        rate - float, presses per second (bursts are spaced to keep this average)
+        buttons - int, buttons to pick from
+        burst - int [1], presses of different buttons sent in 1 write (multi button traffic)
+        seed - int [0], random seed
+    Returns:
+        List[Tuple[float, bytes]], (seconds from start, bytes to send)
+    """
+    rng = random.Random(seed)
+    stream: List[Tuple[float, bytes]] = []
+    interval = burst / rate
+    sent = 0
+    t = 0.0
+    while sent < count:
+        n = min(burst, count - sent)
+        data = bytes(ord(str(rng.randint(1, buttons))) for _ in range(n))
+        stream.append((t, data))
+        sent += n
+        t += interval
+    return stream
+# synthetic_stream
+
+
+def replay_stream(path: str) -> List[Tuple[float, bytes]]:
+    """Load a recorded press stream, 1 "<seconds>,<button digits>" per line
+    Params:
+        path - str, file to load
+    Returns:
+        List[Tuple[float, bytes]], (seconds from start, bytes to send)
+    """
+    stream: List[Tuple[float, bytes]] = []
+    with open(path, "r") as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            t, digits = line.split(",", 1)
+            stream.append((float(t), digits.strip().encode()))
+    return stream
+# replay_stream
+
+
+def run_benchmark(stream: List[Tuple[float, bytes]], buttons: int, use_pty: bool = False,
+                  queue_size: int = 1024, settle: float = 1.0, verbose: bool = False) -> Dict[str, float]:
+    """Drive arduino_listen_loop + MacroManager with stream & measure what comes out the other end
+    Params:
+        stream - List[Tuple[float, bytes]], (seconds from start, bytes to send)
+        buttons - int, how many buttons are in the config
+        use_pty - bool [False], use a pty + real serial.Serial instead of the in memory loopback
+        queue_size - int [1024], CONFIG.QUEUE.SIZE
+        settle - float [1.0], max seconds to wait for the last presses to come out
+        verbose - bool [False], verbosity
+    Returns:
+        Dict[str, float], results
+    """
+    config_dir = tempfile.mkdtemp(prefix="mmp-bench-")
+    config_path = os.path.join(config_dir, "config.json")
+    make_config(config_path, buttons, queue_size)
+
+    output = RecordingBackend()
+    macro_manager = MacroManager(root_win=None, config_path=config_path, verbose=verbose, output=output)
+    action_queue = ActionQueue.from_config(macro_manager)
+    action_queue.start()
+
+    if use_pty:
+        device = PtySerial()
+        port = device.port
+    else:
+        device = port = LoopbackSerial()
+
+    # Runs until the process exits, same as the daemon thread in minimacropad.run
+    listener = threading.Thread(target=arduino_listen_loop, args=(port, macro_manager, action_queue), daemon=True)
+    listener.start()
+
+    # Send the stream on schedule, remember when each button's presses were sent
+    sent: Dict[str, Deque[int]] = {f"f{b}": deque() for b in range(1, buttons + 1)}
+    total_sent = 0
+    # Bytes that aren't a press of a button in the config (framing, digits over --buttons), still sent to the device
+    ignored = 0
+    start = time.perf_counter()
+    for offset, data in stream:
+        delay = start + offset - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        t_send = time.perf_counter_ns()
+        for digit in data:
+            pending = sent.get(f"f{chr(digit)}")
+            if pending is None:
+                ignored += 1
+                continue
+            pending.append(t_send)
+            total_sent += 1
+        device.feed(data)
+    send_time = time.perf_counter() - start
+
+    # Wait for the queue to drain
+    deadline = time.perf_counter() + settle
+    while len(output.events) < total_sent and time.perf_counter() < deadline:
+        time.sleep(0.005)
+    action_queue.stop()
+
+    # Match each event to the oldest press of that button that's not matched yet
+    latency = LatencyHistogram()
+    last_event = 0
+    for t_event, _kind, key in list(output.events):
+        if sent.get(key):
+            latency.record(t_event - sent[key].popleft())
+            last_event = t_event
+
+    emitted = latency.count
+    elapsed = max(send_time, (last_event / 1e9) - start) if emitted else send_time
+    results = {
+        "sent": total_sent,
+        "ignored_bytes": ignored,
+        "emitted": emitted,
+        "dropped_or_merged": total_sent - emitted,
+        "send_seconds": send_time,
+        "presses_per_sec": emitted / elapsed if elapsed > 0 else 0.0,
+    }
+    results.update({f"latency_{k}": v for k, v in latency.summary().items() if k != "count"})
+    return results
+# run_benchmark
+
+
+def main():
+    """Parse args & run the benchmark"""
+    parser = ArgumentParser(description="MiniMacroPad - headless benchmark of the serial -> macro path")
+    parser.add_argument("-n", "--count", type=int, default=1000, help="How many presses to send.")
+    parser.add_argument("-r", "--rate", type=float, default=200.0, help="Presses per second.")
+    parser.add_argument("-b", "--buttons", type=int, default=4, help="How many buttons (1 - 9).")
+    parser.add_argument("--burst", type=int, default=1,
+                        help="Send this many presses (random buttons) in 1 write, for bursty multi button traffic.")
+    parser.add_argument("--replay", default=None, help="Replay a recorded stream instead, '<seconds>,<digits>' per line.")
+    parser.add_argument("--pty", action="store_true", default=False, help="Use a pty + pyserial instead of the in memory loopback.")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed for the synthetic stream.")
+    parser.add_argument("--trace", action="store_true", default=False, help="Also print the TRACER span histograms.")
+    parser.add_argument("--json", action="store_true", default=False, help="Print results as JSON.")
+    parser.add_argument("-v", "--verbose", action="store_true", default=False, help="Add verbose output.")
+    args = parser.parse_args()
+
+    buttons = max(1, min(9, args.buttons))
+    if args.replay:
+        stream = replay_stream(args.replay)
+    else:
+        stream = synthetic_stream(args.count, args.rate, buttons, burst=args.burst, seed=args.seed)
+
+    if args.trace:
+        TRACER.enable()
+    results = run_benchmark(stream, buttons, use_pty=args.pty, verbose=args.verbose)
+    if args.trace:
+        results["trace"] = TRACER.summary()
+
+    if args.json:
+        print(json.dumps(results, indent=4))
+        return
+    for key, value in results.items():
+        if key == "trace":
+            print("trace:")
+            for span, row in value.items():
+                print(f"  {span}: p50 {row['p50_ms']:.3f}ms p95 {row['p95_ms']:.3f}ms p99 {row['p99_ms']:.3f}ms (n={row['count']})")
+        elif isinstance(value, float):
+            print(f"{key}: {value:.3f}")
+        else:
+            print(f"{key}: {value}")
+# main
+
+
+if __name__ == "__main__":
+    main()
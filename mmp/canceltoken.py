@@ -0,0 +1,26 @@
+#!/usr/bin/env python3
+# canceltoken.py - Cooperative cancellation for running macros
+import threading
+
+from mmp.util import MacroCancelled
+
+
+class CancelToken(threading.Event):
+    """Set (cancel()) to stop a running macro. Every step & delay checks it, delays wake up right away.
+    Methods:
+        cancel
+        check
+    """
+
+    def cancel(self) -> None:
+        """Ask the macro using this token to stop"""
+        self.set()
+    # cancel
+
+    def check(self) -> None:
+        """Raise MacroCancelled if this token was cancelled"""
+        if self.is_set():
+            raise MacroCancelled()
+    # check
+
+# CancelToken
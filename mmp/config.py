@@ -3,6 +3,10 @@
 import os.path
 import json
 
+from typing import Any, List, Optional, Set
+
+from mmp.configcache import load_cache, save_cache
+
 
 class Config():
     """Handles config files & handles json load/save
@@ -15,14 +19,18 @@ class Config():
         save_config
         save_default_config
         get_path
+        get_data_dir
+        diff
+        write_cache
     """
 
-    def __init__(self, config_path: str = None, verbose: bool = False):
+    def __init__(self, config_path: str = None, verbose: bool = False, use_cache: bool = True):
         """
         Configure Config object
         Params:
             config_path - name of the config file to use, default to home dir
             verbose - bool, verbosity
+            use_cache - bool [True], load from the compiled cache next to the config file if it's still valid
         """
         self.verbose: bool = verbose
         self.default_config_path: str = "./mmp/res/sampleconfig.json"
@@ -32,17 +40,48 @@ class Config():
             "~") + "/minimacropad-config.json"
         self.path: str = config_path if config_path else self.default_path
 
-        # Load JSON config from path, write default if nothing is found
-        self.full_config: dict = self.load_config()
+        # Compiled plans from the cache (see macroplan.bind_plans), None if the JSON was parsed
+        self.plan_specs: Optional[Any] = None
+        cached = load_cache(self.path, verbose=verbose) if use_cache else None
+        if cached is not None:
+            self.full_config, self.plan_specs = cached
+        else:
+            # Load JSON config from path, write default if nothing is found
+            self.full_config: dict = self.load_config()
 
         # Shortcuts for accessing
         self.config = self.full_config["CONFIG"]
         self.actions = self.full_config["ACTIONS"]
         self.data = self.full_config["DATA"]
-        self.serial = self.config["SERIAL"]
+        # Named pages of buttons, empty = 1 page with ACTIONS in order
+        self.pages: dict = self.full_config.get("PAGES", {})
         self.size = self.config["SIZE"]
+        self.devices: List[dict] = self._get_devices()
+        # First (or only) serial device
+        self.serial = self.devices[0]
     # __init__
 
+    def _get_devices(self) -> List[dict]:
+        """Get the serial devices from CONFIG.SERIAL, a dict for 1 pad or a list of them.
+        Every device gets an OFFSET (added to its button positions, so each pad has its own page of ACTIONS)
+        & a NAME, if they're not set.
+        Returns:
+            List[dict], copies of the SERIAL dicts
+        """
+        _serial = self.config["SERIAL"]
+        _devices = _serial if isinstance(_serial, list) else [_serial]
+        if not _devices:
+            raise Exception("CONFIG.SERIAL needs at least 1 device")
+        page_size = self.size["x"] * self.size["y"]
+        devices = []
+        for idx, device in enumerate(_devices):
+            device = dict(device)
+            device.setdefault("OFFSET", idx * page_size)
+            device.setdefault("NAME", f"pad{idx + 1}")
+            devices.append(device)
+        return devices
+    # _get_devices
+
     def load_config(self) -> dict:
         """Loads JSON config from self.path
         Returns:
@@ -116,4 +155,38 @@ class Config():
         return self.path
     # get_path
 
+    def get_data_dir(self) -> str:
+        """Gets the folder relative DATA FILE paths are relative to (the config file's folder)
+        Returns:
+            str, folder path
+        """
+        return os.path.dirname(os.path.abspath(self.path))
+    # get_data_dir
+
+    def write_cache(self, plan_specs: Any) -> bool:
+        """Save the compiled cache next to the config file, unless CONFIG.CONFIG_CACHE is false
+        Params:
+            plan_specs - Any, compiled plans from macroplan.plans_to_specs
+        Returns:
+            bool, True if it was written
+        """
+        if not self.config.get("CONFIG_CACHE", True):
+            return False
+        self.plan_specs = plan_specs
+        return save_cache(self.path, self.full_config, plan_specs, verbose=self.verbose)
+    # write_cache
+
+    def diff(self, other: "Config") -> Set[str]:
+        """Compare the top level sections of 2 configs
+        Params:
+            other - Config, e.g. a freshly loaded copy of this config
+        Returns:
+            Set[str], names of the sections that are different (CONFIG, ACTIONS, DATA, PAGES)
+        """
+        return {
+            key for key in ("CONFIG", "ACTIONS", "DATA", "PAGES")
+            if self.full_config.get(key) != other.full_config.get(key)
+        }
+    # diff
+
 # Config class
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+# configcache.py - Compiled config cache, skips JSON parsing & macro validation when the config didn't change
+import hashlib
+import marshal
+import os
+import sys
+
+from typing import Any, Optional, Tuple
+
+# Bump when the cached data changes shape (e.g. an action's compiled args)
+CACHE_VERSION: int = 1
+MAGIC: bytes = b"MMPC"
+
+
+def get_cache_path(config_path: str) -> str:
+    """Get where the cache for a config file goes, next to it
+    Params:
+        config_path - str, e.g. ~/minimacropad-config.json
+    Returns:
+        str, e.g. ~/minimacropad-config.cache
+    """
+    return os.path.splitext(config_path)[0] + ".cache"
+# get_cache_path
+
+
+def _source_key(config_path: str, source: bytes) -> Tuple[int, int, int, str, Tuple[int, int]]:
+    """What a cache is valid for: cache version, config mtime / size / sha256 & python version (marshal's format)"""
+    st = os.stat(config_path)
+    return (CACHE_VERSION, st.st_mtime_ns, st.st_size, hashlib.sha256(source).hexdigest(), sys.version_info[:2])
+# _source_key
+
+
+def load_cache(config_path: str, verbose: bool = False) -> Optional[Tuple[dict, Any]]:
+    """Load the cache for config_path, if it's there & still valid
+    Params:
+        config_path - str, the JSON config file
+        verbose - bool [False], verbosity
+    Returns:
+        Optional[Tuple[dict, Any]], (full config, compiled plan specs). None if it's missing, stale or corrupt
+    """
+    try:
+        with open(config_path, "rb") as f:
+            source = f.read()
+        with open(get_cache_path(config_path), "rb") as f:
+            data = f.read()
+        if not data.startswith(MAGIC):
+            raise ValueError("bad header")
+        key, full_config, plan_specs = marshal.loads(data[len(MAGIC):])
+        if tuple(key) != _source_key(config_path, source):
+            if verbose:
+                print("Config cache is stale")
+            return None
+        return (full_config, plan_specs)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        # Corrupt / from another version, the JSON is always there to fall back to
+        if verbose:
+            print(f"Ignoring config cache: {e}")
+        return None
+# load_cache
+
+
+def save_cache(config_path: str, full_config: dict, plan_specs: Any, verbose: bool = False) -> bool:
+    """Write the cache for config_path. Written to a temp file & renamed, so a crash never leaves half a cache
+    Params:
+        config_path - str, the JSON config file full_config was loaded from
+        full_config - dict, the loaded config
+        plan_specs - Any, compiled plans from macroplan.plans_to_specs
+        verbose - bool [False], verbosity
+    Returns:
+        bool, True if it was written
+    """
+    cache_path = get_cache_path(config_path)
+    tmp_path = cache_path + ".tmp"
+    try:
+        with open(config_path, "rb") as f:
+            source = f.read()
+        data = MAGIC + marshal.dumps((_source_key(config_path, source), _intern(full_config), plan_specs))
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, cache_path)
+    except Exception as e:
+        # A cache is nice to have, never fail startup over it
+        if verbose:
+            print(f"Failed to write config cache {cache_path}: {e}")
+        return False
+    if verbose:
+        print(f"Wrote config cache {cache_path}")
+    return True
+# save_cache
+
+
+def _intern(value: Any) -> Any:
+    """Intern every str in value (e.g. repeated DATA strings), so they're stored & loaded once"""
+    if isinstance(value, str):
+        return sys.intern(value)
+    if isinstance(value, dict):
+        return {_intern(k): _intern(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_intern(v) for v in value]
+    if isinstance(value, tuple):
+        return tuple(_intern(v) for v in value)
+    return value
+# _intern
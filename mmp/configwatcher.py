@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+# configwatcher.py - Polls the config file & reloads it in the background when it changes
+import os
+import threading
+
+from typing import Any, Callable, Optional, Tuple
+
+from mmp.config import Config
+
+
+class ConfigWatcher():
+    """Polls the config file's mtime / size, and loads it again when it changes.
+    Params:
+        path - str, config file to watch
+        on_change - Callable[[Config], Any], called with the new Config (from the watcher thread)
+        interval - float [1.0], seconds between polls
+        verbose - bool [False], verbosity
+    Methods:
+        start
+        stop
+        check
+        reload
+    """
+
+    def __init__(self, path: str, on_change: Callable[[Config], Any], interval: float = 1.0, verbose: bool = False):
+        """Create ConfigWatcher, call start() to begin polling"""
+        self.verbose: bool = verbose
+        self.path: str = path
+        self.on_change: Callable[[Config], Any] = on_change
+        self.interval: float = interval
+        self._last: Optional[Tuple[int, int]] = self._stat()
+        self._stop: threading.Event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+    # __init__
+
+    def _stat(self) -> Optional[Tuple[int, int]]:
+        """Get (mtime_ns, size) of self.path
+        Returns:
+            Optional[Tuple[int, int]], None if the file is missing
+        """
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+        return (st.st_mtime_ns, st.st_size)
+    # _stat
+
+    def start(self) -> None:
+        """Start polling in a daemon thread"""
+        self._thread = threading.Thread(target=self._watch, name="mmp-config-watcher", daemon=True)
+        self._thread.start()
+    # start
+
+    def stop(self) -> None:
+        """Stop polling"""
+        self._stop.set()
+    # stop
+
+    def _watch(self) -> None:
+        """Poll until stop() is called"""
+        while not self._stop.wait(self.interval):
+            self.check()
+    # _watch
+
+    def check(self) -> bool:
+        """Reload the config if the file changed since the last check
+        Returns:
+            bool, True if a new config was loaded & passed to on_change
+        """
+        current = self._stat()
+        if current is None or current == self._last:
+            return False
+        self._last = current
+        return self.reload()
+    # check
+
+    def reload(self) -> bool:
+        """Load the config file & pass it to on_change, even if it didn't change (e.g. on SIGHUP)
+        Returns:
+            bool, True if a new config was loaded & passed to on_change
+        """
+        try:
+            new_config = Config(config_path=self.path, verbose=self.verbose)
+        except Exception as e:
+            # Probably saved half way / bad JSON, wait for the next change
+            print(f"Failed to reload {self.path}, keeping the running config")
+            print(e)
+            return False
+
+        if self.verbose:
+            print(f"Config file changed: {self.path}")
+        self.on_change(new_config)
+        return True
+    # reload
+
+# ConfigWatcher
@@ -0,0 +1,481 @@
+#!/usr/bin/env python3
+# gestures.py - Tap, double tap, long press & chords, recognized from the pad's serial presses
+import heapq
+import itertools
+import threading
+import time
+
+from functools import partial
+from typing import Any, Callable, Dict, FrozenSet, Iterator, List, NamedTuple, Optional, Tuple
+
+from mmp.config import Config
+from mmp.util import MacroCompileException
+
+# The firmware sends a button's digit once when it's pressed, then every ~150 ms while it's held.
+# There's no release, so a button is released once its digit stops coming (REPEAT).
+# GESTURES timing keys -> default seconds
+TIMINGS: Dict[str, float] = {
+    # Max seconds between digits of a held button. Longer = released
+    "REPEAT": 0.2,
+    # Max seconds between the 2 presses of a double tap
+    "DOUBLE_TAP": 0.4,
+    # Seconds a button has to be held for a long press
+    "LONG_PRESS": 0.6,
+    # Max seconds between the 1st & last button of a chord
+    "CHORD": 0.2,
+}
+
+# Button states
+IDLE: int = 0
+# Pressed, not decided yet (tap, long press or chord)
+DOWN: int = 1
+# Tapped once, waiting for a 2nd press (double tap)
+WAIT_DOUBLE: int = 2
+# Its gesture already ran, repeats are ignored until it's released
+HELD: int = 3
+
+
+class GestureTable(NamedTuple):
+    """CONFIG.GESTURES compiled to button positions, built once per config (see compile_gestures)"""
+    # Button position -> position of the action its gesture runs
+    double_tap: Dict[int, int]
+    long_press: Dict[int, int]
+    # Set of button positions -> position of the action
+    chords: Dict[FrozenSet[int], int]
+    # Every button that's in a chord
+    chord_buttons: FrozenSet[int]
+    repeat: float
+    double_window: float
+    long_press_time: float
+    chord_window: float
+
+    def is_bound(self, position: int) -> bool:
+        """Check if a button has any gesture. Buttons that don't run on the 1st digit, like before"""
+        return position in self.double_tap or position in self.long_press or position in self.chord_buttons
+    # is_bound
+
+# GestureTable
+
+
+def _get_timing(gestures: dict, key: str) -> float:
+    """Get a GESTURES timing in seconds, TIMINGS has the defaults"""
+    value = gestures.get(key, TIMINGS[key])
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or value <= 0:
+        raise MacroCompileException(f"Expected GESTURES.{key} to be a number > 0, got {value!r}")
+    return float(value)
+# _get_timing
+
+
+def compile_gestures(config: Config) -> GestureTable:
+    """Compile CONFIG.GESTURES, ACTIONS names are turned into button positions (like QUEUE.BUTTON_POLICIES)
+    Params:
+        config - Config, config to compile
+    Returns:
+        GestureTable, empty if there's no GESTURES
+    Raises:
+        MacroCompileException if GESTURES has problems
+    """
+    gestures = config.config.get("GESTURES", {})
+    positions = {name: idx for idx, name in enumerate(config.actions.keys(), start=1)}
+
+    def get_pos(name: Any, where: str) -> int:
+        if name not in positions:
+            raise MacroCompileException(f"GESTURES.{where}: {name!r} isn't in ACTIONS")
+        return positions[name]
+
+    double_tap: Dict[int, int] = {}
+    long_press: Dict[int, int] = {}
+    for name, bindings in gestures.get("BUTTONS", {}).items():
+        button = get_pos(name, "BUTTONS")
+        if not isinstance(bindings, dict):
+            raise MacroCompileException(f"GESTURES.BUTTONS.{name}: expected a dict, got {bindings!r}")
+        for gesture, action in bindings.items():
+            if gesture == "DOUBLE_TAP":
+                double_tap[button] = get_pos(action, f"BUTTONS.{name}.DOUBLE_TAP")
+            elif gesture == "LONG_PRESS":
+                long_press[button] = get_pos(action, f"BUTTONS.{name}.LONG_PRESS")
+            else:
+                raise MacroCompileException(
+                    f"GESTURES.BUTTONS.{name}: unknown gesture {gesture!r}, expected DOUBLE_TAP or LONG_PRESS"
+                )
+
+    chords: Dict[FrozenSet[int], int] = {}
+    for action, names in gestures.get("CHORDS", {}).items():
+        target = get_pos(action, "CHORDS")
+        if not isinstance(names, list) or len(set(names)) < 2:
+            raise MacroCompileException(f"GESTURES.CHORDS.{action}: expected a list of 2+ ACTIONS names, got {names!r}")
+        buttons = frozenset(get_pos(name, f"CHORDS.{action}") for name in names)
+        if buttons in chords:
+            raise MacroCompileException(f"GESTURES.CHORDS.{action}: the same buttons are already a chord")
+        chords[buttons] = target
+
+    return GestureTable(
+        double_tap=double_tap,
+        long_press=long_press,
+        chords=chords,
+        chord_buttons=frozenset().union(*chords),
+        repeat=_get_timing(gestures, "REPEAT"),
+        double_window=_get_timing(gestures, "DOUBLE_TAP"),
+        long_press_time=_get_timing(gestures, "LONG_PRESS"),
+        chord_window=_get_timing(gestures, "CHORD"),
+    )
+# compile_gestures
+
+
+class _TimerHandle():
+    """A TimerScheduler.call_later callback, cancel() it to skip it"""
+    __slots__ = ("func", "cancelled")
+
+    def __init__(self, func: Callable[[], None]):
+        self.func: Callable[[], None] = func
+        self.cancelled: bool = False
+    # __init__
+
+    def cancel(self) -> None:
+        """Don't run it (if it didn't run yet)"""
+        self.cancelled = True
+    # cancel
+
+# _TimerHandle
+
+
+class TimerScheduler():
+    """Runs callbacks after a delay, all on 1 daemon thread: a heap of deadlines & a Condition to sleep on.
+    A held button re-arms its release timer on every repeat (~7 times a second), so a thread per timer
+    (threading.Timer) would keep starting threads. Cancelled callbacks stay in the heap until their deadline.
+    Callbacks must not block, the next one waits for it.
+    Params:
+        name - str ["mmp-gesture-timers"], thread name
+    Methods:
+        call_later
+    """
+
+    def __init__(self, name: str = "mmp-gesture-timers"):
+        """Create TimerScheduler, its thread starts with the 1st call_later"""
+        self.name: str = name
+        self._heap: List[Tuple[float, int, _TimerHandle]] = []
+        self._cond: threading.Condition = threading.Condition()
+        # Tie breaker, so the heap never compares handles
+        self._count: Iterator[int] = itertools.count()
+        self._thread: Optional[threading.Thread] = None
+    # __init__
+
+    def call_later(self, delay: float, func: Callable[[], None]) -> _TimerHandle:
+        """Run func on the scheduler thread after delay seconds
+        Returns:
+            _TimerHandle, cancel() it to skip func
+        """
+        handle = _TimerHandle(func)
+        with self._cond:
+            heapq.heappush(self._heap, (time.monotonic() + delay, next(self._count), handle))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                self._thread.start()
+            elif self._heap[0][2] is handle:
+                # Sooner than what the thread is sleeping until
+                self._cond.notify()
+        return handle
+    # call_later
+
+    def _run(self) -> None:
+        """Run callbacks as they come due, forever (daemon)"""
+        heap = self._heap
+        while True:
+            with self._cond:
+                while True:
+                    if not heap:
+                        self._cond.wait()
+                        continue
+                    wait = heap[0][0] - time.monotonic()
+                    if wait <= 0:
+                        handle = heapq.heappop(heap)[2]
+                        break
+                    self._cond.wait(wait)
+            if handle.cancelled:
+                continue
+            try:
+                handle.func()
+            except Exception as e:
+                print(f"Gesture timer failed: {e!r}")
+    # _run
+
+# TimerScheduler
+
+
+# Shared by every threaded GestureRecognizer, started when the 1st one needs a timer
+_SCHEDULER: TimerScheduler = TimerScheduler()
+
+
+class _Button():
+    """1 button's state in a GestureRecognizer"""
+    __slots__ = ("state", "pressed_at", "last_seen", "released", "release_timer", "long_timer", "double_timer")
+
+    def __init__(self):
+        self.state: int = IDLE
+        self.pressed_at: float = 0.0
+        # Its last digit
+        self.last_seen: float = 0.0
+        # Released while its chord wasn't decided yet
+        self.released: bool = False
+        self.release_timer = None
+        self.long_timer = None
+        self.double_timer = None
+    # __init__
+
+# _Button
+
+
+class GestureRecognizer():
+    """Turns 1 pad's presses into gestures, a small timed state machine per button.
+    Buttons without a gesture in the table are submitted on the 1st digit, like without GESTURES (never delayed).
+    A button with gestures runs its own action (tap) once it's clear it wasn't another gesture:
+    - only a LONG_PRESS: once it's released (REPEAT after its last digit)
+    - a DOUBLE_TAP: once DOUBLE_TAP after the press went by without a 2nd press
+    - only in chords: once CHORD after the press went by without the rest of a chord
+    Long presses & chords run as soon as they're recognized, not on release.
+    Deadlines are timers (call_later), nothing polls. Without a call_later they all share 1 TimerScheduler thread.
+    Params:
+        get_table - Callable[[], GestureTable], the current table (e.g. lambda: macro_manager.gestures), so reloads apply
+        emit - Callable[[int], Any], called with the position of the action to run (e.g. ActionQueue.submit)
+        call_later - Callable [None], (delay, func) -> handle with cancel(). Default the shared TimerScheduler
+                     thread, loop.call_later on the asyncio engine
+        verbose - bool [False], verbosity
+    Methods:
+        is_bound
+        press
+        reset
+    """
+
+    def __init__(self, get_table: Callable[[], GestureTable], emit: Callable[[int], Any],
+                 call_later: Callable[[float, Callable[[], None]], Any] = None, verbose: bool = False):
+        """Create GestureRecognizer"""
+        self.get_table: Callable[[], GestureTable] = get_table
+        self.emit: Callable[[int], Any] = emit
+        self.call_later = call_later if call_later is not None else _SCHEDULER.call_later
+        self.verbose: bool = verbose
+        self._buttons: Dict[int, _Button] = {}
+        # Chord buttons pressed within CHORD of _chord_start, not decided yet
+        self._pending: List[int] = []
+        self._chord_start: float = 0.0
+        self._chord_timer = None
+        # Timers fire on other threads
+        self._lock: threading.RLock = threading.RLock()
+    # __init__
+
+    def is_bound(self, position: int) -> bool:
+        """Check if a button has gestures, press() it instead of submitting it"""
+        return self.get_table().is_bound(position)
+    # is_bound
+
+    def press(self, position: int, now: float = None) -> None:
+        """Feed 1 digit (a press or a repeat while it's held) of a button that has gestures
+        Params:
+            position - int, 1 indexed button position (OFFSET added)
+            now - float [None], time.monotonic() it was read
+        """
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            table = self.get_table()
+            btn = self._buttons.get(position)
+            if btn is None:
+                btn = self._buttons[position] = _Button()
+            btn.last_seen = now
+            if btn.state == IDLE:
+                self._start(position, btn, table, now)
+            elif btn.state == WAIT_DOUBLE:
+                self._cancel(btn.double_timer)
+                btn.double_timer = None
+                double_tap = table.double_tap.get(position)
+                if double_tap is None:
+                    # A reload took its DOUBLE_TAP away while it waited: the 1st press was a tap, this is a new one
+                    btn.state = IDLE
+                    self._run(position, "tap")
+                    self._start(position, btn, table, now)
+                else:
+                    btn.state = HELD
+                    self._run(double_tap, "double tap")
+            # DOWN / HELD: a repeat, it's still held
+            if btn.state != IDLE:
+                self._arm_release(position, btn, table)
+    # press
+
+    def _start(self, position: int, btn: _Button, table: GestureTable, now: float) -> None:
+        """A new press"""
+        btn.state = DOWN
+        btn.pressed_at = now
+        btn.released = False
+        if position in table.long_press:
+            btn.long_timer = self.call_later(table.long_press_time, partial(self._on_long, position))
+        if position in table.chord_buttons:
+            self._add_to_chord(position, table, now)
+    # _start
+
+    def _arm_release(self, position: int, btn: _Button, table: GestureTable, delay: float = None) -> None:
+        """(Re)start the timer that decides the button was released"""
+        self._cancel(btn.release_timer)
+        delay = self._release_wait(table) if delay is None else delay
+        btn.release_timer = self.call_later(delay, partial(self._on_release, position))
+    # _arm_release
+
+    def _release_wait(self, table: GestureTable) -> float:
+        """Seconds without a digit before a button counts as released.
+        The firmware sends each held button in turn, so every held button makes the repeats slower
+        """
+        held = sum(1 for b in self._buttons.values() if b.state in (DOWN, HELD))
+        return table.repeat * max(1, held)
+    # _release_wait
+
+    def _on_release(self, position: int) -> None:
+        """Timer: no digit for REPEAT, the button was released"""
+        with self._lock:
+            btn = self._buttons.get(position)
+            if btn is None:
+                return
+            btn.release_timer = None
+            table = self.get_table()
+            # Another button went down since the timer started, its repeats are slower now
+            wait = btn.last_seen + self._release_wait(table) - time.monotonic()
+            if wait > 0:
+                self._arm_release(position, btn, table, wait)
+                return
+            if btn.state == DOWN:
+                if position in self._pending:
+                    # Its chord is decided once CHORD is up
+                    btn.released = True
+                    return
+                self._tapped(position, btn, table)
+            elif btn.state == HELD:
+                btn.state = IDLE
+    # _on_release
+
+    def _tapped(self, position: int, btn: _Button, table: GestureTable) -> None:
+        """The button was pressed & released, no long press / chord. Wait for a double tap or run its action"""
+        self._cancel(btn.long_timer)
+        btn.long_timer = None
+        if position in table.double_tap:
+            btn.state = WAIT_DOUBLE
+            wait = btn.pressed_at + table.double_window - time.monotonic()
+            btn.double_timer = self.call_later(max(0.0, wait), partial(self._on_double_timeout, position))
+            return
+        btn.state = IDLE
+        self._run(position, "tap")
+    # _tapped
+
+    def _on_double_timeout(self, position: int) -> None:
+        """Timer: no 2nd press within DOUBLE_TAP, it was a tap"""
+        with self._lock:
+            btn = self._buttons.get(position)
+            if btn is None:
+                return
+            btn.double_timer = None
+            if btn.state == WAIT_DOUBLE:
+                btn.state = IDLE
+                self._run(position, "tap")
+    # _on_double_timeout
+
+    def _on_long(self, position: int) -> None:
+        """Timer: held for LONG_PRESS"""
+        with self._lock:
+            btn = self._buttons.get(position)
+            if btn is None:
+                return
+            btn.long_timer = None
+            if btn.state != DOWN or position in self._pending:
+                # A pending chord re-arms it if it isn't one (see _resolve_chord)
+                return
+            btn.state = HELD
+            table = self.get_table()
+            if position in table.long_press:
+                self._run(table.long_press[position], "long press")
+    # _on_long
+
+    def _add_to_chord(self, position: int, table: GestureTable, now: float) -> None:
+        """Add a press to the chord that's being pressed, run it right away if no bigger chord could still match"""
+        if self._pending and now - self._chord_start <= table.chord_window:
+            self._pending.append(position)
+        else:
+            self._resolve_chord()
+            self._pending = [position]
+            self._chord_start = now
+            self._chord_timer = self.call_later(table.chord_window, self._on_chord_timeout)
+        group = frozenset(self._pending)
+        if group in table.chords and not any(group < other for other in table.chords):
+            self._run_chord(group, table)
+    # _add_to_chord
+
+    def _on_chord_timeout(self) -> None:
+        """Timer: CHORD is up"""
+        with self._lock:
+            self._chord_timer = None
+            self._resolve_chord()
+    # _on_chord_timeout
+
+    def _resolve_chord(self) -> None:
+        """Decide the pending chord: run it if it's bound, else every button in it goes on on its own"""
+        self._cancel(self._chord_timer)
+        self._chord_timer = None
+        if not self._pending:
+            return
+        table = self.get_table()
+        group = frozenset(self._pending)
+        if group in table.chords:
+            self._run_chord(group, table)
+            return
+        pending, self._pending = self._pending, []
+        for position in pending:
+            btn = self._buttons[position]
+            if btn.state != DOWN:
+                continue
+            if btn.released:
+                self._tapped(position, btn, table)
+            elif position not in table.long_press and position not in table.double_tap:
+                # Only in chords, nothing else to wait for
+                btn.state = HELD
+                self._run(position, "tap")
+            elif position in table.long_press and btn.long_timer is None:
+                # Its long press came up while the chord was pending
+                wait = btn.pressed_at + table.long_press_time - time.monotonic()
+                btn.long_timer = self.call_later(max(0.0, wait), partial(self._on_long, position))
+    # _resolve_chord
+
+    def _run_chord(self, group: FrozenSet[int], table: GestureTable) -> None:
+        """Run a chord, its buttons are ignored until they're released"""
+        self._cancel(self._chord_timer)
+        self._chord_timer = None
+        self._pending = []
+        for position in group:
+            btn = self._buttons[position]
+            self._cancel(btn.long_timer)
+            btn.long_timer = None
+            btn.state = IDLE if btn.released else HELD
+        self._run(table.chords[group], "chord")
+    # _run_chord
+
+    def _run(self, position: int, gesture: str) -> None:
+        """Submit an action"""
+        if self.verbose:
+            print(f"Gesture: {gesture}, running {position}")
+        self.emit(position)
+    # _run
+
+    @staticmethod
+    def _cancel(timer: Optional[Any]) -> None:
+        """Cancel a call_later handle, if it's set"""
+        if timer is not None:
+            timer.cancel()
+    # _cancel
+
+    def reset(self) -> None:
+        """Forget every button & cancel the timers, e.g. when the pad is unplugged. Nothing pending runs"""
+        with self._lock:
+            for btn in self._buttons.values():
+                self._cancel(btn.release_timer)
+                self._cancel(btn.long_timer)
+                self._cancel(btn.double_timer)
+            self._cancel(self._chord_timer)
+            self._chord_timer = None
+            self._buttons.clear()
+            self._pending = []
+    # reset
+
+# GestureRecognizer
@@ -45,8 +45,7 @@ class GUIManager():
 
         # Set flags for handling closing the window
         signal.signal(signal.SIGINT, signal.default_int_handler)
-        # TODO: Fix the threading to uncomment this!
-        # self.macro_manager.root_win.protocol("WM_DELETE_WINDOW", partial(handle_close, self.macro_manager))
+        # Closing the window ends mainloop() (or AsyncMacroPadCore.run), then the core is stopped
 
         # Set icon / title
         self.macro_manager.root_win.iconbitmap(resource_path(ICON_PATH))
@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+# keyrecorder.py - Records the keyboard & turns it into a short list of ACTIONS steps
+import threading
+import time
+
+from typing import Any, Dict, List, Optional, Tuple
+
+DOWN: str = "down"
+UP: str = "up"
+
+# keyboard module name -> name used in the steps (left / right versions are sent as the plain one)
+MODIFIERS: Dict[str, str] = {
+    "shift": "shift", "left shift": "shift", "right shift": "shift",
+    "ctrl": "ctrl", "left ctrl": "ctrl", "right ctrl": "ctrl",
+    "alt": "alt", "left alt": "alt", "right alt": "alt", "alt gr": "alt gr",
+    "windows": "windows", "left windows": "windows", "right windows": "windows", "command": "windows",
+}
+# What shift + key types (US layout), for when the keyboard module names the unshifted key
+SHIFTED: Dict[str, str] = dict(zip("`1234567890-=[]\\;',./", "~!@#$%^&*()_+{}|:\"<>?"))
+# Keys that are typed as text in a KB_SEND_STR, anything else is a KB_KEY_PRESS
+TEXT_KEYS: Dict[str, str] = {"space": " "}
+
+
+def _typed_char(name: str, shift: bool) -> Optional[str]:
+    """Get the character a key types, None if it doesn't type one (e.g. enter, f5)"""
+    char = TEXT_KEYS.get(name, name)
+    if len(char) != 1:
+        return None
+    if shift:
+        return SHIFTED.get(char, char.upper())
+    return char
+# _typed_char
+
+
+def optimize_key_events(events: List[Tuple[int, str, str]], min_gap: float = 0.3,
+                        max_gap: Optional[float] = None) -> List[Dict[str, Any]]:
+    """Turn recorded key events into a short list of ACTIONS steps, instead of 1 step per key event:
+    - Typed keys in a row become 1 KB_SEND_STR (backspaces in the run delete from it)
+    - Keys pressed while ctrl / alt / windows (or shift + a non text key) is held become 1 KB_SEND_HOTKEY
+    - Other keys (enter, arrows, f-keys, a modifier tapped on its own) become KB_KEY_PRESS
+    - Pauses longer than min_gap become a DELAY (capped at max_gap), shorter ones are dropped
+    Params:
+        events - List[Tuple[int, str, str]], (perf_counter_ns, "down" / "up", keyboard module key name) in order
+        min_gap - float [0.3], pauses shorter than this (seconds) aren't kept
+        max_gap - Optional[float] [None], longest DELAY to keep, None keeps pauses as they were
+    Returns:
+        List[Dict[str, Any]], steps for ACTIONS
+    """
+    steps: List[Dict[str, Any]] = []
+    text: List[str] = []
+    # Held modifiers in the order they went down, & whether they were used in a chord
+    held: Dict[str, bool] = {}
+    last_t: Optional[int] = None
+
+    def flush_text():
+        if text:
+            steps.append({"KB_SEND_STR": "".join(text)})
+            text.clear()
+
+    def add_step(t: int, step: Optional[Dict[str, Any]], char: Optional[str] = None):
+        nonlocal last_t
+        if last_t is not None:
+            gap = (t - last_t) / 1e9
+            if gap >= min_gap:
+                flush_text()
+                if max_gap is not None:
+                    gap = min(gap, max_gap)
+                steps.append({"DELAY": round(gap, 3)})
+        last_t = t
+        if char is not None:
+            text.append(char)
+            return
+        flush_text()
+        steps.append(step)
+
+    for t, event_type, name in events:
+        name = name.lower() if len(name) > 1 else name
+        modifier = MODIFIERS.get(name)
+        if modifier is not None:
+            if event_type == DOWN:
+                held.setdefault(modifier, False)
+            elif modifier in held:
+                if not held.pop(modifier):
+                    # Tapped on its own, e.g. the windows key
+                    add_step(t, {"KB_KEY_PRESS": modifier})
+            continue
+        if event_type != DOWN:
+            continue
+
+        chord = [m for m in held if m != "shift"]
+        char = None if chord else _typed_char(name, "shift" in held)
+        for modifier in held:
+            held[modifier] = True
+        if char is not None:
+            add_step(t, None, char)
+        elif name == "backspace" and text and not held:
+            # Fix the typo in the run instead of replaying it
+            text.pop()
+            last_t = t
+        elif held:
+            add_step(t, {"KB_SEND_HOTKEY": list(held) + [name]})
+        else:
+            add_step(t, {"KB_KEY_PRESS": name})
+    flush_text()
+    return steps
+# optimize_key_events
+
+
+class KeyRecorder():
+    """Records key presses with 1 keyboard hook until stop_hotkey is pressed.
+    The hook only appends (perf_counter_ns, down / up, key name), waiting for the hotkey is an Event, nothing polls.
+    Params:
+        stop_hotkey - str ["esc"], hotkey that stops recording (keyboard module format, e.g. "ctrl+shift+r")
+        verbose - bool [False], verbosity
+    Methods:
+        record
+        stop
+        steps
+    """
+
+    def __init__(self, stop_hotkey: str = "esc", verbose: bool = False):
+        """Create KeyRecorder, imports keyboard"""
+        import keyboard
+        self.keyboard = keyboard
+        self.verbose: bool = verbose
+        self.stop_hotkey: str = stop_hotkey
+        self.events: List[Tuple[int, str, str]] = []
+        self._stopped: threading.Event = threading.Event()
+    # __init__
+
+    def _on_event(self, event) -> None:
+        """The keyboard hook, runs on the keyboard module's thread. Just stores the event"""
+        if event.name is not None:
+            self.events.append((time.perf_counter_ns(), event.event_type, event.name))
+    # _on_event
+
+    def record(self, timeout: Optional[float] = None) -> List[Tuple[int, str, str]]:
+        """Record until stop_hotkey is pressed (or stop() / timeout)
+        Params:
+            timeout - Optional[float] [None], max seconds to record
+        Returns:
+            List[Tuple[int, str, str]], the events, without the stop hotkey
+        """
+        self.events = []
+        self._stopped.clear()
+        hook = self.keyboard.hook(self._on_event)
+        hotkey = self.keyboard.add_hotkey(self.stop_hotkey, self.stop)
+        if self.verbose:
+            print(f"Recording the keyboard, press {self.stop_hotkey} to stop")
+        try:
+            self._stopped.wait(timeout)
+        finally:
+            self.keyboard.remove_hotkey(hotkey)
+            self.keyboard.unhook(hook)
+
+        # Drop the stop hotkey's own presses from the end
+        stop_keys = {key.strip().lower() for key in self.stop_hotkey.split("+")}
+        stop_keys |= {name for name, modifier in MODIFIERS.items() if modifier in stop_keys}
+        while self.events and self.events[-1][2].lower() in stop_keys:
+            self.events.pop()
+        if self.verbose:
+            print(f"Recorded {len(self.events)} key events")
+        return self.events
+    # record
+
+    def stop(self) -> None:
+        """Stop recording"""
+        self._stopped.set()
+    # stop
+
+    def steps(self, min_gap: float = 0.3, max_gap: Optional[float] = None) -> List[Dict[str, Any]]:
+        """Get the recording as ACTIONS steps (see optimize_key_events)"""
+        return optimize_key_events(self.events, min_gap=min_gap, max_gap=max_gap)
+    # steps
+
+# KeyRecorder
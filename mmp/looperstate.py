@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+# looperstate.py - Remembers looper positions across restarts in a small append-only log next to the config file
+import json
+import os
+import threading
+
+from typing import Dict, Optional
+
+
+def get_state_path(config_path: str) -> str:
+    """Get where the looper state for a config file goes, next to it
+    Params:
+        config_path - str, e.g. ~/minimacropad-config.json
+    Returns:
+        str, e.g. ~/minimacropad-config.loopers
+    """
+    return os.path.splitext(config_path)[0] + ".loopers"
+# get_state_path
+
+
+class LooperStateStore():
+    """Looper positions (DATA name -> pos), saved as an append-only log of 1 JSON line per change: ["NAME", pos]
+    The last line for a name wins, so a change is a small append instead of rewriting a file.
+    record() only updates a dict & wakes the writer thread, the press never waits on the disk.
+    Changes that come in while the writer is busy are merged, so a burst of presses is 1 write.
+    The log is rewritten (compacted) to 1 line per name on load & once it has COMPACT_AT lines.
+    A line cut off by a crash is skipped, so at worst the last change is lost.
+    Params:
+        path - str, the log file (see get_state_path)
+        verbose - bool [False], verbosity
+    Methods:
+        get
+        record
+        start
+        flush
+        close
+    """
+    # Lines in the log before it's compacted
+    COMPACT_AT: int = 4096
+
+    def __init__(self, path: str, verbose: bool = False):
+        """Create LooperStateStore & load the positions saved by the last run. The writer starts on the 1st record()"""
+        self.verbose: bool = verbose
+        self.path: str = path
+        self.positions: Dict[str, int] = self._load()
+        # Changes the writer thread hasn't written yet
+        self._pending: Dict[str, int] = {}
+        self._lock: threading.Lock = threading.Lock()
+        # Held while writing, so the writer thread & close() don't write at the same time
+        self._write_lock: threading.Lock = threading.Lock()
+        self._wake: threading.Event = threading.Event()
+        self._stop: bool = False
+        self._lines: int = len(self.positions)
+        self._thread: Optional[threading.Thread] = None
+        self._file = None
+    # __init__
+
+    def _load(self) -> Dict[str, int]:
+        """Read the log & compact it"""
+        positions: Dict[str, int] = {}
+        lines = 0
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                for line in f:
+                    lines += 1
+                    try:
+                        name, pos = json.loads(line)
+                    except ValueError:
+                        # Cut off by a crash
+                        continue
+                    if isinstance(name, str) and isinstance(pos, int):
+                        positions[name] = pos
+        except FileNotFoundError:
+            return positions
+        except OSError as e:
+            print(f"Failed to load looper positions from {self.path}: {e}")
+            return positions
+        if lines > len(positions):
+            self._compact(positions)
+        if self.verbose:
+            print(f"Loaded looper positions: {positions}")
+        return positions
+    # _load
+
+    def _compact(self, positions: Dict[str, int]) -> None:
+        """Rewrite the log with 1 line per name. Written to a temp file & renamed, so a crash never loses it"""
+        tmp_path = self.path + ".tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.writelines(json.dumps([name, pos]) + "\n" for name, pos in positions.items())
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            print(f"Failed to compact looper positions {self.path}: {e}")
+    # _compact
+
+    def get(self, name: str, size: int) -> int:
+        """Get the saved position for a looper
+        Params:
+            name - str, DATA name
+            size - int, how many strings the looper has now
+        Returns:
+            int, 0 if there's none or it's past the end of the list (e.g. the list got shorter)
+        """
+        pos = self.positions.get(name, 0)
+        return pos if 0 <= pos < size else 0
+    # get
+
+    def record(self, name: str, pos: int) -> None:
+        """Remember a looper's new position, written in the background. Never blocks on I/O
+        Params:
+            name - str, DATA name
+            pos - int, new position
+        """
+        with self._lock:
+            self.positions[name] = pos
+            self._pending[name] = pos
+            if self._thread is None:
+                self.start()
+        self._wake.set()
+    # record
+
+    def start(self) -> None:
+        """Start the writer thread"""
+        self._thread = threading.Thread(target=self._write_loop, name="mmp-looper-state", daemon=True)
+        self._thread.start()
+    # start
+
+    def _write_loop(self) -> None:
+        """Write changes as they come in, until close()"""
+        while True:
+            self._wake.wait()
+            self._wake.clear()
+            self.flush()
+            if self._stop:
+                return
+    # _write_loop
+
+    def flush(self) -> None:
+        """Write every change that hasn't been written yet"""
+        with self._write_lock:
+            # record() only waits on this short swap, never on the disk
+            with self._lock:
+                pending, self._pending = self._pending, {}
+                positions = dict(self.positions)
+            if not pending:
+                return
+            try:
+                if self._lines + len(pending) > LooperStateStore.COMPACT_AT:
+                    self._close_file()
+                    self._compact(positions)
+                    self._lines = len(positions)
+                    return
+                if self._file is None:
+                    self._file = open(self.path, "a", encoding="utf-8")
+                self._file.write("".join(json.dumps([name, pos]) + "\n" for name, pos in pending.items()))
+                self._file.flush()
+                self._lines += len(pending)
+            except OSError as e:
+                print(f"Failed to save looper positions to {self.path}: {e}")
+    # flush
+
+    def _close_file(self) -> None:
+        """Close the log file (it's kept open between writes)"""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+    # _close_file
+
+    def close(self) -> None:
+        """Write what's left & stop the writer thread"""
+        self._stop = True
+        self._wake.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout=1.0)
+        self.flush()
+        with self._write_lock:
+            self._close_file()
+    # close
+
+# LooperStateStore
@@ -1,13 +1,16 @@
 #!/usr/bin/env python3
 # macrodisplay.py  - TK Frame main window for the Macro Display
-import time
+import queue
 
 import ttkbootstrap as ttk
 from tkinter import Tk
 from ttkbootstrap.constants import *
 from functools import partial
+from typing import Callable, Dict, Optional, Tuple, Union
 
 from mmp.macromanager import MacroManager
+from mmp.pages import Page
+from mmp.tracer import TRACER
 
 
 class MacroDisplay(ttk.Frame):
@@ -19,8 +22,12 @@ class MacroDisplay(ttk.Frame):
         verbose - bool [False], verbosity
         **options - other options to be passed to tk
     Methods:
-        tbd
+        display_press
+        display_state
+        call_soon
     """
+    # ms between checks of the GUI update channel (~1 frame)
+    DRAIN_INTERVAL_MS: int = 16
 
     def __init__(self, macro_manager: MacroManager, verbose: bool = False, **options):
         super().__init__(macro_manager.root_win, **options)
@@ -30,52 +37,204 @@ class MacroDisplay(ttk.Frame):
         self.verbose: bool = macro_manager.verbose
 
         self.size: dict = macro_manager.config.size
-        self.actions: list = macro_manager.config.actions
 
         self.truncate_length = 28  # TODO: make a param
+        # How long a press stays highlighted
+        self.highlight_ms: int = int(macro_manager.config.config.get("GUI_HIGHLIGHT", 0.25) * 1000)
+
+        # GUI update channel: other threads put positions to highlight (or funcs to call) here,
+        # _drain_updates takes them off on the Tk thread. Tk widgets are only ever touched from the Tk thread
+        self._updates: queue.SimpleQueue = queue.SimpleQueue()
+        # position -> after() id of the timer that un-highlights it
+        self._highlight_timers: Dict[int, str] = {}
         self.grid(column=self.size['x'], row=self.size['y'])
-        self.macrogrid = self._init_grid()
+
+        # Aborts every running macro & releases held keys, always placed under the grid
+        self.panic_button = ttk.Button(self.container, text="PANIC", bootstyle=(DANGER, OUTLINE),
+                                       command=self.macro_manager.panic)
+        # Serial connection state of every pad, under the PANIC button
+        self._pad_states: Dict[str, str] = {}
+        self.status_label = ttk.Label(self.container, text="", bootstyle=SECONDARY)
+        self.panic_button.grid(row=1, column=0, sticky=EW, ipadx=5, ipady=5, padx=2, pady=2)
+        self.status_label.grid(row=2, column=0, sticky=W, padx=2)
+
+        # Every page's grid is built once & kept: page name -> (frame, position -> button)
+        # Switching pages hides 1 frame & shows another, nothing is rebuilt
+        self._pages: Dict[str, Page] = {}
+        self._page_grids: Dict[str, Tuple[ttk.Frame, Dict[int, ttk.Button]]] = {}
+        # The page that's showing & its buttons
+        self._shown: Optional[Page] = None
+        self.macrogrid: Dict[int, ttk.Button] = {}
+        self._build_pages()
+        self._show_page(self.macro_manager.pages.current())
+
+        # Called with (position, do_alt_tab) for clicks instead of running the macro here, if set
+        self.gui_press_handler: Optional[Callable[[int, bool], None]] = None
+
+        # Rebuild the grid when the config file changes
+        self.macro_manager.reload_listeners.append(self._on_reload)
+
+        self.container.after(MacroDisplay.DRAIN_INTERVAL_MS, self._drain_updates)
     # __init__
 
-    def _init_grid(self, verbose: bool = False) -> dict:
+    def call_soon(self, func: Callable[[], None]) -> None:
+        """Run func on the Tk thread, safe to call from any thread
+        Params:
+            func - Callable[[], None], e.g. something that updates widgets
+        """
+        self._updates.put(func)
+    # call_soon
+
+    def _drain_updates(self):
+        """Handle everything in the GUI update channel, runs on the Tk thread every DRAIN_INTERVAL_MS"""
+        positions = set()
+        try:
+            while True:
+                item: Union[int, Callable[[], None]] = self._updates.get_nowait()
+                if callable(item):
+                    item()
+                else:
+                    # Highlights for the same button in 1 frame are merged
+                    positions.add(item)
+        except queue.Empty:
+            pass
+        # Show the page presses go to, e.g. after a PAGE_* action or when a PAGE_MOMENTARY button was let go
+        page = self.macro_manager.pages.current()
+        if page is not self._shown:
+            self._show_page(page)
+        for position in positions:
+            self._highlight(position)
+        self.container.after(MacroDisplay.DRAIN_INTERVAL_MS, self._drain_updates)
+    # _drain_updates
+
+    def _highlight(self, position: int):
+        """Highlight the button at position & schedule un-highlighting it. Runs on the Tk thread"""
+        if TRACER.enabled:
+            TRACER.highlight(position)
+        if position not in self.macrogrid:
+            # e.g. a gesture's action or an action that's only on another page
+            if self.verbose:
+                print(f"Position {position} isn't on the page that's showing, not highlighting it")
+            return
+        self.macrogrid[position].configure(bootstyle=PRIMARY)
+        # Pressed again while highlighted, restart the timer
+        if position in self._highlight_timers:
+            self.container.after_cancel(self._highlight_timers[position])
+        self._highlight_timers[position] = self.container.after(
+            self.highlight_ms, partial(self._unhighlight, position)
+        )
+    # _highlight
+
+    def _unhighlight(self, position: int):
+        """Un-highlight the button at position. Runs on the Tk thread"""
+        self._highlight_timers.pop(position, None)
+        if position in self.macrogrid:
+            self.macrogrid[position].configure(bootstyle=DARK)
+    # _unhighlight
+
+    def _on_reload(self, changed: set):
+        """Reload listener, called from the config watcher thread
+        Params:
+            changed - set, changed config sections
+        """
+        if "ACTIONS" in changed or "CONFIG" in changed or "PAGES" in changed:
+            self.call_soon(self._rebuild_grid)
+    # _on_reload
+
+    def _rebuild_grid(self):
+        """Rebuild every page's grid if the pages (button names, SIZE or PAGES) changed. Runs on the Tk thread"""
+        pages = self.macro_manager.pages.pages
+        if pages == self._pages:
+            return
+        if self.verbose:
+            print("Config changed, rebuilding grid")
+        self._clear_highlights()
+        for frame, _ in self._page_grids.values():
+            frame.destroy()
+        self._page_grids.clear()
+        self._shown = None
+        self.size = self.macro_manager.config.size
+        self._build_pages()
+        self._show_page(self.macro_manager.pages.current())
+    # _rebuild_grid
+
+    def _build_pages(self):
+        """Build the grid of every page, once. Runs on the Tk thread"""
+        self._pages = self.macro_manager.pages.pages
+        for page in self._pages.values():
+            self._page_grids[page.name] = self._init_grid(page)
+    # _build_pages
+
+    def _show_page(self, page: Page):
+        """Hide the grid that's showing & show page's (already built). Runs on the Tk thread"""
+        self._clear_highlights()
+        if self._shown is not None and self._shown.name in self._page_grids:
+            self._page_grids[self._shown.name][0].grid_remove()
+        if page.name not in self._page_grids:
+            # Switched to before a reload rebuilt the grids
+            self._page_grids[page.name] = self._init_grid(page)
+        frame, self.macrogrid = self._page_grids[page.name]
+        # grid() with no options puts it back where grid_remove() took it from
+        frame.grid()
+        self._shown = page
+        self._update_status()
+        if self.verbose:
+            print(f"Showing page {page.name!r}")
+    # _show_page
+
+    def _clear_highlights(self):
+        """Un-highlight every highlighted button right away. Runs on the Tk thread"""
+        for position, timer in list(self._highlight_timers.items()):
+            self.container.after_cancel(timer)
+            self._unhighlight(position)
+    # _clear_highlights
+
+    def _init_grid(self, page: Page, verbose: bool = False) -> Tuple[ttk.Frame, Dict[int, ttk.Button]]:
         """
-        Initializes the grid.
+        Initializes the grid of 1 page, in its own frame.
         Params:
+            page - Page, page to build
             verbose - bool [False], verbosity
         Returns:
-            dict of ttk grid buttons
+            Tuple[ttk.Frame, Dict[int, ttk.Button]], the frame & its buttons by ACTIONS position
         """
         if self.verbose:
-            print("init grid:")
+            print(f"init grid: {page.name}")
+        frame = ttk.Frame(self.container)
         grid = {}
         r = 0  # current row
         c = 0  # current column
-        for idx, item in enumerate(self.actions.keys(), start=1):
+        for idx in range(1, len(page.names)):
+            item = page.names[idx]
+            position = page.positions[idx]
             if self.verbose:
-                print(f"idx: {idx} {item.strip()} - r: {r}, c: {c}")
-                print("  ", end='')
-                print(item)
+                print(f"idx: {idx} {item} - r: {r}, c: {c}")
 
             # is_recording_macro: bool = ("rec" in item["func"])
             do_alt_tab = True  # TODO: replace with is gui flag?
 
-            grid[idx] = ttk.Button(self.container,
-                                   text=item.strip(),
-                                   bootstyle=(DARK),
-                                   command=partial(
-                                       self._handle_gui_press, position=idx, do_alt_tab=do_alt_tab)
-                                   )
+            # Buttons with nothing on them (null in PAGES) are left empty
+            if item is not None:
+                grid[position] = ttk.Button(frame,
+                                            text=item.strip(),
+                                            bootstyle=(DARK),
+                                            command=partial(
+                                                self._handle_gui_press, position=position, do_alt_tab=do_alt_tab)
+                                            )
 
-            grid[idx].grid(row=r, column=c,
-                           ipadx=5, ipady=5, padx=2, pady=2
-                           )
+                grid[position].grid(row=r, column=c,
+                                    ipadx=5, ipady=5, padx=2, pady=2
+                                    )
             # Increment
-            if idx % self.size['x'] == 0:
+            if idx % page.size['x'] == 0:
                 r += 1
                 c = 0
             else:
                 c += 1
-        return grid
+
+        frame.grid(row=0, column=0, sticky=NSEW)
+        frame.grid_remove()
+        return (frame, grid)
     # _init_grid
 
     def _handle_gui_press(self, position: int, do_alt_tab: bool = False):
@@ -87,6 +246,11 @@ class MacroDisplay(ttk.Frame):
         """
         if self.verbose:
             print(f"Clicked {position}")
+        # PAGE_* buttons switch right away, like pad presses do in MacroManager.resolve
+        self.macro_manager.pages.press(position)
+        if self.gui_press_handler is not None:
+            self.gui_press_handler(position, do_alt_tab)
+            return
         if do_alt_tab:
             # alt + tab back to whatever the user was doing before
             self.macro_manager.run_action(
@@ -98,20 +262,41 @@ class MacroDisplay(ttk.Frame):
         self.macro_manager.run_action(position=position)
     # _handle_gui_press
 
+    def display_state(self, name: str, state: str):
+        """Show a pad's connection state (see SerialSupervisor.STATES) under the grid
+        Safe to call from any thread & never blocks, the label is updated on the Tk thread
+        Params:
+            name - str, pad NAME
+            state - str, e.g. CONNECTED
+        """
+        self.call_soon(partial(self._set_pad_state, name, state))
+    # display_state
+
+    def _set_pad_state(self, name: str, state: str):
+        """Update the status label. Runs on the Tk thread"""
+        self._pad_states[name] = state
+        self._update_status()
+    # _set_pad_state
+
+    def _update_status(self):
+        """Show the page (if PAGES has named pages) & the pad states in the status label. Runs on the Tk thread"""
+        text = "  ".join(f"{_name}: {_state}" for _name, _state in self._pad_states.items())
+        if self._shown is not None and self._shown.name:
+            text = f"[{self._shown.name}]  {text}"
+        self.status_label.configure(
+            text=text,
+            bootstyle=SECONDARY if all(s == "CONNECTED" for s in self._pad_states.values()) else WARNING
+        )
+    # _update_status
+
     def display_press(self, position: int, verbose: bool = False):
         """Display visual click on GUI in position var
+        Safe to call from any thread & never blocks, the highlight happens on the Tk thread
         Params:
             position - int, position within buttons[] that was pressed
             verbose - bool [False], verbosity
         """
         if self.verbose:
             print(f"click - pos: {position}")
-        if position > len(self.macrogrid):
-            print("Hit a button that's not defined in the config file!")
-            print(f"  position: {position} larger than buttons length")
-            print("  Doing nothing!")
-            return
-        self.macrogrid[position].configure(bootstyle=PRIMARY)
-        time.sleep(.25)  # TODO: make this a variable
-        self.macrogrid[position].configure(bootstyle=DARK)
+        self._updates.put(position)
     # display_press
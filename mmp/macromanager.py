@@ -1,215 +1,462 @@
 #!/usr/bin/env python3
 # macromanager.py - Manager for the Macros for use with the MiniMacroPad
-import keyboard
-import mouse
-import time
+import asyncio
 
-from datetime import datetime
-from enum import Enum
-from tkinter import Tk
-from typing import Tuple, Dict, List, Union, Any
+from threading import Lock
+from typing import Tuple, Dict, List, Optional, Set, Union, Any, Callable, TYPE_CHECKING
 
 from mmp.config import Config
 from mmp.stringlooper import StringLooper
+from mmp.mappedlines import MappedLines, is_same_data
 from mmp.actionmanager import ActionManager
+from mmp.outputbackend import OutputBackend
+from mmp.macroplan import MacroPlan, MacroStep, compile_actions, bind_plans, plans_to_specs
+from mmp.gestures import GestureTable, compile_gestures
+from mmp.pages import PAGE_ACTIONS, PageManager, compile_pages
+from mmp.profiles import ProfileManager, ProfileRules, WindowProvider, compile_profiles, get_ttl, get_window_provider
+from mmp.util import MacroCompileException, MacroCancelled
+from mmp.canceltoken import CancelToken
+from mmp.tracer import TRACER
 
-
-class FuncManager():
-    """
-    NOTE: This is being replaced by ActionManager! This is only for reference while implementing the looper stuff
-    """
-
-    def __init__(self, config: Config, default_delay: float = 0.2, verbose: bool = False):
-        self.verbose: bool = verbose
-        self.config: Config = config
-        self.default_delay: float = default_delay
-        self.loopers: Dict[StringLooper] = self._parse_loopers()
-    # __init__
-
-    def _parse_loopers(self) -> dict:
-        """parse config json to create string loopers
-        (Instantiates StringLooper objects)
-        Returns:
-            dict[str, StringLooper]
-        """
-        # TODO: fix the exception handling! make it return an error instead of raising here
-        _looper = {}
-        # TODO: reimplement
-        for btn in self.config.buttons:
-            if "extra" not in btn:
-                continue
-            try:
-                # If the array name is not in data
-                if btn["extra"] not in self.config.data:
-                    raise Exception(
-                        f"Failed to find {btn['extra']} in {self.config.data}")
-                # Get array name from extra variable
-                tmp_loop = StringLooper(self.config.data[btn['extra']])
-                # Add to dict
-                _looper[btn['extra']] = tmp_loop
-
-            except Exception as e:
-                print("Failed to add looper")
-                raise e
-
-        if self.verbose:
-            print("loopers:")
-            for looper in _looper.values():
-                print(looper)
-
-        # Return new dict
-        return _looper
-    # _parse_loopers
-
-    def loop_up(self, idx: int, extra: str):
-        self.loopers[extra].loop_up()
-        if self.verbose:
-            print(
-                f"loop_up: {self.loopers[extra].get_str()}, idx: {idx}, extra: {extra}")
-        keyboard.write(self.loopers[extra].get_str())
-    # loop_up func from json
-
-    def loop_down(self, idx: int, extra: str):
-        self.loopers[extra].loop_down()
-        keyboard.write(self.loopers[extra].get_str())
-    # loop_down func from json
-
-    def loop_rand(self, idx: int, extra: str):
-        self.loopers[extra].loop_rand()
-        keyboard.write(self.loopers[extra].get_str())
-    # loop_rand func from json
-
-# FuncManager
+if TYPE_CHECKING:
+    from tkinter import Tk
 
 
 class MacroManager():
     """Manager for the Macros for use with the MiniMacroPad"""
 
-    def __init__(self, root_win: Tk, config_path: str = None, verbose: bool = False):
+    def __init__(self, root_win: Optional["Tk"], config_path: str = None, verbose: bool = False, output: OutputBackend = None,
+                 window_provider: WindowProvider = None):
         """Create MacroManager
         (Instantiates Config, ActionManager objects)
             Params:
-                root_win - Tk, root container
+                root_win - Optional[Tk], root container. None when running without the GUI
                 config_path - str [None], path to config, if None use default
                 verbose - bool [False], verbosity
+                output - OutputBackend [None], sends the keyboard events, if None use CONFIG.OUTPUT
+                window_provider - WindowProvider [None], returns the focused window for PROFILES,
+                                  if None use CONFIG.PROFILES.PROVIDER
             Methods that you should use:
                 run_action
         """
         self.verbose: bool = verbose
+        self._window_provider: Optional[WindowProvider] = window_provider
 
         # Load json Config from file, takes config_path if provided
         self.config: Config = Config(config_path=config_path, verbose=verbose)
 
         # Setup the class that will run the macro itself
-        self.action_manager: ActionManager = ActionManager(self.config, verbose=verbose)
+        self.action_manager: ActionManager = ActionManager(
+            self.config, default_delay=self.config.config.get("DEFAULT_DELAY", 0.2), verbose=verbose, output=output
+        )
+
+        # Compile ACTIONS once (or load them from the config cache), index is the button position
+        self.plans: List[Optional[MacroPlan]] = self._compile(self.config)
+
+        # Every page's button -> position table, compiled once. Switching pages swaps which one presses use
+        self.pages: PageManager = self.action_manager.pages
+        self.pages.set_pages(*compile_pages(self.config, self.plans))
+
+        # CONFIG.PROFILES, switches pages to the focused window's profile. None without PROFILES
+        self.profiles: Optional[ProfileManager] = None
+        self._set_profiles(compile_profiles(self.config, self.pages.pages), get_ttl(self.config))
+
+        # CONFIG.GESTURES with ACTIONS names turned into button positions, for the pads' GestureRecognizers
+        self.gestures: GestureTable = compile_gestures(self.config)
 
         # Set root_win from param
-        self.root_win: Tk = root_win
+        self.root_win: Optional["Tk"] = root_win
 
         # The last pressed button position on the macro pad
         self.last_pressed_pos = -1
+
+        # Called with the set of changed sections after reload_config swapped in a new config
+        self.reload_listeners: List[Callable[[Set[str]], None]] = []
+
+        # Tokens of the macros running right now & what to call on panic()
+        self._active_tokens: Set[CancelToken] = set()
+        self._tokens_lock: Lock = Lock()
+        # DATA FILEs replaced by a reload, closed once the macros that were running then (their tokens) are done
+        self._retired: List[Tuple[Set[CancelToken], List[MappedLines]]] = []
+        self.panic_listeners: List[Callable[[], None]] = []
     # __init__
 
-    def run_action(self, position: int = -1, action_name: str = None, value: Any = None):
+    def reload_config(self, new_config: Config) -> Set[str]:
+        """Swap in a freshly loaded config, only rebuilding what changed.
+        Loopers whose DATA list didn't change are kept (with their position). DATA FILEs that were saved again are
+        mapped again, even if the config file itself didn't change (e.g. on SIGHUP).
+        Presses already running keep using the plan they started with, the next press uses the new plans.
+        Params:
+            new_config - Config, newly loaded config
+        Returns:
+            Set[str], changed sections (CONFIG, ACTIONS, DATA, PAGES). Empty if nothing changed or the new config is invalid
+        """
+        changed = self.config.diff(new_config)
+        if "DATA" not in changed and self._data_files_changed(new_config):
+            # A DATA FILE was saved again, the config itself didn't change
+            changed.add("DATA")
+        if not changed:
+            return changed
+        if self.verbose:
+            print(f"Reloading config, changed: {sorted(changed)}")
+
+        loopers = self.action_manager.loopers
+        plans = self.plans
+        if "ACTIONS" in changed or "DATA" in changed:
+            loopers = self.action_manager.build_loopers(new_config, keep=loopers)
+            try:
+                plans = self._compile(new_config, loopers)
+            except MacroCompileException as e:
+                print("Not reloading config, keeping the running one")
+                print(e)
+                return set()
+        gestures = self.gestures
+        pages = None
+        if changed & {"CONFIG", "ACTIONS", "PAGES"}:
+            try:
+                gestures = compile_gestures(new_config)
+                pages = compile_pages(new_config, plans)
+                release = self.action_manager.get_page_release(new_config)
+                profiles = (compile_profiles(new_config, pages[0]), get_ttl(new_config))
+            except (MacroCompileException, ValueError) as e:
+                print("Not reloading config, keeping the running one")
+                print(e)
+                return set()
+
+        # Swap, each of these is a single reference assignment so a press sees either the old or new plans
+        self.action_manager.config = new_config
+        old_loopers = self.action_manager.loopers
+        self.action_manager.loopers = loopers
+        self.config = new_config
+        self.plans = plans
+        self.gestures = gestures
+        if pages is not None:
+            self.pages.set_pages(*pages, release=release)
+            self._set_profiles(*profiles)
+        if loopers is not old_loopers:
+            self._retire_mapped(old_loopers, loopers)
+
+        for listener in self.reload_listeners:
+            listener(changed)
+        return changed
+    # reload_config
+
+    def _retire_mapped(self, old_loopers: Dict[str, StringLooper], loopers: Dict[str, StringLooper]) -> None:
+        """Close the DATA FILEs only old_loopers used. Right away if no macro is running, else once the macros running
+        now are done (a press that started before the reload can still be reading them)
+        Params:
+            old_loopers - Dict[str, StringLooper], loopers before the reload
+            loopers - Dict[str, StringLooper], loopers swapped in
+        """
+        in_use = {id(mapped) for looper in loopers.values() for mapped in looper.get_mapped()}
+        retired = {id(mapped): mapped for looper in old_loopers.values() for mapped in looper.get_mapped()
+                   if id(mapped) not in in_use}
+        if not retired:
+            return
+        with self._tokens_lock:
+            if self._active_tokens:
+                self._retired.append((set(self._active_tokens), list(retired.values())))
+                return
+        for mapped in retired.values():
+            mapped.close()
+    # _retire_mapped
+
+    def _finish_token(self, token: CancelToken) -> None:
+        """A macro is done: forget its token & close retired DATA FILEs no running macro can read anymore"""
+        closing: List[MappedLines] = []
+        with self._tokens_lock:
+            self._active_tokens.discard(token)
+            if self._retired:
+                waiting = []
+                for tokens, mapped in self._retired:
+                    tokens.discard(token)
+                    if tokens:
+                        waiting.append((tokens, mapped))
+                    else:
+                        closing.extend(mapped)
+                self._retired = waiting
+        for mapped in closing:
+            mapped.close()
+    # _finish_token
+
+    def _set_profiles(self, rules: Optional[ProfileRules], ttl: float) -> None:
+        """Use newly compiled PROFILES rules, the window provider (& its lookup thread) is only set up the 1st time"""
+        if rules is None:
+            if self.profiles is not None:
+                self.profiles.stop()
+            self.profiles = None
+        elif self.profiles is None:
+            provider = self._window_provider
+            if provider is None:
+                provider = get_window_provider(self.config.config["PROFILES"].get("PROVIDER", "AUTO"), self.verbose)
+            self.profiles = ProfileManager(rules, provider, ttl=ttl, verbose=self.verbose)
+            self.profiles.start()
+        else:
+            self.profiles.set_rules(rules, ttl)
+    # _set_profiles
+
+    def close(self) -> None:
+        """Shutting down: stop the PROFILES lookups & close the action manager (see ActionManager.close)"""
+        if self.profiles is not None:
+            self.profiles.stop()
+        self.action_manager.close()
+    # close
+
+    def resolve(self, button: int) -> int:
+        """Turn a pad's button (OFFSET added) into the ACTIONS position to run.
+        Switches to the focused window's profile page first (the window ProfileManager last found, no lookup here), then looks the button up on the
+        page that's on (see PageManager.resolve)
+        Params:
+            button - int, 1 indexed button number
+        Returns:
+            int, ACTIONS position, 0 if there's nothing on that button
+        """
+        profiles = self.profiles
+        if profiles is not None:
+            page = profiles.get_page()
+            if page is not None:
+                self.pages.switch(page)
+        # Gesture buttons switch pages once their gesture is decided (see submit_gesture)
+        return self.pages.resolve(button, deferred=self.gestures.is_bound)
+    # resolve
+
+    def submit_gesture(self, action_queue: Any, position: int) -> bool:
+        """GestureRecognizer emit: switch pages for the gesture's action (like resolve does for other presses),
+        then queue it
+        Params:
+            action_queue - ActionQueue / AsyncActionQueue, queue to submit to
+            position - int, ACTIONS position the gesture runs
+        Returns:
+            bool, what action_queue.submit returned
+        """
+        self.pages.press(position)
+        return action_queue.submit(position)
+    # submit_gesture
+
+    def _data_files_changed(self, new_config: Config) -> bool:
+        """Check if any looper's DATA FILE changed since it was mapped"""
+        data_dir = new_config.get_data_dir()
+        return any(
+            isinstance(looper.strings, MappedLines)
+            and not is_same_data(looper.strings, new_config.data.get(name), data_dir)
+            for name, looper in self.action_manager.loopers.items()
+        )
+    # _data_files_changed
+
+    def _compile(self, config: Config, loopers: Dict[str, StringLooper] = None) -> List[Optional[MacroPlan]]:
+        """Get the plans for config's ACTIONS, from the config cache if it had them, else compile & cache them
+        Params:
+            config - Config, config to compile
+            loopers - Dict[str, StringLooper] [None], loopers to bind to, default to action_manager.loopers
+        Returns:
+            List[Optional[MacroPlan]], index is the button position
+        Raises:
+            MacroCompileException if ACTIONS has problems
+        """
+        if config.plan_specs is not None:
+            try:
+                return bind_plans(config.plan_specs, self.action_manager, loopers)
+            except (KeyError, IndexError, TypeError, ValueError) as e:
+                print(f"Config cache doesn't fit, compiling ACTIONS: {e!r}")
+        plans = compile_actions(config.actions, self.action_manager, loopers)
+        config.write_cache(plans_to_specs(plans))
+        return plans
+    # _compile
+
+    def run_action(self, position: int = -1, action_name: str = None, value: Any = None, cancel: CancelToken = None) -> bool:
         """Run an action depending on the action type
-        TODO: support delays here (e.g. alt tab)
+        If the macro is cancelled or fails, keys / mouse buttons it's holding down are released
         Params:
             position - int [-1], position where to call the action function from
+            action_name - str [None], run just this action (with value) instead of the plan at position
+            value - Any [None], value for action_name
+            cancel - CancelToken [None], cancel() it to stop the macro, checked by every step & delay
+        Returns:
+            bool, True if the macro ran all its steps
         """
         if self.verbose:
             print(f"Running button press for {position}")
 
+        # Registered before the plan is looked up, so a reload can't close DATA FILEs the plan reads (_retire_mapped)
+        token = cancel if cancel is not None else CancelToken()
+        with self._tokens_lock:
+            self._active_tokens.add(token)
+        self.action_manager.set_token(token)
+        try:
+            steps = self._get_steps(position, action_name, value)
+            if steps is None:
+                return False
+            # For every step in the plan, run the func
+            tracing = TRACER.enabled
+            for step in steps:
+                token.check()
+                if tracing:
+                    t_step = TRACER.now()
+                    step.func(*step.args)
+                    TRACER.record(step.trace_name, TRACER.now() - t_step)
+                else:
+                    step.func(*step.args)
+            return True
+        except MacroCancelled:
+            if self.verbose:
+                print(f"Cancelled action at pos: {position}")
+            self.action_manager.release_held(token)
+            return False
+        except Exception:
+            self.action_manager.release_held(token)
+            raise
+        finally:
+            self.action_manager.set_token(None)
+            self._finish_token(token)
+    # run_action
+
+    async def run_action_async(self, position: int = -1, action_name: str = None, value: Any = None,
+                               cancel: CancelToken = None) -> bool:
+        """run_action for the asyncio engine: steps that wait (DELAY, holds, pacing) are awaited,
+        so many macros can run at once on 1 thread. Cancelling the task stops the macro like cancel() does,
+        but CancelledError is raised again once held keys are released
+        Params:
+            position - int [-1], position where to call the action function from
+            action_name - str [None], run just this action (with value) instead of the plan at position
+            value - Any [None], value for action_name
+            cancel - CancelToken [None], cancel() it to stop the macro at the next step
+        Returns:
+            bool, True if the macro ran all its steps
+        """
+        if self.verbose:
+            print(f"Running button press for {position}")
+
+        # Registered before the plan is looked up, so a reload can't close DATA FILEs the plan reads (_retire_mapped)
+        token = cancel if cancel is not None else CancelToken()
+        with self._tokens_lock:
+            self._active_tokens.add(token)
+        # Only set in this task's context
+        self.action_manager.set_token(token)
+        try:
+            steps = self._get_steps(position, action_name, value)
+            if steps is None:
+                return False
+            tracing = TRACER.enabled
+            for step in steps:
+                token.check()
+                t_step = TRACER.now() if tracing else 0
+                if step.async_func is not None:
+                    await step.async_func(*step.args)
+                else:
+                    step.func(*step.args)
+                if tracing:
+                    TRACER.record(step.trace_name, TRACER.now() - t_step)
+            return True
+        except MacroCancelled:
+            if self.verbose:
+                print(f"Cancelled action at pos: {position}")
+            self.action_manager.release_held(token)
+            return False
+        except asyncio.CancelledError:
+            # The task was cancelled (RESTART, stop(), shutdown), it has to end up cancelled
+            if self.verbose:
+                print(f"Cancelled action at pos: {position}")
+            self.action_manager.release_held(token)
+            raise
+        except Exception:
+            self.action_manager.release_held(token)
+            raise
+        finally:
+            self.action_manager.set_token(None)
+            self._finish_token(token)
+    # run_action_async
+
+    def _get_steps(self, position: int, action_name: str = None, value: Any = None) -> Optional[Tuple[MacroStep, ...]]:
+        """Get the steps to run for run_action
+        Returns:
+            Optional[Tuple[MacroStep, ...]], None if nothing is at position
+        """
         # Run action_name if defined, don't use the button position at all!
         if action_name:
             if value is None:
                 raise Exception(f"Value cannot be None for {action_name}!")
-            self.action_manager.actions[action_name](value)
-            return
-
-        # Otherwise, run the action from the last pressed position
+            func, args = self.action_manager.compile_step(action_name, value)
+            if action_name in PAGE_ACTIONS:
+                # Not resolved from a button, so nothing switched yet
+                func, args = self.action_manager.do_page_switch, (action_name,) + args
+            return (MacroStep(action_name, func, args, f"step:{action_name}",
+                              self.action_manager.async_actions.get(action_name)),)
+        # Otherwise, run the plan from the pressed position
         self.last_pressed_pos = position
-        action_name, action_items = self._get_action_from_pos()
-        if action_name == "err":
-            print(action_items)
-            return
-        elif action_items is None:
+        plan = self._get_plan(position)
+        if plan is None:
             print(f"Could not get action at pos: {position}. Make sure it's in ACTIONS in the config. Or is it 0? It should start at 1")
-            return
+            return None
+        return plan.steps
+    # _get_steps
 
-        # For every _action in action_items, run the func
-        for _action in action_items:
-            func_name, func_value = next(iter(_action.items()))
-            self.action_manager.actions[func_name](func_value)
-
-        # # TODO: support mouse recording
-        # # TODO: try/catch
-        # # TODO: add recording action for KB!
-    # run_action
-
-    def rec_mouse(self, idx: int):
-        """Record mouse inputs
-        TODO: Reimplement
+    def panic(self) -> None:
+        """Abort everything: cancel every running macro, tell panic_listeners (e.g. drop queued presses)
+        & release every held key / mouse button
         """
-        positions: Dict[str, str] = {}
-        has_quit: bool = False
-        count: int = 0
-
-        def add_pos(_type: str):
-            # Add mouse position and button click to positions
-            # _type can be: left, right, double, middle
-            x, y = mouse.get_position()
-            now = datetime.now().strftime("%Y-%m-%d-%H-%M-%S-%Z")
-            positions[str(now)] = {
-                "type": _type,
-                "posx": x,
-                "posy": y,
-            }
-
-        while not has_quit and count < 999999999:
-            # Record user input until they hit "ESC"
-            count += 1
-            if self.verbose:
-                print(f"rec_mouse # {count}")
-            has_quit = keyboard.is_pressed("escape")
+        print("PANIC: aborting all macros")
+        with self._tokens_lock:
+            tokens = list(self._active_tokens)
+        for token in tokens:
+            token.cancel()
+        for listener in self.panic_listeners:
+            listener()
+        self.action_manager.release_held()
+    # panic
+
+    def record_mouse(self, action_name: str, stop_hotkey: str = "esc", timeout: float = None) -> int:
+        """Record the mouse until stop_hotkey is pressed & save it to the config file as
+        ACTIONS[action_name] = [{"MOUSE_PLAYBACK": recording}]
+        Params:
+            action_name - str, ACTIONS entry to save to, replaced if it's there
+            stop_hotkey - str ["esc"], hotkey that stops recording
+            timeout - float [None], max seconds to record
+        Returns:
+            int, how many events were recorded
+        """
+        from mmp.mouserecorder import MouseRecorder
 
-            mouse.on_click(partial(add_pos, "left"))
-            mouse.on_middle_click(partial(add_pos, "middle"))
-            mouse.on_right_click(partial(add_pos, "right"))
-            mouse.on_double_click(partial(add_pos, "double"))
-            time.sleep(0.02)
+        recorder = MouseRecorder(stop_hotkey=stop_hotkey, verbose=self.verbose)
+        recording = recorder.record(timeout=timeout)
+        self.config.full_config["ACTIONS"][action_name] = [{"MOUSE_PLAYBACK": recording}]
+        self.config.save_config()
+        print(f"Saved {len(recorder.events())} mouse events to ACTIONS.{action_name}")
+        return len(recorder.events())
+    # record_mouse
+
+    def record_keys(self, action_name: str, stop_hotkey: str = "esc", max_gap: float = None,
+                    timeout: float = None) -> int:
+        """Record the keyboard until stop_hotkey is pressed & save it to the config file as ACTIONS[action_name],
+        optimized into KB_SEND_STR / KB_SEND_HOTKEY / KB_KEY_PRESS / DELAY steps (see keyrecorder.optimize_key_events)
+        Params:
+            action_name - str, ACTIONS entry to save to, replaced if it's there
+            stop_hotkey - str ["esc"], hotkey that stops recording
+            max_gap - float [None], longest DELAY to keep between keys, None keeps pauses as they were
+            timeout - float [None], max seconds to record
+        Returns:
+            int, how many steps were saved
+        """
+        from mmp.keyrecorder import KeyRecorder
 
-        keyboard.unhook_all()
-        mouse.unhook_all()
-        if self.verbose:
-            print("Positions")
-            print(positions)
-        self.config.full_config["BUTTONS"][idx]["mouse_movements"] = positions
+        recorder = KeyRecorder(stop_hotkey=stop_hotkey, verbose=self.verbose)
+        events = recorder.record(timeout=timeout)
+        steps = recorder.steps(max_gap=max_gap)
+        self.config.full_config["ACTIONS"][action_name] = steps
         self.config.save_config()
-    # rec_mouse
+        print(f"Saved {len(events)} key events as {len(steps)} steps to ACTIONS.{action_name}")
+        return len(steps)
+    # record_keys
 
-    def _get_action_from_pos(self) -> Tuple[str, Union[Dict[str, Any], str]]:
-        """Get action name & action object from self.last_pressed_pos
+    def _get_plan(self, position: int) -> Optional[MacroPlan]:
+        """Get the compiled plan for a button position
+        Params:
+            position - int, 1 indexed button position
         Returns:
-            Tuple[str, Union[Dict[str, Any], str]] - If the first part of the tuple is "err", then you hit an error
+            Optional[MacroPlan] - None if nothing is at that position
         """
-        # Error if the user hit a button that was bigger than actions, so we can't call anything
-        if self.last_pressed_pos > len(self.config.actions.keys()) or self.last_pressed_pos == 0:
-            _msg = (
-                "Hit a button that's not defined in the config file!"
-                f"pos: {self.last_pressed_pos} larger than buttons length"
-                "Doing nothing"
-            )
-            return ("err", _msg)
-
-        _action_matched_key = None
-        _action = None
-
-        for idx, action_key in enumerate(self.config.actions.keys(), start=1):
-            if idx == self.last_pressed_pos:
-                _action_matched_key = action_key
-                _action = self.config.actions[action_key]
-                break
-        return (_action_matched_key, _action)
-    # _get_action_from_pos
+        if 0 < position < len(self.plans):
+            return self.plans[position]
+        return None
+    # _get_plan
 
 # MacroManager
@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+# macropadcore.py - Everything but the GUI: macros, action queue, config watcher & the serial listeners
+import threading
+
+from typing import Callable, List, Optional, TYPE_CHECKING
+
+from mmp.macromanager import MacroManager
+from mmp.actionqueue import ActionQueue
+from mmp.configwatcher import ConfigWatcher
+from mmp.outputbackend import OutputBackend
+from mmp.serialsupervisor import PortScanner, SerialSupervisor
+
+if TYPE_CHECKING:
+    from tkinter import Tk
+
+
+class BaseMacroPadCore():
+    """What both engines share: the MacroManager, the action queue, the config watcher, the pads' serial
+    supervisors & the front-ends attached with attach(). Doesn't import tkinter.
+    How it runs is up to the engine: MacroPadCore (threads, start / stop / wait) or
+    AsyncMacroPadCore (asyncio, await run / stop)
+    Params:
+        root_win - Optional[Tk] [None], Tk root the GUI uses, None when headless
+        config_path - str [None], path to config, if None use default
+        verbose - bool [False], verbosity
+        output - OutputBackend [None], sends the keyboard events, if None use CONFIG.OUTPUT
+    Methods:
+        attach
+    """
+
+    # Runs the button presses, AsyncMacroPadCore swaps in AsyncActionQueue
+    queue_class = ActionQueue
+
+    def __init__(self, root_win: Optional["Tk"] = None, config_path: str = None, verbose: bool = False,
+                 output: OutputBackend = None):
+        """Create the core, the engine's start() / run() runs it"""
+        self.verbose: bool = verbose
+        self.macro_manager: MacroManager = MacroManager(
+            root_win=root_win, config_path=config_path, verbose=verbose, output=output
+        )
+        # Called with the button position once its macro finished (from a worker thread)
+        self.press_listeners: List[Callable[[int], None]] = []
+
+        # Run macros on worker threads, so reading serial data never waits on a macro
+        self.action_queue: ActionQueue = self.queue_class.from_config(self.macro_manager, on_done=self._on_done)
+
+        # Reload the config file in the background when it's saved, reload() also uses it
+        self.reload_interval: float = self.macro_manager.config.config.get("RELOAD_INTERVAL", 1.0)
+        self.config_watcher: ConfigWatcher = ConfigWatcher(
+            self.macro_manager.config.get_path(), on_change=self.macro_manager.reload_config,
+            interval=self.reload_interval or 1.0, verbose=verbose
+        )
+
+        # 1 supervisor per pad in CONFIG.SERIAL, started by the engine
+        _reconnect = self.macro_manager.config.config.get("RECONNECT", {})
+        self.scanner: PortScanner = PortScanner(min_interval=_reconnect.get("SCAN_INTERVAL", 2.0), verbose=verbose)
+        self.supervisors: List[SerialSupervisor] = [
+            SerialSupervisor(
+                device, self.macro_manager, self.action_queue, self.scanner,
+                min_backoff=_reconnect.get("MIN_DELAY", 0.5), max_backoff=_reconnect.get("MAX_DELAY", 10.0),
+                verbose=verbose
+            )
+            for device in self.macro_manager.config.devices
+        ]
+        self._stopped: threading.Event = threading.Event()
+    # __init__
+
+    def attach(self, on_press: Callable[[int], None], on_state: Callable[[str, str], None] = None) -> None:
+        """Attach a front-end
+        Params:
+            on_press - Callable[[int], None], called with the position of every press once its macro ran.
+                       Called from a worker thread, so it must not block (e.g. MacroDisplay.display_press)
+            on_state - Callable[[str, str], None] [None], called with (pad name, state) when a pad connects,
+                       is unplugged, etc. (see SerialSupervisor.STATES). Called from the pad's thread
+        """
+        self.press_listeners.append(on_press)
+        if on_state is not None:
+            for supervisor in self.supervisors:
+                supervisor.on_state.append(on_state)
+    # attach
+
+    def _on_done(self, position: int) -> None:
+        """ActionQueue on_done, tell every front-end"""
+        for listener in self.press_listeners:
+            listener(position)
+    # _on_done
+
+# BaseMacroPadCore
+
+
+class MacroPadCore(BaseMacroPadCore):
+    """Serial -> keystroke translation, with no GUI. Doesn't import tkinter.
+    Front-ends (e.g. the GUI) attach to it with attach() to hear about presses.
+    Every pad in CONFIG.SERIAL gets a SerialSupervisor thread (blocked in read(), so an idle pad costs no CPU)
+    that reconnects it when it's unplugged, they all submit to the same ActionQueue.
+    Params:
+        root_win - Optional[Tk] [None], Tk root the GUI uses, None when headless
+        config_path - str [None], path to config, if None use default
+        verbose - bool [False], verbosity
+        output - OutputBackend [None], sends the keyboard events, if None use CONFIG.OUTPUT
+    Methods:
+        attach
+        start
+        reload
+        stop
+        wait
+        handle_gui_press
+    """
+
+    def start(self, use_serial: bool = True) -> None:
+        """Start the action queue workers, the config watcher & the serial supervisors
+        Params:
+            use_serial - bool [True], False for GUI only mode
+        """
+        self.action_queue.start()
+        if self.reload_interval:
+            self.config_watcher.start()
+        if use_serial:
+            for supervisor in self.supervisors:
+                supervisor.start()
+    # start
+
+    def reload(self) -> bool:
+        """Load the config file again right now (e.g. on SIGHUP)
+        Returns:
+            bool, True if a new config was loaded
+        """
+        return self.config_watcher.reload()
+    # reload
+
+    def stop(self) -> None:
+        """Stop everything: cancel running macros, release held keys & close the serial devices.
+        Safe to call more than once & from a signal handler
+        """
+        if self._stopped.is_set():
+            return
+        self._stopped.set()
+        if self.verbose:
+            print("Stopping")
+        self.config_watcher.stop()
+        self.action_queue.stop()
+        for supervisor in self.supervisors:
+            supervisor.stop()
+        self.macro_manager.close()
+    # stop
+
+    def wait(self, poll: float = 0.5) -> None:
+        """Block until stop() is called
+        Params:
+            poll - float [0.5], seconds between checks, so signal handlers get to run on every platform
+        """
+        while not self._stopped.wait(poll):
+            pass
+    # wait
+
+    def handle_gui_press(self, position: int, do_alt_tab: bool = False) -> None:
+        """Run a button clicked in the GUI through the queue, instead of blocking the Tk thread
+        (MacroDisplay.gui_press_handler)
+        Params:
+            position - int, 1 indexed button position
+            do_alt_tab - bool [False], run alt + tab before the macro
+        """
+        if not do_alt_tab:
+            self.action_queue.submit(position)
+            return
+        threading.Thread(target=self._gui_press, args=(position,), name="mmp-gui-press", daemon=True).start()
+    # handle_gui_press
+
+    def _gui_press(self, position: int) -> None:
+        """alt + tab back to whatever the user was doing before, then queue the press"""
+        self.macro_manager.run_action(action_name="KB_SEND_HOTKEY", value=["alt", "tab"])
+        self.action_queue.submit(position)
+    # _gui_press
+
+# MacroPadCore
@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+# macroplan.py - Compiles ACTIONS from the config into ready to run macro plans
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+from mmp.actionmanager import ActionManager
+from mmp.stringlooper import StringLooper
+from mmp.util import MacroCompileException
+
+
+class MacroStep(NamedTuple):
+    """One step of a macro, call func(*args) to run it"""
+    name: str
+    func: Callable
+    args: tuple
+    # TRACER histogram name, built once here instead of on every press
+    trace_name: str
+    # Coroutine function the asyncio engine awaits instead of func (same args), None if func doesn't wait
+    async_func: Optional[Callable] = None
+# MacroStep
+
+
+class MacroPlan(NamedTuple):
+    """A compiled macro (1 button), steps run in order"""
+    name: str
+    steps: Tuple[MacroStep, ...]
+# MacroPlan
+
+
+def compile_actions(actions: Dict[str, List[Dict[str, Any]]], action_manager: ActionManager,
+                    loopers: Dict[str, StringLooper] = None) -> List[Optional[MacroPlan]]:
+    """Compile the ACTIONS dict into a list of MacroPlans indexed by button position.
+    Every step's action function is looked up & its value validated here, so running a press is just calling funcs.
+    Params:
+        actions - Dict[str, List[Dict[str, Any]]], ACTIONS from the config
+        action_manager - ActionManager, has the action functions
+        loopers - Dict[str, StringLooper] [None], loopers to bind to, default to action_manager.loopers
+    Returns:
+        List[Optional[MacroPlan]] - index 0 is None, since button positions start at 1
+    Raises:
+        MacroCompileException with every problem found, if there are any
+    """
+    plans: List[Optional[MacroPlan]] = [None]
+    errors: List[str] = []
+
+    for action_name, action_items in actions.items():
+        plans.append(compile_action(action_name, action_items, action_manager, errors, loopers))
+
+    if errors:
+        raise MacroCompileException("Failed to compile ACTIONS:\n  " + "\n  ".join(errors))
+    return plans
+# compile_actions
+
+
+def compile_action(action_name: str, action_items: List[Dict[str, Any]], action_manager: ActionManager,
+                   errors: List[str], loopers: Dict[str, StringLooper] = None) -> MacroPlan:
+    """Compile 1 macro (ACTIONS entry) into a MacroPlan
+    Params:
+        action_name - str, name of the ACTIONS entry
+        action_items - List[Dict[str, Any]], the steps from the config
+        action_manager - ActionManager, has the action functions
+        errors - List[str], problems are appended here instead of raising
+        loopers - Dict[str, StringLooper] [None], loopers to bind to, default to action_manager.loopers
+    Returns:
+        MacroPlan, bad steps are left out
+    """
+    steps: List[MacroStep] = []
+    if not isinstance(action_items, list):
+        errors.append(f"{action_name}: expected a list of steps")
+        return MacroPlan(action_name, ())
+
+    # Seconds between characters for the typing steps after a KB_PACING step
+    pacing = 0.0
+
+    for idx, _action in enumerate(action_items, start=1):
+        if not isinstance(_action, dict) or len(_action) != 1:
+            errors.append(f"{action_name} step {idx}: expected 1 {{\"ACTION_NAME\": value}} per step, got {_action!r}")
+            continue
+        func_name, func_value = next(iter(_action.items()))
+
+        # KB_PACING is folded into the steps after it, it doesn't run on its own
+        if func_name == "KB_PACING":
+            if isinstance(func_value, bool) or not isinstance(func_value, (int, float)) or func_value < 0:
+                errors.append(f"{action_name} step {idx} ({func_name}): Expected a number >= 0, got {func_value!r}")
+            else:
+                pacing = float(func_value)
+            continue
+
+        try:
+            func, args = action_manager.compile_step(func_name, func_value, loopers)
+        except ValueError as e:
+            errors.append(f"{action_name} step {idx} ({func_name}): {e}")
+            continue
+        if func_name in ActionManager.PACED_ACTIONS:
+            args = args + (pacing,)
+        steps.append(MacroStep(func_name, func, args, f"step:{func_name}", action_manager.async_actions.get(func_name)))
+
+    return MacroPlan(action_name, tuple(steps))
+# compile_action
+
+
+def plans_to_specs(plans: List[Optional[MacroPlan]]) -> List[Optional[Tuple[str, Tuple[Tuple[str, tuple], ...]]]]:
+    """Turn compiled plans into plain data for the config cache: (name, ((ACTION_NAME, args), ...)) per plan.
+    Loopers are stored as their DATA name
+    Params:
+        plans - List[Optional[MacroPlan]], from compile_actions
+    Returns:
+        List[Optional[Tuple[str, Tuple[Tuple[str, tuple], ...]]]], same indexes as plans
+    """
+    specs = []
+    for plan in plans:
+        if plan is None:
+            specs.append(None)
+            continue
+        steps = []
+        for step in plan.steps:
+            args = step.args
+            if step.name in ActionManager.LOOPER_ACTIONS:
+                args = (args[0].name,) + args[1:]
+            steps.append((step.name, args))
+        specs.append((plan.name, tuple(steps)))
+    return specs
+# plans_to_specs
+
+
+def bind_plans(specs: List[Optional[Tuple[str, Tuple[Tuple[str, tuple], ...]]]], action_manager: ActionManager,
+               loopers: Dict[str, StringLooper] = None) -> List[Optional[MacroPlan]]:
+    """Build plans from plans_to_specs data without validating the values again
+    Params:
+        specs - from plans_to_specs (e.g. loaded from the config cache)
+        action_manager - ActionManager, has the action functions
+        loopers - Dict[str, StringLooper] [None], loopers to bind to, default to action_manager.loopers
+    Returns:
+        List[Optional[MacroPlan]], like compile_actions
+    Raises:
+        KeyError / ValueError / TypeError if the specs don't fit (then compile_actions instead)
+    """
+    loopers = action_manager.loopers if loopers is None else loopers
+    plans: List[Optional[MacroPlan]] = []
+    for spec in specs:
+        if spec is None:
+            plans.append(None)
+            continue
+        name, _steps = spec
+        steps = []
+        for func_name, args in _steps:
+            args = tuple(args)
+            if func_name.startswith("MOUSE_"):
+                # Load the mouse backend now, like compile_step does
+                action_manager.load_mouse()
+            if func_name in ActionManager.LOOPER_ACTIONS:
+                args = (loopers[args[0]],) + args[1:]
+            steps.append(MacroStep(func_name, action_manager.actions[func_name], args, f"step:{func_name}",
+                                   action_manager.async_actions.get(func_name)))
+        plans.append(MacroPlan(name, tuple(steps)))
+    return plans
+# bind_plans
@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+# mappedlines.py - Memory-mapped, line-oriented text files used as DATA lists (e.g. huge phrase lists for loopers)
+import mmap
+import os
+
+from array import array
+from collections.abc import Sequence
+from typing import Any, Optional, Sequence as SequenceType, Tuple, Union
+
+
+class MappedLines(Sequence):
+    """Read-only list of the lines of a text file, without loading the file.
+    The file is memory-mapped & only an index of where each line starts / ends is kept (16 bytes a line),
+    a line is decoded when it's asked for. So lines[i] is O(1) & the OS pages the file in & out as needed.
+    Blank lines are skipped, line endings (\\n or \\r\\n) are stripped.
+    NOTE: replace the file (save a new one over it) instead of truncating it while it's mapped
+    Params:
+        path - str, path to the file
+        encoding - str ["utf-8"], encoding of the file
+    Methods:
+        close
+        is_same_file
+    """
+
+    def __init__(self, path: str, encoding: str = "utf-8"):
+        """Map path & index its lines
+        Raises:
+            OSError if path can't be opened, ValueError if it has no lines
+        """
+        self.path: str = path
+        self.encoding: str = encoding
+        with open(path, "rb") as f:
+            st = os.fstat(f.fileno())
+            # What is mapped, see is_same_file
+            self.stat_key: tuple = (st.st_ino, st.st_mtime_ns, st.st_size)
+            if st.st_size == 0:
+                raise ValueError(f"{path} is empty")
+            # The map stays valid after the file is closed
+            self._map: mmap.mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._starts: array = array("Q")
+        self._ends: array = array("Q")
+        self._build_index()
+        if not self._starts:
+            self.close()
+            raise ValueError(f"{path} has no lines")
+    # __init__
+
+    def _build_index(self) -> None:
+        """Find where every non blank line starts & ends"""
+        mm = self._map
+        find = mm.find
+        size = len(mm)
+        starts = self._starts
+        ends = self._ends
+        pos = 0
+        while pos < size:
+            end = find(b"\n", pos)
+            if end == -1:
+                end = size
+            stop = end - 1 if end > pos and mm[end - 1] == 0x0D else end
+            if stop > pos:
+                starts.append(pos)
+                ends.append(stop)
+            pos = end + 1
+    # _build_index
+
+    def __len__(self) -> int:
+        return len(self._starts)
+    # __len__
+
+    def __getitem__(self, idx: Union[int, slice]) -> Union[str, list]:
+        """Decode the line at idx (negative indexes & slices work like a list)"""
+        if isinstance(idx, slice):
+            return [self[i] for i in range(*idx.indices(len(self)))]
+        return self._map[self._starts[idx]:self._ends[idx]].decode(self.encoding, errors="replace")
+    # __getitem__
+
+    def is_same_file(self, path: str, encoding: str = "utf-8") -> bool:
+        """Check if path is what's mapped, & that it didn't change since (e.g. to reuse it when the config reloads)
+        Params:
+            path - str, path to the file
+            encoding - str ["utf-8"], encoding of the file
+        Returns:
+            bool, False if it's another file, or the file was saved again
+        """
+        if os.path.abspath(path) != os.path.abspath(self.path) or encoding != self.encoding:
+            return False
+        try:
+            st = os.stat(path)
+        except OSError:
+            return False
+        return (st.st_ino, st.st_mtime_ns, st.st_size) == self.stat_key
+    # is_same_file
+
+    def close(self) -> None:
+        """Unmap the file"""
+        self._map.close()
+    # close
+
+    def __repr__(self) -> str:
+        return f"MappedLines({self.path!r}, {len(self)} lines)"
+    # __repr__
+
+# MappedLines
+
+
+def get_data_file(value: Any, base_dir: str) -> Optional[Tuple[str, str]]:
+    """Get the file a DATA entry points at
+    Params:
+        value - Any, the DATA entry, e.g. {"FILE": "phrases.txt", "ENCODING": "utf-8"}
+        base_dir - str, relative FILE paths are relative to this (the config file's folder)
+    Returns:
+        Optional[Tuple[str, str]], (path, encoding). None if value is an inline list (or {"ITEMS": list})
+    Raises:
+        ValueError if value isn't a list of str or a valid FILE / ITEMS entry
+    """
+    if isinstance(value, dict) and "ITEMS" in value:
+        value = value["ITEMS"]
+    if isinstance(value, list):
+        if not all(isinstance(v, str) for v in value):
+            raise ValueError(f"Expected a list of str, got {value!r}")
+        return None
+    if not isinstance(value, dict) or not isinstance(value.get("FILE"), str):
+        raise ValueError(f"Expected a list of str, {{\"ITEMS\": list}} or {{\"FILE\": path}}, got {value!r}")
+    path = os.path.join(base_dir, os.path.expanduser(value["FILE"]))
+    return (path, value.get("ENCODING", "utf-8"))
+# get_data_file
+
+
+def load_data(value: Any, base_dir: str) -> SequenceType[str]:
+    """Get the strings of a DATA entry: inline lists (& ITEMS) as is, FILE entries memory-mapped
+    Params:
+        value - Any, the DATA entry
+        base_dir - str, relative FILE paths are relative to this (the config file's folder)
+    Returns:
+        Sequence[str], list or MappedLines
+    Raises:
+        ValueError if value is invalid or the file has no lines, OSError if the file can't be opened
+    """
+    data_file = get_data_file(value, base_dir)
+    if data_file is None:
+        return value["ITEMS"] if isinstance(value, dict) else value
+    return MappedLines(*data_file)
+# load_data
+
+
+def is_same_data(strings: SequenceType[str], value: Any, base_dir: str) -> bool:
+    """Check if strings (from load_data) is still what the DATA entry value has
+    Params:
+        strings - Sequence[str], from load_data
+        value - Any, the DATA entry (e.g. from a reloaded config)
+        base_dir - str, relative FILE paths are relative to this (the config file's folder)
+    Returns:
+        bool
+    """
+    if isinstance(strings, MappedLines):
+        try:
+            data_file = get_data_file(value, base_dir)
+        except ValueError:
+            return False
+        return data_file is not None and strings.is_same_file(*data_file)
+    return strings == (value.get("ITEMS") if isinstance(value, dict) else value)
+# is_same_data
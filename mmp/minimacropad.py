@@ -1,198 +1,272 @@
 #!/usr/bin/env python3
 # minimacropad.py - A python driver to provide functionality to the mini macro pad.
-import sys
+# NOTE: serial & the GUI stack (tkinter / ttkbootstrap) are imported where they're used, to keep startup fast
 import signal
 import threading
 
-from serial import Serial
-import serial
-
 from functools import partial
-import ttkbootstrap as ttk
-from tkinter import Tk, messagebox
-from ttkbootstrap.constants import *
-from typing import Optional
-
-from mmp.util import (
-    CustomSerialException,
-    SerialNotFoundException, SerialMountException,
-    resource_path, get_serial_port_name, ICON_PATH, SFX_PATH, MSGBOX_TITLE
-)
-from mmp.config import Config
-from mmp.macrodisplay import MacroDisplay
-from mmp.guimanager import GUIManager
+from typing import Callable, Optional, TYPE_CHECKING
+
 from mmp.macromanager import MacroManager
+from mmp.actionqueue import ActionQueue
+from mmp.serialdecoder import SerialDecoder
+from mmp.gestures import GestureRecognizer
+from mmp.startup import STARTUP
+from mmp.tracer import TRACER
+
+if TYPE_CHECKING:
+    from serial import Serial
 
 
-def run(is_gui_only: bool, monitor_num: Optional[int], is_verbose: bool):
+def run(is_gui_only: bool, monitor_num: Optional[int], is_verbose: bool, startup_timing: bool = False,
+        is_headless: bool = False, use_asyncio: bool = False):
     """Start initializing the MiniMacroPad & set things up.
     Params:
         is_gui_only - bool, Run in GUI only mode. (Disable serial comms)
         monitor_num - Optional[int], Which monitor to show the GUI on. If None, use what's in the config
         is_verbose - bool, Enable verbosity
+        startup_timing - bool [False], print how long each startup phase took
+        is_headless - bool [False], no GUI at all (tkinter is never imported), see run_headless
+        use_asyncio - bool [False], run on the asyncio engine (AsyncMacroPadCore) instead of threads
     """
     if is_verbose:
         print("Driver for macro pad:")
 
-    # # Globals # #
-    # TODO: Stop using globals
-    # Setup Serial communication thread
-    global thread1
-    # Used when clicking the close icon in the GUI, stop the thread too
-    global do_close
-    do_close = False
+    if is_headless:
+        return run_headless(is_verbose=is_verbose, startup_timing=startup_timing, use_asyncio=use_asyncio)
 
     # Create root TK window
-    _root: Tk = ttk.Window(themename="darkly")
+    with STARTUP.phase("gui import"):
+        import ttkbootstrap as ttk
+        from mmp.guimanager import GUIManager
+    with STARTUP.phase("tk window"):
+        _root = ttk.Window(themename="darkly")
 
-    # Setup manager that handles actual functionality
-    macro_manager: MacroManager = MacroManager(
-        root_win=_root, verbose=is_verbose)
-
-    # Load arduino's Serial port if possible
-    arduino: Serial = None
-    if not is_gui_only:
-        if is_verbose:
-            print("Loading Serial connection")
-        arduino: Serial = init_arduino(macro_manager.config)
+    # Setup the core that handles actual functionality, the GUI attaches to it
+    with STARTUP.phase("config+compile"):
+        core = _create_core(root_win=_root, is_verbose=is_verbose, use_asyncio=use_asyncio)
+        macro_manager: MacroManager = core.macro_manager
 
     # Setup GUI
-    guimanager = GUIManager(macro_manager=macro_manager, cli_arg_monitor_num=monitor_num)
+    with STARTUP.phase("gui setup"):
+        guimanager = GUIManager(macro_manager=macro_manager, cli_arg_monitor_num=monitor_num)
+        core.attach(guimanager.macro_display.display_press, on_state=guimanager.macro_display.display_state)
+        # Clicks go thru the queue, so a macro never blocks the window
+        guimanager.macro_display.gui_press_handler = core.handle_gui_press
 
-    # Handle reading serial data via arduino_listen_loop
-    thread1 = threading.Thread(target=arduino_listen_loop, args=(
-        arduino, macro_manager, guimanager.macro_display), daemon=True)
-    # TODO: add keyword args to above
-    thread1.start()
+    if is_verbose and not is_gui_only:
+        print("Loading Serial connection")
+
+    if use_asyncio:
+        import asyncio
+        if startup_timing:
+            print(STARTUP.report())
+        # Tk is pumped by the loop, returns once the window is closed
+        asyncio.run(core.run(use_serial=not is_gui_only, tk_root=_root))
+        return
+
+    # Connect to the arduino(s) in the background, reconnecting if they're unplugged
+    with STARTUP.phase("workers"):
+        core.start(use_serial=not is_gui_only)
+
+    if startup_timing:
+        print(STARTUP.report())
 
     # Start GUI thread
     macro_manager.root_win.mainloop()
+    core.stop()
 # end main
 
 
-def init_arduino(config: Config) -> Serial:
+def _create_core(root_win=None, is_verbose: bool = False, use_asyncio: bool = False):
+    """Create the MacroPadCore (or AsyncMacroPadCore)"""
+    if use_asyncio:
+        from mmp.asynccore import AsyncMacroPadCore
+        return AsyncMacroPadCore(root_win=root_win, verbose=is_verbose)
+    from mmp.macropadcore import MacroPadCore
+    return MacroPadCore(root_win=root_win, verbose=is_verbose)
+# _create_core
+
+
+def run_headless(is_verbose: bool, startup_timing: bool = False, use_asyncio: bool = False) -> int:
+    """Serial -> keystrokes with no GUI, until SIGINT / SIGTERM. SIGHUP reloads the config file.
+    Pads that aren't plugged in (yet) are waited for.
+    Params:
+        is_verbose - bool, Enable verbosity
+        startup_timing - bool [False], print how long each startup phase took
+        use_asyncio - bool [False], run on the asyncio engine (AsyncMacroPadCore) instead of threads
+    Returns:
+        int, exit code
     """
-    Initialize serial COM port and return it. Uses SERIAL_QRY to find the port. Show MsgBox if there's an exception.
+    with STARTUP.phase("config+compile"):
+        core = _create_core(is_verbose=is_verbose, use_asyncio=use_asyncio)
+
+    if use_asyncio:
+        import asyncio
+        if startup_timing:
+            print(STARTUP.report())
+        if is_verbose:
+            print("Running headless, Ctrl+C to quit")
+        asyncio.run(core.run(handle_signals=True))
+        return 0
+
+    def _on_stop_signal(signum, frame):
+        print(f"Got {signal.Signals(signum).name}, shutting down")
+        core.stop()
+
+    def _on_reload_signal(signum, frame):
+        # Loads the config on another thread, the handler returns right away
+        threading.Thread(target=core.reload, name="mmp-reload", daemon=True).start()
+
+    signal.signal(signal.SIGINT, _on_stop_signal)
+    signal.signal(signal.SIGTERM, _on_stop_signal)
+    if hasattr(signal, "SIGHUP"):
+        # Not on Windows
+        signal.signal(signal.SIGHUP, _on_reload_signal)
+    with STARTUP.phase("workers"):
+        core.start()
+
+    if startup_timing:
+        print(STARTUP.report())
+    if is_verbose:
+        print("Running headless, Ctrl+C to quit")
+
+    core.wait()
+    return 0
+# run_headless
+
+
+def run_recorder(action_name: str, is_verbose: bool, stop_hotkey: str = "esc", record_keys: bool = False,
+                 max_gap: Optional[float] = None) -> int:
+    """Record the mouse (or keyboard) until stop_hotkey is pressed & save it as ACTIONS[action_name], no GUI / serial
     Params:
-        config - Config object that has relevant info for the RETRY_COUNT, BAUDRATE, etc.
+        action_name - str, ACTIONS entry to save to
+        is_verbose - bool, Enable verbosity
+        stop_hotkey - str ["esc"], hotkey that stops recording
+        record_keys - bool [False], record the keyboard instead of the mouse
+        max_gap - Optional[float] [None], keyboard only, longest DELAY to keep between keys
     Returns:
-        Serial object of arduino / teensy
+        int, exit code
     """
-    # Load arduino serial connection
-    for tries in range(config.config["RETRY_COUNT"]):
-        # Start stuff we hope to do, raise exceptions if there's an issue
-        try:
-            # Get serial port name, if available
-            # TODO: Support args here
-            serial_port = get_serial_port_name(
-                name=config.serial["QUERY"], is_COM_name=False, verbose=config.verbose
-            )
-            if serial_port is None:
-                raise SerialNotFoundException(
-                    f"Failed to load serial port: {config.serial['QUERY']}")
-
-            # Get serial connection if we can
-            arduino = Serial(port=serial_port, baudrate=config.serial["BAUDRATE"],
-                             timeout=config.serial["TIMEOUT"])
-            if arduino is None:
-                raise SerialMountException(
-                    f"Failed to mount Serial port: {config.serial['QUERY']}")
-        # end stuff that we hope to do, handle the above exceptions w/ an error msg
-        except serial.SerialException as e:
-            print(e)
-            _msg = f"{str(e)}\n\nCheck if you have another instance open?"
-            messagebox.showerror(title=MSGBOX_TITLE, message=_msg)
-            sys.exit(0)
-        except CustomSerialException as e:
-            print(e)
-            _msg = f"{str(e)}\n\nWant to try loading again?"
-            if messagebox.askyesno(title=MSGBOX_TITLE, message=_msg):
-                continue
-            else:
-                _msg = f"{str(e)}\n\nWant to run in GUI only mode?"
-                if messagebox.askyesno(title=MSGBOX_TITLE, message=_msg):
-                    return None
-                sys.exit(0)
-            sys.exit(0)
-        except Exception as e:
-            print(e)
-            raise e
-            sys.exit(1)
-        # break the loop if loading succeeds
-        break
-    return arduino
-# end init_arduino
+    macro_manager = MacroManager(root_win=None, verbose=is_verbose)
+    print(f"Recording the {'keyboard' if record_keys else 'mouse'} for {action_name}, press {stop_hotkey} to stop")
+    if record_keys:
+        macro_manager.record_keys(action_name, stop_hotkey=stop_hotkey, max_gap=max_gap)
+    else:
+        macro_manager.record_mouse(action_name, stop_hotkey=stop_hotkey)
+    macro_manager.close()
+    return 0
+# run_recorder
 
 
-def arduino_listen_loop(arduino: Serial, macro_manager: MacroManager, window: Tk):
+def arduino_listen_loop(arduino: "Serial", macro_manager: MacroManager, action_queue: ActionQueue,
+                        on_close: Optional[Callable[[], None]] = None, device: dict = None):
     """
-    Handles serial comms & run actions if the arduino sends the right signal
+    Handles serial comms & queue actions if the arduino sends the right signal
+    Reads whatever bytes are waiting (in_waiting) instead of readline, so a press doesn't wait on SERIAL.TIMEOUT
     Params:
         arduino - Serial, the arduino's serial connection. If None then return (leave), else listen for button presses
         macro_manager - MacroManager, instance of the MacroManager class that's used elsewhere in the program
-        window - Tk, used to display a button press based on btn_pos
+        action_queue - ActionQueue, presses are submitted here. Runs the action & displays the press on the GUI
+        on_close - Optional[Callable[[], None]] [None], called when the device goes away
+        device - dict [None], which of config.devices this is (FRAMING, PANIC_CODE, OFFSET), default to the first
     """
     # GUI only mode
     if arduino is None:
         return
 
+    from serial import SerialException
+
+    device = macro_manager.config.serial if device is None else device
+    decoder = SerialDecoder(
+        framing=device.get("FRAMING", "AUTO"), verbose=macro_manager.verbose
+    )
+    # Long presses, double taps & chords, decided on timer threads
+    gestures = GestureRecognizer(
+        lambda: macro_manager.gestures, partial(macro_manager.submit_gesture, action_queue), verbose=macro_manager.verbose
+    )
+
     while True:
         try:
-            data = str(arduino.readline().decode().strip())
-            if data == "":
+            # Blocks until at least 1 byte shows up (or TIMEOUT), then grab everything that's waiting
+            chunk = arduino.read(arduino.in_waiting or 1)
+            if not chunk:
                 continue
-            if macro_manager.verbose:
-                print(data)
-            if "log:" in data:
-                print(data[4:])
-            if ":" not in data:
-                # Get button position from data
-
-                # NOTE: button position is NOT 0 indexed!
-                btn_pos = get_btn_pos(data, macro_manager)
-                # Run action
-                macro_manager.run_action(position=btn_pos)
-                # Display press on GUI
-                window.display_press(btn_pos)
-        except serial.serialutil.SerialException as e:
+            handle_chunk(chunk, decoder, macro_manager, action_queue, device, gestures)
+        except SerialException as e:
             print("Device disconnected?")
             print(e)
-            handle_close(macro_manager)
+            gestures.reset()
+            if on_close is not None:
+                on_close()
             return
     # end loop
 # arduino_listen_loop
 
 
-def get_btn_pos(data: str, macro_manager: MacroManager) -> int:
-    """Parse button position from serial data that's a number
-    (checks for macro_manager.config.actions.keys())
+def handle_chunk(chunk: bytes, decoder: SerialDecoder, macro_manager: MacroManager, action_queue: ActionQueue,
+                 device: dict, gestures: Optional[GestureRecognizer] = None) -> None:
+    """Decode bytes read from a pad & submit its button presses
     Params:
-        data - str, serial's readline that's been stripped
-    Returns:
-        int - btn_pos, 1 indexed
+        chunk - bytes, what was read from the serial port
+        decoder - SerialDecoder, this pad's decoder (keeps partial events between chunks)
+        macro_manager - MacroManager, for verbosity & panic()
+        action_queue - ActionQueue, presses are submitted here
+        device - dict, which of config.devices this is (PANIC_CODE, OFFSET)
+        gestures - Optional[GestureRecognizer] [None], this pad's recognizer. Buttons with gestures go thru it,
+                   the rest are submitted right away
     """
-    # NOTE: button position is NOT 0 indexed!
-    btn_pos = int(data)
-    if btn_pos > len(macro_manager.config.actions.keys()):
-        # 11 => 1
-        if len(str(btn_pos)) > 1:
-            btn_pos = int(str(btn_pos)[-1])
-    return btn_pos
-# get_btn_pos
+    t_recv = TRACER.now() if TRACER.enabled else 0
+    # Serial event that aborts every macro right away, instead of being queued
+    panic_code = device.get("PANIC_CODE")
+    # This pad's page of ACTIONS starts after OFFSET
+    offset = device.get("OFFSET", 0)
+    for data in decoder.feed(chunk):
+        if macro_manager.verbose:
+            print(data)
+        if "log:" in data:
+            print(data[4:])
+            continue
+        if ":" in data:
+            continue
+        if data == panic_code:
+            macro_manager.panic()
+            continue
+        # Get button position from data
+        # NOTE: button position is NOT 0 indexed!
+        btn_pos = get_btn_pos(data)
+        if btn_pos is None:
+            continue
+        btn_pos += offset
+        # The ACTIONS position this button runs on the current page (or the focused app's profile page)
+        position = macro_manager.resolve(btn_pos)
+        if not position:
+            page = macro_manager.pages.current().name
+            print(f"Nothing on button {btn_pos}{f' on page {page!r}' if page else ''}, add it to the config")
+            continue
+        btn_pos = position
+        if gestures is not None and gestures.is_bound(btn_pos):
+            gestures.press(btn_pos)
+            continue
+        # Queue the action, the GUI shows the press once it ran
+        if TRACER.enabled:
+            action_queue.submit(btn_pos, t_recv, TRACER.now())
+        else:
+            action_queue.submit(btn_pos)
+# handle_chunk
 
 
-def handle_close(macro_manager: MacroManager):
-    """
-    Handles the close button operation, cleanup stuff
-    TODO: Fix this!
+def get_btn_pos(data: str) -> Optional[int]:
+    """Parse button position from a decoded serial event that's a number
+    Params:
+        data - str, one event from SerialDecoder.feed
+    Returns:
+        Optional[int] - btn_pos, 1 indexed. None if data isn't a number
     """
-    if thread1 is not None:
-        do_close = True
-        macro_manager.root_win.destroy()
-        sys.exit(0)
-    else:
-        print("thread is none")
-        macro_manager.root_win.destroy()
-        sys.exit(0)
-    # stop thread1
-# end handle_close
+    # NOTE: button position is NOT 0 indexed!
+    try:
+        return int(data)
+    except ValueError:
+        print(f"Got unexpected serial data: {data}")
+        return None
+# get_btn_pos
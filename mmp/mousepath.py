@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+# mousepath.py - Eased mouse paths, precomputed when ACTIONS are compiled so moving the mouse is just emitting points
+from typing import Callable, Dict, List, Optional, Tuple
+
+
+def _ease_in_out(t: float) -> float:
+    """Cubic ease in & out"""
+    if t < 0.5:
+        return 4 * t * t * t
+    return 1 - (-2 * t + 2) ** 3 / 2
+# _ease_in_out
+
+
+# EASING name -> f(t), t & f(t) go from 0 to 1
+EASINGS: Dict[str, Callable[[float], float]] = {
+    "LINEAR": lambda t: t,
+    "EASE_IN": lambda t: t * t * t,
+    "EASE_OUT": lambda t: 1 - (1 - t) ** 3,
+    "EASE_IN_OUT": _ease_in_out,
+    # smoothstep, gentler than EASE_IN_OUT
+    "SMOOTH": lambda t: t * t * (3 - 2 * t),
+}
+
+
+def get_fractions(duration: float, rate: float, easing: str = "EASE_IN_OUT") -> Tuple[Tuple[float, ...], float]:
+    """Get how far along the path each point is, for a move that takes duration seconds at rate points per second
+    Params:
+        duration - float, seconds the move takes. 0 jumps right to the end
+        rate - float, points per second (CONFIG.MOUSE_RATE)
+        easing - str ["EASE_IN_OUT"], one of EASINGS
+    Returns:
+        Tuple[Tuple[float, ...], float], (fraction of the way for every point (the last is 1.0), seconds between points)
+    Raises:
+        ValueError if easing is unknown
+    """
+    if easing not in EASINGS:
+        raise ValueError(f"Unknown EASING {easing!r}, expected one of {list(EASINGS)}")
+    ease = EASINGS[easing]
+    count = max(1, round(duration * rate))
+    fractions = tuple(ease(i / count) for i in range(1, count + 1))
+    return (fractions, duration / count)
+# get_fractions
+
+
+def get_deltas(dx: int, dy: int, fractions: Tuple[float, ...]) -> Tuple[Tuple[int, ...], Tuple[int, ...]]:
+    """Get the relative moves for a path of dx, dy pixels. Rounded from the running total,
+    so the moves always add up to exactly dx, dy
+    Params:
+        dx - int, pixels to move right
+        dy - int, pixels to move down
+        fractions - Tuple[float, ...], from get_fractions
+    Returns:
+        Tuple[Tuple[int, ...], Tuple[int, ...]], (x moves, y moves), 1 per point
+    """
+    xs = [0] + [round(dx * f) for f in fractions]
+    ys = [0] + [round(dy * f) for f in fractions]
+    return (
+        tuple(xs[i] - xs[i - 1] for i in range(1, len(xs))),
+        tuple(ys[i] - ys[i - 1] for i in range(1, len(ys))),
+    )
+# get_deltas
+
+
+def scale_path(start: Tuple[int, int], end: Tuple[int, int],
+               fractions: Tuple[float, ...]) -> List[Tuple[int, int]]:
+    """Get the points of a path from start to end, all at once before they're emitted
+    Params:
+        start - Tuple[int, int], (x, y) where the mouse is now
+        end - Tuple[int, int], (x, y) to move to
+        fractions - Tuple[float, ...], from get_fractions
+    Returns:
+        List[Tuple[int, int]], absolute (x, y) points, the last one is end
+    """
+    x0, y0 = start
+    dx = end[0] - x0
+    dy = end[1] - y0
+    return [(round(x0 + dx * f), round(y0 + dy * f)) for f in fractions]
+# scale_path
+
+
+def parse_point(value, name: str = "point") -> Tuple[int, int]:
+    """Validate an [x, y] point
+    Params:
+        value - Any, from the config
+        name - str ["point"], what it is, for the error
+    Returns:
+        Tuple[int, int]
+    Raises:
+        ValueError if it's not 2 numbers
+    """
+    if (not isinstance(value, (list, tuple)) or len(value) != 2
+            or not all(isinstance(v, (int, float)) and not isinstance(v, bool) for v in value)):
+        raise ValueError(f"Expected {name} to be [x, y], got {value!r}")
+    return (round(value[0]), round(value[1]))
+# parse_point
+
+
+def parse_duration(value: Optional[float]) -> float:
+    """Validate a DURATION in seconds, None is 0 (jump)"""
+    if value is None:
+        return 0.0
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or value < 0:
+        raise ValueError(f"Expected DURATION to be a number >= 0, got {value!r}")
+    return float(value)
+# parse_duration
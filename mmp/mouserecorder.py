@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+# mouserecorder.py - Records the mouse into a compact timeline that MOUSE_PLAYBACK replays
+import base64
+import threading
+import time
+
+from array import array
+from typing import Iterator, List, Optional, Tuple
+
+# Event kinds in the timeline
+MOVE: int = 0
+DOWN: int = 1
+UP: int = 2
+WHEEL: int = 3
+
+# Button index in the timeline -> mouse module name (same order as ActionManager.MOUSE_BUTTONS)
+BUTTONS: List[str] = ["left", "right", "middle", "x", "x2"]
+# Wheel deltas are kept as ints, 120 per notch (like Windows)
+WHEEL_UNIT: int = 120
+TIMELINE_VERSION: int = 1
+
+
+def _put_varint(out: bytearray, value: int) -> None:
+    """Append a signed int as a zigzag varint (small numbers, + or -, take 1 byte)"""
+    value = value * 2 if value >= 0 else -value * 2 - 1
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+# _put_varint
+
+
+def _get_varints(data: bytes) -> Iterator[int]:
+    """Read every zigzag varint in data"""
+    value = 0
+    shift = 0
+    for byte in data:
+        value |= (byte & 0x7F) << shift
+        if byte & 0x80:
+            shift += 7
+            continue
+        yield value >> 1 if not value & 1 else -(value >> 1) - 1
+        value = 0
+        shift = 0
+    if shift:
+        raise ValueError("TIMELINE is cut off")
+# _get_varints
+
+
+def encode_timeline(start: Tuple[int, int], events: List[Tuple[int, int, int, int]]) -> dict:
+    """Encode recorded events as a MOUSE_PLAYBACK value.
+    Every event is varints: microseconds since the last event, kind, then dx, dy from the last position (MOVE),
+    the button (DOWN / UP) or the delta (WHEEL). Mostly 1 - 2 bytes each, then base64 so it fits in the JSON config
+    Params:
+        start - Tuple[int, int], (x, y) where the mouse was when recording started
+        events - List[Tuple[int, int, int, int]], (perf_counter_ns, kind, a, b) in order, the 1st time is the start
+    Returns:
+        dict, {"START": [x, y], "TIMELINE": str, "VERSION": int}
+    """
+    out = bytearray()
+    t0 = events[0][0] if events else 0
+    last_us = 0
+    last_x, last_y = start
+    for t, kind, a, b in events:
+        # Round each time to the microsecond, not each gap, so the rounding doesn't add up over the recording
+        t_us = (t - t0) // 1000
+        _put_varint(out, t_us - last_us)
+        _put_varint(out, kind)
+        if kind == MOVE:
+            _put_varint(out, a - last_x)
+            _put_varint(out, b - last_y)
+            last_x, last_y = a, b
+        else:
+            _put_varint(out, a)
+        last_us = t_us
+    return {"START": [start[0], start[1]], "TIMELINE": base64.b64encode(bytes(out)).decode("ascii"),
+            "VERSION": TIMELINE_VERSION}
+# encode_timeline
+
+
+def decode_timeline(value: dict, speed: float = 1.0) -> Tuple[Tuple[float, ...], Tuple[int, ...], Tuple[int, ...],
+                                                              Tuple[int, ...]]:
+    """Decode a MOUSE_PLAYBACK value into when / what to replay, once when ACTIONS are compiled
+    Params:
+        value - dict, from encode_timeline
+        speed - float [1.0], 2.0 plays it back twice as fast
+    Returns:
+        Tuple of 4 tuples, 1 item per event: (seconds after the start, kind, x / button / wheel delta, y)
+        Positions are absolute
+    Raises:
+        ValueError if value is invalid
+    """
+    if value.get("VERSION", TIMELINE_VERSION) != TIMELINE_VERSION:
+        raise ValueError(f"Unknown TIMELINE VERSION {value.get('VERSION')!r}")
+    try:
+        data = base64.b64decode(value["TIMELINE"], validate=True)
+    except Exception as e:
+        raise ValueError(f"TIMELINE isn't valid base64: {e}")
+    x, y = value["START"]
+    times, kinds, xs, ys = [], [], [], []
+    now_us = 0
+    varints = _get_varints(data)
+    try:
+        for dt in varints:
+            now_us += dt
+            kind = next(varints)
+            a = next(varints)
+            if kind == MOVE:
+                x += a
+                y += next(varints)
+                a, b = x, y
+            elif kind in (DOWN, UP, WHEEL):
+                b = 0
+            else:
+                raise ValueError(f"Unknown event kind {kind} in TIMELINE")
+            times.append(now_us / 1e6 / speed)
+            kinds.append(kind)
+            xs.append(a)
+            ys.append(b)
+    except StopIteration:
+        raise ValueError("TIMELINE is cut off")
+    return (tuple(times), tuple(kinds), tuple(xs), tuple(ys))
+# decode_timeline
+
+
+class MouseRecorder():
+    """Records mouse moves, buttons & the wheel until stop_hotkey is pressed.
+    1 mouse hook is installed for the whole recording. It only writes the event & a perf_counter_ns timestamp
+    into preallocated arrays (a ring buffer), so it keeps up with 1000 Hz mice. Waiting for the hotkey is an
+    Event, nothing polls. If more than capacity events come in, the oldest ones are overwritten.
+    Params:
+        capacity - int [262144], max events kept, rounded up to a power of 2
+        stop_hotkey - str ["esc"], hotkey that stops recording (keyboard module format, e.g. "ctrl+shift+r")
+        verbose - bool [False], verbosity
+    Methods:
+        record
+        stop
+        events
+        timeline
+    """
+
+    def __init__(self, capacity: int = 1 << 18, stop_hotkey: str = "esc", verbose: bool = False):
+        """Create MouseRecorder, imports mouse & keyboard"""
+        import keyboard
+        import mouse
+        self.keyboard = keyboard
+        self.mouse = mouse
+        self.verbose: bool = verbose
+        self.stop_hotkey: str = stop_hotkey
+
+        size = 1
+        while size < capacity:
+            size <<= 1
+        self.capacity: int = size
+        self._mask: int = size - 1
+        self._t: array = array("q", [0]) * size
+        self._kind: array = array("B", [0]) * size
+        self._a: array = array("i", [0]) * size
+        self._b: array = array("i", [0]) * size
+        # Events pushed so far, only the hook writes it
+        self._count: int = 0
+        self._stopped: threading.Event = threading.Event()
+        self.start_pos: Tuple[int, int] = (0, 0)
+        self.start_ns: int = 0
+    # __init__
+
+    def _on_event(self, event) -> None:
+        """The mouse hook, runs on the mouse module's thread. Just stores the event"""
+        t = time.perf_counter_ns()
+        mouse = self.mouse
+        if isinstance(event, mouse.MoveEvent):
+            kind, a, b = MOVE, event.x, event.y
+        elif isinstance(event, mouse.ButtonEvent):
+            if event.button not in BUTTONS:
+                return
+            # "double" is the 2nd down of a double click (Windows)
+            kind, a, b = (UP if event.event_type == "up" else DOWN), BUTTONS.index(event.button), 0
+        elif isinstance(event, mouse.WheelEvent):
+            kind, a, b = WHEEL, round(event.delta * WHEEL_UNIT), 0
+        else:
+            return
+        idx = self._count & self._mask
+        self._t[idx] = t
+        self._kind[idx] = kind
+        self._a[idx] = a
+        self._b[idx] = b
+        self._count += 1
+    # _on_event
+
+    def record(self, timeout: Optional[float] = None) -> dict:
+        """Record until stop_hotkey is pressed (or stop() / timeout)
+        Params:
+            timeout - Optional[float] [None], max seconds to record
+        Returns:
+            dict, the MOUSE_PLAYBACK value (see timeline)
+        """
+        self._count = 0
+        self._stopped.clear()
+        self.start_pos = tuple(self.mouse.get_position())
+        self.start_ns = time.perf_counter_ns()
+        hotkey = self.keyboard.add_hotkey(self.stop_hotkey, self.stop)
+        self.mouse.hook(self._on_event)
+        if self.verbose:
+            print(f"Recording the mouse, press {self.stop_hotkey} to stop")
+        try:
+            self._stopped.wait(timeout)
+        finally:
+            self.mouse.unhook(self._on_event)
+            self.keyboard.remove_hotkey(hotkey)
+        if self._count > self.capacity:
+            print(f"Recorded {self._count} mouse events, only the last {self.capacity} were kept")
+        elif self.verbose:
+            print(f"Recorded {self._count} mouse events")
+        return self.timeline()
+    # record
+
+    def stop(self) -> None:
+        """Stop recording"""
+        self._stopped.set()
+    # stop
+
+    def events(self) -> List[Tuple[int, int, int, int]]:
+        """Get the recorded events, oldest first
+        Returns:
+            List[Tuple[int, int, int, int]], (perf_counter_ns, kind, a, b)
+        """
+        count = self._count
+        first = max(0, count - self.capacity)
+        return [
+            (self._t[i & self._mask], self._kind[i & self._mask], self._a[i & self._mask], self._b[i & self._mask])
+            for i in range(first, count)
+        ]
+    # events
+
+    def timeline(self) -> dict:
+        """Get the recording as a MOUSE_PLAYBACK value (see encode_timeline)"""
+        events = self.events()
+        start = self.start_pos
+        if self._count > self.capacity:
+            # The start was overwritten, start where the 1st kept move is
+            start = next(((a, b) for _, kind, a, b in events if kind == MOVE), start)
+        else:
+            # Keep the pause before the 1st event
+            events.insert(0, (self.start_ns, MOVE, start[0], start[1]))
+        return encode_timeline(start, events)
+    # timeline
+
+# MouseRecorder
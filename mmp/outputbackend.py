@@ -0,0 +1,326 @@
+#!/usr/bin/env python3
+# outputbackend.py - Backends that send the keyboard events for ActionManager
+import os
+import struct
+import sys
+import threading
+import time
+
+from abc import ABC, abstractmethod
+from typing import Dict, List, Optional, Tuple
+
+try:
+    from fcntl import ioctl
+except ImportError:
+    # Windows, there's no uinput anyway
+    ioctl = None
+
+
+class OutputBackend(ABC):
+    """Base class for sending keyboard events. Keys use the keyboard module's names (e.g. "ctrl", "a", "enter")
+    Methods:
+        press
+        release
+        press_and_release
+        write
+        close
+    """
+    name: str = "BASE"
+
+    @abstractmethod
+    def press(self, key: str) -> None:
+        """Press down a key"""
+    # press
+
+    @abstractmethod
+    def release(self, key: str) -> None:
+        """Release a key"""
+    # release
+
+    def press_and_release(self, key: str) -> None:
+        """Press & release a key"""
+        self.press(key)
+        self.release(key)
+    # press_and_release
+
+    def press_keys(self, keys: List[str]) -> None:
+        """Press down every key in keys, in order (e.g. a hotkey)"""
+        for key in keys:
+            self.press(key)
+    # press_keys
+
+    def release_keys(self, keys: List[str]) -> None:
+        """Release every key in keys, in order"""
+        for key in keys:
+            self.release(key)
+    # release_keys
+
+    @abstractmethod
+    def write(self, text: str, delay: float = 0) -> None:
+        """Type text
+        Params:
+            text - str, text to type
+            delay - float [0], seconds between characters (pacing). 0 sends everything at once if the backend can
+        """
+    # write
+
+    def close(self) -> None:
+        """Release resources"""
+        pass
+    # close
+
+# OutputBackend
+
+
+class KeyboardBackend(OutputBackend):
+    """Sends every event on its own with the keyboard module. Works everywhere, this is the fallback
+    The keyboard module is imported when the backend is created, not when mmp is imported
+    """
+    name: str = "KEYBOARD"
+
+    def __init__(self):
+        import keyboard
+        self.keyboard = keyboard
+
+    def press(self, key: str) -> None:
+        self.keyboard.press(key)
+
+    def release(self, key: str) -> None:
+        self.keyboard.release(key)
+
+    def press_and_release(self, key: str) -> None:
+        self.keyboard.press_and_release(key)
+
+    def write(self, text: str, delay: float = 0) -> None:
+        self.keyboard.write(text, delay)
+
+# KeyboardBackend
+
+
+def _us_chars() -> Dict[str, Tuple[int, bool]]:
+    """Get the US layout character -> (keycode, needs shift) table for UinputBackend"""
+    chars: Dict[str, Tuple[int, bool]] = {}
+    for row, keys, shifted in (
+        (2, "1234567890-=", "!@#$%^&*()_+"),
+        (16, "qwertyuiop[]", "QWERTYUIOP{}"),
+        (30, "asdfghjkl;'`", "ASDFGHJKL:\"~"),
+        (43, "\\zxcvbnm,./", "|ZXCVBNM<>?"),
+    ):
+        for idx, (key, shift) in enumerate(zip(keys, shifted)):
+            chars[key] = (row + idx, False)
+            chars[shift] = (row + idx, True)
+    chars[" "] = (57, False)
+    chars["\n"] = (28, False)
+    chars["\t"] = (15, False)
+    return chars
+# _us_chars
+
+
+class UinputBackend(OutputBackend):
+    """Linux only, creates a virtual keyboard with /dev/uinput & writes a whole string (or hotkey)
+    as one batch of input events, instead of 1 syscall + scheduling hop per event.
+    Keys / characters that aren't on the US layout map below are sent with the fallback backend.
+    Params:
+        fallback - OutputBackend, used for anything this backend can't map
+        batch_chars - int [32], max characters per write, so a long string doesn't overflow the readers' event buffers
+        verbose - bool [False], verbosity
+    """
+    name: str = "UINPUT"
+
+    # linux/input-event-codes.h & linux/uinput.h
+    EV_SYN: int = 0x00
+    EV_KEY: int = 0x01
+    SYN_REPORT: int = 0
+    UI_SET_EVBIT: int = 0x40045564
+    UI_SET_KEYBIT: int = 0x40045565
+    UI_DEV_SETUP: int = 0x405C5503
+    UI_DEV_CREATE: int = 0x5501
+    UI_DEV_DESTROY: int = 0x5502
+    BUS_VIRTUAL: int = 0x06
+    EVENT_FORMAT: str = "llHHi"
+
+    KEY_LEFTSHIFT: int = 42
+    # key name -> keycode, names follow the keyboard module
+    KEYCODES: Dict[str, int] = {
+        "esc": 1, "escape": 1, "backspace": 14, "tab": 15, "enter": 28, "return": 28,
+        "ctrl": 29, "left ctrl": 29, "shift": 42, "left shift": 42, "right shift": 54,
+        "alt": 56, "left alt": 56, "space": 57, "caps lock": 58,
+        "f1": 59, "f2": 60, "f3": 61, "f4": 62, "f5": 63, "f6": 64, "f7": 65, "f8": 66, "f9": 67, "f10": 68,
+        "f11": 87, "f12": 88, "right ctrl": 97, "right alt": 100, "alt gr": 100,
+        "home": 102, "up": 103, "page up": 104, "left": 105, "right": 106, "end": 107, "down": 108,
+        "page down": 109, "insert": 110, "delete": 111,
+        "windows": 125, "win": 125, "left windows": 125, "command": 125, "right windows": 126, "menu": 127,
+    }
+    # character -> (keycode, needs shift)
+    CHARS: Dict[str, Tuple[int, bool]] = _us_chars()
+
+    def __init__(self, fallback: OutputBackend, batch_chars: int = 32, verbose: bool = False):
+        """Open /dev/uinput & create the virtual keyboard. Raises OSError if that's not possible"""
+        self.verbose: bool = verbose
+        self.fallback: OutputBackend = fallback
+        self.batch_chars: int = max(1, batch_chars)
+        self._lock: threading.Lock = threading.Lock()
+        self._fd: int = os.open("/dev/uinput", os.O_WRONLY | os.O_NONBLOCK)
+        try:
+            ioctl(self._fd, UinputBackend.UI_SET_EVBIT, UinputBackend.EV_KEY)
+            ioctl(self._fd, UinputBackend.UI_SET_EVBIT, UinputBackend.EV_SYN)
+            for code in range(1, 128):
+                ioctl(self._fd, UinputBackend.UI_SET_KEYBIT, code)
+            # struct uinput_setup { struct input_id id; char name[80]; __u32 ff_effects_max; }
+            setup = struct.pack("HHHH80sI", UinputBackend.BUS_VIRTUAL, 0x1209, 0x4D4D, 1, b"MiniMacroPad", 0)
+            ioctl(self._fd, UinputBackend.UI_DEV_SETUP, setup)
+            ioctl(self._fd, UinputBackend.UI_DEV_CREATE)
+        except OSError:
+            os.close(self._fd)
+            raise
+        # Give the desktop a moment to pick up the new device
+        time.sleep(0.1)
+    # __init__
+
+    def _event(self, etype: int, code: int, value: int) -> bytes:
+        """Pack 1 struct input_event, the kernel fills in the time"""
+        return struct.pack(UinputBackend.EVENT_FORMAT, 0, 0, etype, code, value)
+    # _event
+
+    def _key(self, code: int, value: int) -> bytes:
+        """Key event + SYN_REPORT"""
+        return self._event(UinputBackend.EV_KEY, code, value) + self._event(UinputBackend.EV_SYN, UinputBackend.SYN_REPORT, 0)
+    # _key
+
+    def _char_events(self, char: str) -> bytes:
+        """All the events to type char"""
+        code, shift = UinputBackend.CHARS[char]
+        if shift:
+            return (self._key(UinputBackend.KEY_LEFTSHIFT, 1) + self._key(code, 1) +
+                    self._key(code, 0) + self._key(UinputBackend.KEY_LEFTSHIFT, 0))
+        return self._key(code, 1) + self._key(code, 0)
+    # _char_events
+
+    def _flush(self, events: bytes) -> None:
+        """Write a batch of events in 1 syscall"""
+        with self._lock:
+            os.write(self._fd, events)
+    # _flush
+
+    def _keycode(self, key: str) -> Optional[int]:
+        """Get the keycode for a key name, None if it's not mapped"""
+        key = key.lower()
+        if key in UinputBackend.KEYCODES:
+            return UinputBackend.KEYCODES[key]
+        if len(key) == 1 and key in UinputBackend.CHARS:
+            return UinputBackend.CHARS[key][0]
+        return None
+    # _keycode
+
+    def press(self, key: str) -> None:
+        code = self._keycode(key)
+        if code is None:
+            self.fallback.press(key)
+            return
+        self._flush(self._key(code, 1))
+
+    def release(self, key: str) -> None:
+        code = self._keycode(key)
+        if code is None:
+            self.fallback.release(key)
+            return
+        self._flush(self._key(code, 0))
+
+    def press_keys(self, keys: List[str]) -> None:
+        codes = [self._keycode(k) for k in keys]
+        if None in codes:
+            super().press_keys(keys)
+            return
+        self._flush(b"".join(self._key(c, 1) for c in codes))
+
+    def release_keys(self, keys: List[str]) -> None:
+        codes = [self._keycode(k) for k in keys]
+        if None in codes:
+            super().release_keys(keys)
+            return
+        self._flush(b"".join(self._key(c, 0) for c in codes))
+
+    def press_and_release(self, key: str) -> None:
+        # Hotkey strings like "ctrl+c" are sent as 1 batch: press all in order, release in reverse
+        codes = [self._keycode(k.strip()) for k in key.split("+")] if key != "+" else [self._keycode(key)]
+        if None in codes:
+            self.fallback.press_and_release(key)
+            return
+        self._flush(b"".join(self._key(c, 1) for c in codes) + b"".join(self._key(c, 0) for c in reversed(codes)))
+
+    def write(self, text: str, delay: float = 0) -> None:
+        if any(char not in UinputBackend.CHARS for char in text):
+            self.fallback.write(text, delay)
+            return
+        if delay:
+            # Paced, 1 character at a time
+            for char in text:
+                self._flush(self._char_events(char))
+                time.sleep(delay)
+            return
+        for start in range(0, len(text), self.batch_chars):
+            self._flush(b"".join(self._char_events(char) for char in text[start:start + self.batch_chars]))
+
+    def close(self) -> None:
+        try:
+            ioctl(self._fd, UinputBackend.UI_DEV_DESTROY)
+        finally:
+            os.close(self._fd)
+
+# UinputBackend
+
+
+class RecordingBackend(OutputBackend):
+    """Doesn't send anything, timestamps (perf_counter_ns) every event instead. Used by mmp.benchmark"""
+    name: str = "RECORD"
+
+    def __init__(self):
+        self.events: List[Tuple[int, str, str]] = []
+        self._lock: threading.Lock = threading.Lock()
+    # __init__
+
+    def _record(self, kind: str, value: str) -> None:
+        """Save a (perf_counter_ns, kind, value) event"""
+        t = time.perf_counter_ns()
+        with self._lock:
+            self.events.append((t, kind, value))
+    # _record
+
+    def press(self, key: str) -> None:
+        self._record("press", key)
+
+    def release(self, key: str) -> None:
+        self._record("release", key)
+
+    def press_and_release(self, key: str) -> None:
+        self._record("press_and_release", key)
+
+    def write(self, text: str, delay: float = 0) -> None:
+        self._record("write", text)
+
+# RecordingBackend
+
+
+def get_output_backend(name: str = "KEYBOARD", verbose: bool = False) -> OutputBackend:
+    """Create the output backend from CONFIG.OUTPUT, falling back to KEYBOARD if it can't be used
+    Params:
+        name - str ["KEYBOARD"], KEYBOARD or UINPUT
+        verbose - bool [False], verbosity
+    Returns:
+        OutputBackend
+    """
+    name = name.upper()
+    fallback = KeyboardBackend()
+    if name == "UINPUT":
+        if not sys.platform.startswith("linux") or ioctl is None:
+            print("OUTPUT UINPUT is only supported on Linux, using KEYBOARD")
+            return fallback
+        try:
+            return UinputBackend(fallback, verbose=verbose)
+        except OSError as e:
+            print(f"Failed to open /dev/uinput, using KEYBOARD: {e}")
+            return fallback
+    if name != "KEYBOARD":
+        print(f"Unknown OUTPUT {name}, using KEYBOARD")
+    return fallback
+# get_output_backend
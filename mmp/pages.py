@@ -0,0 +1,293 @@
+#!/usr/bin/env python3
+# pages.py - Named pages (layers) of buttons, each compiled once into a button -> ACTIONS position table
+import threading
+import time
+
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+
+from mmp.config import Config
+from mmp.util import MacroCompileException
+
+# Name of the only page when the config has no PAGES, ACTIONS in order
+DEFAULT_PAGE: str = ""
+
+# Actions that switch pages
+PAGE_ACTIONS: List[str] = ["PAGE_TO", "PAGE_TOGGLE", "PAGE_MOMENTARY"]
+
+
+class Page(NamedTuple):
+    """1 page, compiled once (see compile_pages). Resolving a press is 1 index into positions"""
+    name: str
+    # Index is the button number (OFFSET added), value the ACTIONS position it runs. 0 = nothing
+    positions: Tuple[int, ...]
+    # ACTIONS name on each button, same indexes. None = nothing
+    names: Tuple[Optional[str], ...]
+    # Grid size, {"x": columns, "y": rows}
+    size: Dict[str, int]
+    # Button -> (PAGE_* action, page) it switches with, applied as soon as the button is pressed
+    switches: Dict[int, Tuple[str, str]]
+
+    def get_position(self, button: int) -> int:
+        """Get the ACTIONS position for a button, 0 if there's nothing on it"""
+        return self.positions[button] if 0 < button < len(self.positions) else 0
+    # get_position
+
+# Page
+
+
+def compile_pages(config: Config, plans: list) -> Tuple[Dict[str, Page], str]:
+    """Compile PAGES into 1 table per page. Without PAGES there's 1 page (DEFAULT_PAGE) with ACTIONS in order
+    Params:
+        config - Config, config to compile
+        plans - List[Optional[MacroPlan]], the compiled ACTIONS, to check PAGE_* steps & find the buttons that switch
+    Returns:
+        Tuple[Dict[str, Page], str], (page name -> Page, the page to start on)
+    Raises:
+        MacroCompileException if PAGES has problems
+    """
+    action_names = list(config.actions.keys())
+    positions = {name: idx for idx, name in enumerate(action_names, start=1)}
+    _pages = config.pages
+    if not _pages:
+        names = (None,) + tuple(action_names)
+        page_positions = tuple(range(len(names)))
+        page = Page(DEFAULT_PAGE, page_positions, names, config.size, _get_switches(page_positions, plans))
+        _check_page_steps({DEFAULT_PAGE: page}, plans)
+        return ({DEFAULT_PAGE: page}, DEFAULT_PAGE)
+
+    errors: List[str] = []
+    pages: Dict[str, Page] = {}
+    for name, _page in _pages.items():
+        if not isinstance(_page, dict) or not isinstance(_page.get("BUTTONS"), list):
+            errors.append(f"PAGES.{name}: expected {{\"BUTTONS\": [ACTIONS names]}}, got {_page!r}")
+            continue
+        size = _page.get("SIZE", config.size)
+        if not isinstance(size, dict) or not all(isinstance(size.get(k), int) and size[k] > 0 for k in ("x", "y")):
+            errors.append(f"PAGES.{name}.SIZE: expected {{\"x\": int, \"y\": int}}, got {size!r}")
+            continue
+        page_positions = [0]
+        page_names: List[Optional[str]] = [None]
+        for idx, action_name in enumerate(_page["BUTTONS"], start=1):
+            if action_name is not None and action_name not in positions:
+                errors.append(f"PAGES.{name} button {idx}: {action_name!r} isn't in ACTIONS")
+                action_name = None
+            page_positions.append(positions[action_name] if action_name is not None else 0)
+            page_names.append(action_name)
+        pages[name] = Page(name, tuple(page_positions), tuple(page_names), size, _get_switches(page_positions, plans))
+
+    try:
+        _check_page_steps(pages, plans)
+    except MacroCompileException as e:
+        errors.append(str(e))
+    if errors:
+        raise MacroCompileException("Failed to compile PAGES:\n  " + "\n  ".join(errors))
+    return (pages, next(iter(pages)))
+# compile_pages
+
+
+def _get_switches(positions: Tuple[int, ...], plans: list) -> Dict[int, Tuple[str, str]]:
+    """Get the button -> (PAGE_* action, page) table of a page, the last PAGE_* step of a plan wins
+    Params:
+        positions - Tuple[int, ...], index is the button number, value the ACTIONS position
+        plans - List[Optional[MacroPlan]], the compiled ACTIONS
+    """
+    switches = {}
+    for button, position in enumerate(positions):
+        plan = plans[position] if 0 < position < len(plans) else None
+        for step in (plan.steps if plan is not None else ()):
+            if step.name in PAGE_ACTIONS:
+                switches[button] = (step.name, step.args[0])
+    return switches
+# _get_switches
+
+
+def _check_page_steps(pages: Dict[str, Page], plans: list) -> None:
+    """Make sure every PAGE_* step switches to a page that's there
+    Raises:
+        MacroCompileException if one doesn't
+    """
+    for plan in plans:
+        for step in (plan.steps if plan is not None else ()):
+            if step.name in PAGE_ACTIONS and step.args[0] not in pages:
+                raise MacroCompileException(f"{plan.name} ({step.name}): {step.args[0]!r} isn't in PAGES")
+# _check_page_steps
+
+
+class PageManager():
+    """Which page is showing & turns button presses into ACTIONS positions with it.
+    Every page is compiled up front, so switching is swapping 1 reference & resolving a press is 1 index.
+    A button with a PAGE_* step switches as soon as it's resolved, before its macro is even queued, so the next press
+    already uses the new page. The PAGE_* steps themselves do nothing (see ActionManager.do_page_step).
+    The pad doesn't send releases, so a PAGE_MOMENTARY page stays while its button keeps repeating (a held button
+    is sent every ~150 ms) & goes away once it hasn't been sent for release seconds. Checked on the next press
+    or current() call, nothing polls.
+    Params:
+        release - float [0.4], seconds without a repeat before a PAGE_MOMENTARY page goes away
+        verbose - bool [False], verbosity
+    Methods:
+        set_pages
+        current
+        resolve
+        press
+        switch
+        toggle
+        hold
+    """
+
+    def __init__(self, release: float = 0.4, verbose: bool = False):
+        """Create PageManager, with no pages until set_pages"""
+        self.verbose: bool = verbose
+        self.release: float = release
+        self.pages: Dict[str, Page] = {}
+        # The page that's on (PAGE_TO / PAGE_TOGGLE)
+        self.page: Optional[Page] = None
+        # Page PAGE_TOGGLE goes back to
+        self._previous: Optional[str] = None
+        # PAGE_MOMENTARY page, the button holding it & until when
+        self._held: Optional[Page] = None
+        self._held_button: int = 0
+        self._held_until: float = 0.0
+        # ACTIONS position -> (PAGE_* action, page), for presses that aren't resolved from a button (see press)
+        self._by_position: Dict[int, Tuple[str, str]] = {}
+        self._lock: threading.Lock = threading.Lock()
+    # __init__
+
+    def set_pages(self, pages: Dict[str, Page], start: str, release: float = None) -> None:
+        """Swap in newly compiled pages, staying on the same page if it's still there
+        Params:
+            pages - Dict[str, Page], from compile_pages
+            start - str, page to go to if the current one is gone
+            release - float [None], new release, None keeps it
+        """
+        with self._lock:
+            name = self.page.name if self.page is not None else start
+            self.pages = pages
+            self.page = pages.get(name, pages[start])
+            if self._previous not in pages:
+                self._previous = None
+            if self._held is not None:
+                self._held = pages.get(self._held.name)
+            if release is not None:
+                self.release = release
+            self._by_position = {
+                page.positions[button]: switch for page in pages.values() for button, switch in page.switches.items()
+            }
+    # set_pages
+
+    def current(self, now: float = None) -> Page:
+        """Get the page presses go to right now (a held PAGE_MOMENTARY page, else the page that's on)
+        Params:
+            now - float [None], time.monotonic()
+        """
+        held = self._held
+        if held is None:
+            return self.page
+        now = time.monotonic() if now is None else now
+        if now <= self._held_until:
+            return held
+        with self._lock:
+            if self._held is held and now > self._held_until:
+                self._held = None
+                self._held_button = 0
+                if self.verbose:
+                    print(f"Released page {held.name!r}, back to {self.page.name!r}")
+        return self._held if self._held is not None else self.page
+    # current
+
+    def resolve(self, button: int, now: float = None, deferred: Callable[[int], bool] = None) -> int:
+        """Turn a button press (OFFSET added) into the ACTIONS position it runs on the current page.
+        A button with a PAGE_* step switches right away, so the next press already uses the new page
+        Params:
+            button - int, 1 indexed button number
+            now - float [None], time.monotonic() it was read
+            deferred - Callable[[int], bool] [None], True for positions that don't switch here
+                       (e.g. GestureTable.is_bound, they switch with press() once their gesture is decided)
+        Returns:
+            int, ACTIONS position, 0 if there's nothing on that button
+        """
+        now = time.monotonic() if now is None else now
+        if self._held is not None and button == self._held_button:
+            # A repeat of the button holding the page, it's still held
+            self._held_until = now + self.release
+            return self.page.get_position(button)
+        page = self.current(now)
+        position = page.get_position(button)
+        target = page.switches.get(button)
+        if target is not None and (deferred is None or not deferred(position)):
+            self._apply(target, button, now)
+        return position
+    # resolve
+
+    def press(self, position: int) -> None:
+        """Switch pages for an ACTIONS position that wasn't resolved from a pad button (GUI clicks, gestures)
+        Params:
+            position - int, 1 indexed ACTIONS position
+        """
+        target = self._by_position.get(position)
+        if target is not None:
+            self._apply(target)
+    # press
+
+    def _apply(self, target: Tuple[str, str], button: int = 0, now: float = None) -> None:
+        """Run a (PAGE_* action, page) switch
+        Params:
+            target - Tuple[str, str], from Page.switches
+            button - int [0], pad button that was pressed, 0 for GUI clicks & gestures
+            now - float [None], time.monotonic()
+        """
+        action, name = target
+        if action == "PAGE_TO":
+            self.switch(name)
+        elif action == "PAGE_TOGGLE":
+            self.toggle(name)
+        else:
+            self.hold(name, button, now)
+    # _apply
+
+    def switch(self, name: str) -> None:
+        """Turn a page on (PAGE_TO)
+        Params:
+            name - str, PAGES name
+        """
+        with self._lock:
+            page = self.pages[name]
+            if page is not self.page:
+                self._previous = self.page.name
+                self.page = page
+                self._held = None
+        if self.verbose:
+            print(f"Page {name!r}")
+    # switch
+
+    def toggle(self, name: str) -> None:
+        """Turn a page on, or if it's already on go back to the page before it (PAGE_TOGGLE)
+        Params:
+            name - str, PAGES name
+        """
+        if self.page.name == name and self._previous is not None:
+            self.switch(self._previous)
+        else:
+            self.switch(name)
+    # toggle
+
+    def hold(self, name: str, button: int = 0, now: float = None) -> None:
+        """Hold a page for release seconds (PAGE_MOMENTARY), again if it's already held
+        Params:
+            name - str, PAGES name
+            button - int [0], button holding it, its repeats keep it held. 0 for GUI clicks
+            now - float [None], time.monotonic()
+        """
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            page = self.pages[name]
+            if self._held is not page:
+                if self.verbose:
+                    print(f"Holding page {name!r}")
+                self._held = page
+                self._held_button = button
+            elif button:
+                self._held_button = button
+            self._held_until = now + self.release
+    # hold
+
+# PageManager
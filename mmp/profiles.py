@@ -0,0 +1,395 @@
+#!/usr/bin/env python3
+# profiles.py - Per application profiles: switch PAGES depending on the focused window
+import re
+import shutil
+import subprocess
+import sys
+import threading
+import time
+
+from typing import Callable, Dict, List, NamedTuple, Optional, Pattern, Tuple
+
+from mmp.config import Config
+from mmp.util import MacroCompileException
+
+# Seconds between lookups of the focused window, presses only read the last one
+DEFAULT_TTL: float = 0.25
+# Max windows whose matched page is remembered, it's cleared once it's full
+MATCH_CACHE_SIZE: int = 256
+
+# Global inline flags, e.g. "(?i)" (a "(?i:" scoped group doesn't match)
+GLOBAL_FLAGS: Pattern = re.compile(r"\(\?([aiLmsux]+)\)")
+# An odd number of backslashes then a digit (\1), or a numbered conditional (?(1)...)
+NUMBERED_GROUP_REF: Pattern = re.compile(r"(?<!\\)(?:\\\\)*\\[1-9]|\(\?\(\d")
+
+
+class WindowInfo(NamedTuple):
+    """The focused window"""
+    # Window class, e.g. "Code", "firefox" (X11 WM_CLASS class, Windows class name)
+    wm_class: str
+    title: str
+# WindowInfo
+
+
+WindowProvider = Callable[[], Optional[WindowInfo]]
+
+
+def _windows_provider() -> WindowProvider:
+    """Focused window on Windows, straight from user32 (no extra packages, a few microseconds)"""
+    import ctypes
+    user32 = ctypes.windll.user32
+    buf = ctypes.create_unicode_buffer(512)
+
+    def get_window() -> Optional[WindowInfo]:
+        hwnd = user32.GetForegroundWindow()
+        if not hwnd:
+            return None
+        user32.GetClassNameW(hwnd, buf, len(buf))
+        wm_class = buf.value
+        user32.GetWindowTextW(hwnd, buf, len(buf))
+        return WindowInfo(wm_class, buf.value)
+    return get_window
+# _windows_provider
+
+
+def _xlib_provider() -> WindowProvider:
+    """Focused window on X11 with python-xlib, 1 connection kept open"""
+    from Xlib import X, display
+    _display = display.Display()
+    root = _display.screen().root
+    active_atom = _display.intern_atom("_NET_ACTIVE_WINDOW")
+    name_atom = _display.intern_atom("_NET_WM_NAME")
+    utf8_atom = _display.intern_atom("UTF8_STRING")
+
+    def get_window() -> Optional[WindowInfo]:
+        prop = root.get_full_property(active_atom, X.AnyPropertyType)
+        if prop is None or not prop.value or not prop.value[0]:
+            return None
+        window = _display.create_resource_object("window", prop.value[0])
+        wm_class = window.get_wm_class() or ("", "")
+        name = window.get_full_property(name_atom, utf8_atom)
+        title = name.value.decode("utf-8", "replace") if name is not None else (window.get_wm_name() or "")
+        return WindowInfo(wm_class[1], title)
+    return get_window
+# _xlib_provider
+
+
+def _xprop_provider(xprop: str) -> WindowProvider:
+    """Focused window on X11 with the xprop command, when python-xlib isn't installed (a few ms per call)"""
+    id_re = re.compile(r"window id # (0x[0-9a-fA-F]+)")
+    class_re = re.compile(r'WM_CLASS\(STRING\) = "[^"]*", "([^"]*)"')
+    title_re = re.compile(r'_NET_WM_NAME\(UTF8_STRING\) = "(.*)"')
+
+    def get_window() -> Optional[WindowInfo]:
+        out = subprocess.run([xprop, "-root", "_NET_ACTIVE_WINDOW"], capture_output=True, text=True).stdout
+        match = id_re.search(out)
+        if match is None or int(match.group(1), 16) == 0:
+            return None
+        out = subprocess.run([xprop, "-id", match.group(1), "WM_CLASS", "_NET_WM_NAME"],
+                             capture_output=True, text=True).stdout
+        wm_class = class_re.search(out)
+        title = title_re.search(out)
+        return WindowInfo(wm_class.group(1) if wm_class else "", title.group(1) if title else "")
+    return get_window
+# _xprop_provider
+
+
+def get_window_provider(name: str = "AUTO", verbose: bool = False) -> Optional[WindowProvider]:
+    """Get a function that returns the focused window
+    Params:
+        name - str ["AUTO"], CONFIG.PROFILES.PROVIDER: AUTO, WINDOWS, XLIB or XPROP
+        verbose - bool [False], verbosity
+    Returns:
+        Optional[WindowProvider], None if there's no way to get the focused window here
+    """
+    name = name.upper()
+    try:
+        if name == "WINDOWS" or (name == "AUTO" and sys.platform.startswith("win")):
+            return _windows_provider()
+        if name in ("AUTO", "XLIB"):
+            try:
+                return _xlib_provider()
+            except ImportError:
+                if name == "XLIB":
+                    raise
+        if name in ("AUTO", "XPROP"):
+            xprop = shutil.which("xprop")
+            if xprop is not None:
+                return _xprop_provider(xprop)
+    except Exception as e:
+        print(f"Failed to set up the {name} window provider: {e}")
+        return None
+    if verbose:
+        print(f"No window provider ({name}) here, PROFILES won't switch pages")
+    return None
+# get_window_provider
+
+
+class ProfileRules(NamedTuple):
+    """CONFIG.PROFILES.RULES compiled (see compile_profiles). Rules are checked in order, the 1st match wins"""
+    # PAGES name of each rule
+    pages: Tuple[str, ...]
+    # Lower case CLASS (None = any class) -> (1st rule with only that CLASS, TITLE rules for it in 1 regex)
+    by_class: Dict[Optional[str], Tuple[Optional[int], Optional[Pattern]]]
+    # Page when no rule matches, None leaves the page as is
+    default: Optional[str]
+
+    def match(self, window: WindowInfo) -> Optional[str]:
+        """Get the page for a window
+        Params:
+            window - WindowInfo, the focused window
+        Returns:
+            Optional[str], PAGES name, default if no rule matches
+        """
+        best = None
+        for key in (window.wm_class.lower(), None):
+            entry = self.by_class.get(key)
+            if entry is None:
+                continue
+            idx, regex = entry
+            if regex is not None:
+                match = regex.match(window.title)
+                if match is not None:
+                    # lastgroup is the rule's own group, it closes last
+                    title_idx = int(match.lastgroup[1:])
+                    idx = title_idx if idx is None else min(idx, title_idx)
+            if idx is not None and (best is None or idx < best):
+                best = idx
+        return self.pages[best] if best is not None else self.default
+    # match
+
+# ProfileRules
+
+
+def _title_pattern(title: str) -> str:
+    """Check a TITLE regex & wrap it in a group, so it can go in the combined regex of compile_profiles.
+    Leading global flags (e.g. "(?i)term") become scoped flags ("(?i:term)"), they can't be in the middle of a regex.
+    Numeric backreferences & conditionals are rejected, the group numbers move once the patterns are combined
+    Params:
+        title - str, PROFILES.RULES[].TITLE
+    Returns:
+        str, the pattern in a (?:...) or (?flags:...) group
+    Raises:
+        re.error if it's not a regex, TypeError if it's not a str, ValueError if it can't be combined
+    """
+    re.compile(title)
+    if NUMBERED_GROUP_REF.search(title):
+        raise ValueError("numbered backreferences (\\1, (?(1)...)) can't be used, use a named group: (?P<name>...) & (?P=name)")
+    flags = GLOBAL_FLAGS.match(title)
+    if flags is None:
+        return f"(?:{title})"
+    if GLOBAL_FLAGS.search(title, flags.end()):
+        raise ValueError("global flags (e.g. (?i)) can only be at the start")
+    # A (?x) comment runs to the end of the line, keep it from swallowing the closing ")"
+    end = "\n)" if "x" in flags.group(1) else ")"
+    return f"(?{flags.group(1)}:{title[flags.end():]}{end}"
+# _title_pattern
+
+
+def get_ttl(config: Config) -> float:
+    """Get CONFIG.PROFILES.TTL, seconds the focused window is cached for"""
+    ttl = config.config.get("PROFILES", {}).get("TTL", DEFAULT_TTL)
+    if isinstance(ttl, bool) or not isinstance(ttl, (int, float)) or ttl < 0:
+        raise MacroCompileException(f"Expected PROFILES.TTL to be a number >= 0, got {ttl!r}")
+    return float(ttl)
+# get_ttl
+
+
+def compile_profiles(config: Config, pages: Dict[str, object]) -> Optional[ProfileRules]:
+    """Compile CONFIG.PROFILES.RULES. Rules with a CLASS are a dict lookup, the TITLE patterns for the same
+    CLASS are 1 combined regex (a named group per rule), so a match is at most 2 lookups & 2 regexes
+    Params:
+        config - Config, config to compile
+        pages - Dict[str, Page], compiled PAGES (from compile_pages), rules have to switch to one of them
+    Returns:
+        Optional[ProfileRules], None if there's no PROFILES
+    Raises:
+        MacroCompileException if PROFILES has problems
+    """
+    profiles = config.config.get("PROFILES")
+    if not profiles:
+        return None
+    rules = profiles.get("RULES", [])
+    if not isinstance(rules, list):
+        raise MacroCompileException(f"PROFILES.RULES: expected a list, got {rules!r}")
+    errors: List[str] = []
+    rule_pages: List[str] = []
+    class_only: Dict[Optional[str], int] = {}
+    titles: Dict[Optional[str], List[str]] = {}
+    for idx, rule in enumerate(rules):
+        if not isinstance(rule, dict) or not ({"CLASS", "TITLE"} & rule.keys()):
+            errors.append(f"PROFILES.RULES[{idx}]: expected {{\"CLASS\" and / or \"TITLE\", \"PAGE\"}}, got {rule!r}")
+            rule_pages.append("")
+            continue
+        page = rule.get("PAGE")
+        if page not in pages:
+            errors.append(f"PROFILES.RULES[{idx}]: PAGE {page!r} isn't in PAGES")
+        rule_pages.append(page)
+        wm_class = rule.get("CLASS")
+        if wm_class is not None and not isinstance(wm_class, str):
+            errors.append(f"PROFILES.RULES[{idx}]: expected CLASS to be a str, got {wm_class!r}")
+            continue
+        key = wm_class.lower() if wm_class is not None else None
+        if "TITLE" not in rule:
+            class_only.setdefault(key, idx)
+            continue
+        try:
+            title = _title_pattern(rule["TITLE"])
+        except (re.error, TypeError, ValueError) as e:
+            errors.append(f"PROFILES.RULES[{idx}]: bad TITLE {rule['TITLE']!r}: {e}")
+            continue
+        # Each pattern can match anywhere in the title, the 1st rule that matches wins
+        titles.setdefault(key, []).append(f"(?P<r{idx}>.*?{title})")
+
+    by_class: Dict[Optional[str], Tuple[Optional[int], Optional[Pattern]]] = {}
+    for key in set(class_only) | set(titles):
+        regex = None
+        if key in titles:
+            try:
+                regex = re.compile("|".join(titles[key]), re.IGNORECASE)
+            except re.error as e:
+                errors.append(f"PROFILES.RULES: TITLE patterns for CLASS {key!r} don't fit together: {e}")
+        by_class[key] = (class_only.get(key), regex)
+
+    default = profiles.get("DEFAULT")
+    if default is not None and default not in pages:
+        errors.append(f"PROFILES.DEFAULT: {default!r} isn't in PAGES")
+    if errors:
+        raise MacroCompileException("Failed to compile PROFILES:\n  " + "\n  ".join(errors))
+    return ProfileRules(tuple(rule_pages), by_class, default)
+# compile_profiles
+
+
+class ProfileManager():
+    """Switches pages to the focused window's profile, checked when a button is pressed.
+    The focused window is looked up by a background thread every ttl seconds (or right away after invalidate(),
+    e.g. on a focus change event), presses only read what it found last, so they never ask the window system.
+    The page for each window is remembered too, the rules only run for windows that weren't seen yet.
+    The page only switches when the focused window's profile changes, so PAGE_* actions still work while staying
+    in the same app.
+    Params:
+        rules - ProfileRules, from compile_profiles
+        provider - Optional[WindowProvider], returns the focused window (get_window_provider, or a stub in tests)
+        ttl - float [0.25], seconds between lookups of the focused window (at least MIN_POLL in the thread)
+        verbose - bool [False], verbosity
+    Methods:
+        start
+        stop
+        set_rules
+        refresh
+        get_window
+        invalidate
+        get_page
+    """
+
+    # Shortest wait between lookups in the background thread, so TTL 0 doesn't spin
+    MIN_POLL: float = 0.02
+
+    def __init__(self, rules: ProfileRules, provider: Optional[WindowProvider], ttl: float = DEFAULT_TTL,
+                 verbose: bool = False):
+        """Create ProfileManager, call start() to look up the focused window in the background"""
+        self.verbose: bool = verbose
+        self.provider: Optional[WindowProvider] = provider
+        self.ttl: float = ttl
+        self.rules: ProfileRules = rules
+        self._window: Optional[WindowInfo] = None
+        self._window_at: float = float("-inf")
+        # WindowInfo -> page, so each window is matched once
+        self._matches: Dict[WindowInfo, Optional[str]] = {}
+        # Page of the last profile that was applied
+        self.last_page: Optional[str] = None
+        self._stop: threading.Event = threading.Event()
+        self._wake: threading.Event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+    # __init__
+
+    def start(self) -> None:
+        """Look up the focused window in a daemon thread until stop(). Does nothing without a provider"""
+        if self.provider is None or self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._watch, name="mmp-profiles", daemon=True)
+        self._thread.start()
+    # start
+
+    def stop(self) -> None:
+        """Stop looking up the focused window, waits for a lookup that's running to finish"""
+        self._stop.set()
+        self._wake.set()
+        thread = self._thread
+        if thread is not None and thread is not threading.current_thread():
+            thread.join(timeout=1.0)
+    # stop
+
+    def _watch(self) -> None:
+        """Refresh the focused window every ttl seconds until stop() is called"""
+        while not self._stop.is_set():
+            self.refresh()
+            self._wake.wait(max(self.ttl, self.MIN_POLL))
+            self._wake.clear()
+    # _watch
+
+    def set_rules(self, rules: ProfileRules, ttl: float = None) -> None:
+        """Swap in newly compiled rules (config reload)"""
+        self._matches = {}
+        self.rules = rules
+        self.last_page = None
+        if ttl is not None:
+            self.ttl = ttl
+    # set_rules
+
+    def refresh(self, now: float = None) -> Optional[WindowInfo]:
+        """Ask the provider for the focused window, unless the last answer is newer than ttl.
+        Called from the background thread, or directly when there's no thread (e.g. tests)
+        Params:
+            now - float [None], time.monotonic()
+        Returns:
+            Optional[WindowInfo], the focused window
+        """
+        now = time.monotonic() if now is None else now
+        if now - self._window_at < self.ttl or self.provider is None:
+            return self._window
+        try:
+            self._window = self.provider()
+        except Exception as e:
+            print(f"Failed to get the focused window: {e}")
+            self._window = None
+        self._window_at = now
+        return self._window
+    # refresh
+
+    def get_window(self) -> Optional[WindowInfo]:
+        """Get the focused window found by the last refresh(), never asks the window system"""
+        return self._window
+    # get_window
+
+    def invalidate(self) -> None:
+        """Forget when the window was looked up, e.g. when the focus changed. The thread looks it up again right away"""
+        self._window_at = float("-inf")
+        self._wake.set()
+    # invalidate
+
+    def get_page(self) -> Optional[str]:
+        """Get the page to switch to for the focused window, if its profile changed since the last call
+        Returns:
+            Optional[str], PAGES name, None to stay on the page that's on
+        """
+        window = self._window
+        if window is None:
+            return None
+        matches = self._matches
+        if window in matches:
+            page = matches[window]
+        else:
+            if len(matches) >= MATCH_CACHE_SIZE:
+                matches.clear()
+            page = matches[window] = self.rules.match(window)
+        if page == self.last_page:
+            return None
+        # A window with no profile (None) is remembered too, so coming back to the last profile's app switches again
+        self.last_page = page
+        if page is not None and self.verbose:
+            print(f"Focused {window.wm_class!r} ({window.title!r}), profile page {page!r}")
+        return page
+    # get_page
+
+# ProfileManager
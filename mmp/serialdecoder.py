@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+# serialdecoder.py - Streaming decoder for the bytes sent by the MiniMacroPad firmware
+from typing import List
+
+
+class SerialDecoder():
+    """Streaming, byte level decoder that splits serial data into separate events.
+    Feed it whatever bytes are waiting on the port, get back every complete event.
+    Framing modes:
+        RAW - every digit byte is a press (what MiniMacroPad.ino sends today, no newline)
+        LINE - events are separated by a newline (\\n, \\r\\n)
+        LENGTH - every event is prefixed by 1 byte with the payload length
+        AUTO - RAW until the first newline shows up, then LINE
+    Params:
+        framing - str ["AUTO"], one of FRAMINGS
+        verbose - bool [False], verbosity
+    Methods:
+        feed
+        reset
+    """
+    FRAMINGS: List[str] = ["AUTO", "RAW", "LINE", "LENGTH"]
+
+    def __init__(self, framing: str = "AUTO", verbose: bool = False):
+        """Create SerialDecoder
+        Params:
+            framing - str ["AUTO"], one of FRAMINGS
+            verbose - bool [False], verbosity
+        """
+        framing = framing.upper()
+        if framing not in SerialDecoder.FRAMINGS:
+            raise Exception(f"Unknown serial FRAMING: {framing}, expected one of {SerialDecoder.FRAMINGS}")
+        self.verbose: bool = verbose
+        self.framing: str = framing
+        self._buf: bytearray = bytearray()
+        # Only used for LENGTH framing, -1 when waiting for the length byte
+        self._want: int = -1
+    # __init__
+
+    def reset(self) -> None:
+        """Drop any partial event, e.g. after reopening the port"""
+        self._buf.clear()
+        self._want = -1
+    # reset
+
+    def feed(self, data: bytes) -> List[str]:
+        """Decode a chunk of serial bytes
+        Params:
+            data - bytes, whatever was read from the serial port (may be partial / many events)
+        Returns:
+            List[str] - every complete event in this chunk, in order. Empty list if nothing is complete yet
+        """
+        if self.framing == "LENGTH":
+            return self._feed_length(data)
+
+        events: List[str] = []
+        for byte in data:
+            if byte == 0x0A:  # \n
+                if self.framing == "AUTO":
+                    # Firmware is sending newlines, so it frames its own events now
+                    if self.verbose:
+                        print("SerialDecoder: newline seen, switching to LINE framing")
+                    self.framing = "LINE"
+                self._flush_line(events)
+            elif byte == 0x0D:  # \r
+                continue
+            elif self.framing == "LINE":
+                self._buf.append(byte)
+            elif 0x30 <= byte <= 0x39 and not self._buf:
+                # A bare digit is a full press, don't wait for anything else
+                events.append(chr(byte))
+            elif self.framing == "RAW":
+                # Nothing but digits are expected here, skip noise
+                continue
+            else:
+                # Text (e.g. "log:...") in AUTO mode, keep it until the newline
+                self._buf.append(byte)
+        return events
+    # feed
+
+    def _flush_line(self, events: List[str]) -> None:
+        """Append the buffered line to events (if it's not empty) & clear the buffer"""
+        line = self._buf.decode(errors="replace").strip()
+        self._buf.clear()
+        if line:
+            events.append(line)
+    # _flush_line
+
+    def _feed_length(self, data: bytes) -> List[str]:
+        """feed() for LENGTH framing"""
+        events: List[str] = []
+        for byte in data:
+            if self._want < 0:
+                self._want = byte
+                if self._want == 0:
+                    self._want = -1
+                continue
+            self._buf.append(byte)
+            if len(self._buf) >= self._want:
+                self._want = -1
+                self._flush_line(events)
+        return events
+    # _feed_length
+
+# SerialDecoder
@@ -0,0 +1,303 @@
+#!/usr/bin/env python3
+# serialsupervisor.py - Keeps a pad's serial connection up: reconnects with backoff when it's unplugged
+import asyncio
+import sys
+import threading
+import time
+
+from functools import partial
+from typing import Callable, List, Optional, Set, TYPE_CHECKING
+
+from mmp.actionqueue import ActionQueue
+from mmp.macromanager import MacroManager
+from mmp.minimacropad import arduino_listen_loop, handle_chunk
+from mmp.serialdecoder import SerialDecoder
+from mmp.gestures import GestureRecognizer
+
+if TYPE_CHECKING:
+    from serial import Serial
+
+
+class PortScanner():
+    """Finds ports by description with serial.tools.list_ports, shared by every SerialSupervisor.
+    The port list is only enumerated again once it's min_interval seconds old, however many pads are missing.
+    Ports handed out by find() are claimed until release(), so identical pads get different ports.
+    Params:
+        min_interval - float [2.0], min seconds between enumerations
+        verbose - bool [False], verbosity
+    Methods:
+        find
+        release
+    """
+
+    def __init__(self, min_interval: float = 2.0, verbose: bool = False):
+        """Create PortScanner"""
+        self.verbose: bool = verbose
+        self.min_interval: float = min_interval
+        self.claimed: Set[str] = set()
+        self._ports: list = []
+        self._last_scan: Optional[float] = None
+        self._lock: threading.Lock = threading.Lock()
+    # __init__
+
+    def find(self, query: str) -> Optional[str]:
+        """Find & claim a port whose description has query in it
+        Params:
+            query - str, e.g. "USB Serial Device"
+        Returns:
+            Optional[str], port to open (e.g. COM7, /dev/ttyACM0). None if nothing unclaimed matches
+        """
+        with self._lock:
+            now = time.monotonic()
+            if self._last_scan is None or now - self._last_scan >= self.min_interval:
+                import serial.tools.list_ports
+                self._ports = list(serial.tools.list_ports.comports())
+                self._last_scan = now
+                if self.verbose:
+                    print("Serial Ports:")
+                    for p in self._ports:
+                        print(f"  {p.device} - {p.description}")
+            for p in self._ports:
+                if p.device not in self.claimed and query in p.description:
+                    self.claimed.add(p.device)
+                    return p.device
+        return None
+    # find
+
+    def release(self, port: str) -> None:
+        """Let another pad use port"""
+        with self._lock:
+            self.claimed.discard(port)
+    # release
+
+# PortScanner
+
+
+class SerialSupervisor():
+    """Background thread that owns 1 pad: opens it, runs arduino_listen_loop until it's unplugged,
+    then waits (backing off from min_backoff to max_backoff seconds) & looks for it again.
+    Never busy-loops & never shows dialogs, state changes go to the on_state listeners.
+    States:
+        CONNECTING - looking for / opening the port
+        CONNECTED - reading button presses
+        WAITING - not found or unplugged, waiting before looking again
+        STOPPED - stop() was called
+    Params:
+        device - dict, one of config.devices
+        macro_manager - MacroManager, runs the actual actions
+        action_queue - ActionQueue, presses are submitted here
+        scanner - PortScanner, shared by all pads
+        min_backoff - float [0.5], seconds to wait after the 1st failure, doubled after every failure
+        max_backoff - float [10.0], max seconds to wait between tries
+        verbose - bool [False], verbosity
+    Methods:
+        start
+        stop
+        supervise_async
+    """
+    STATES: List[str] = ["CONNECTING", "CONNECTED", "WAITING", "STOPPED"]
+
+    def __init__(self, device: dict, macro_manager: MacroManager, action_queue: ActionQueue, scanner: PortScanner,
+                 min_backoff: float = 0.5, max_backoff: float = 10.0, verbose: bool = False):
+        """Create SerialSupervisor, call start() to connect"""
+        self.verbose: bool = verbose
+        self.device: dict = device
+        self.name: str = device["NAME"]
+        self.macro_manager: MacroManager = macro_manager
+        self.action_queue: ActionQueue = action_queue
+        self.scanner: PortScanner = scanner
+        self.min_backoff: float = max(0.01, min_backoff)
+        self.max_backoff: float = max(self.min_backoff, max_backoff)
+
+        self.state: str = "STOPPED"
+        # Called with (pad name, state) from the supervisor thread
+        self.on_state: List[Callable[[str, str], None]] = []
+        self.arduino: Optional["Serial"] = None
+        self._stop: threading.Event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+    # __init__
+
+    def start(self) -> None:
+        """Start the supervisor thread"""
+        self._thread = threading.Thread(target=self._supervise, name=f"mmp-serial-{self.name}", daemon=True)
+        self._thread.start()
+    # start
+
+    def stop(self) -> None:
+        """Stop supervising & close the port, the reader thread wakes up & quits"""
+        self._stop.set()
+        arduino = self.arduino
+        if arduino is not None:
+            try:
+                arduino.close()
+            except Exception as e:
+                print(f"Failed to close {self.name}: {e}")
+        self._set_state("STOPPED")
+    # stop
+
+    def _set_state(self, state: str) -> None:
+        """Change state & tell the listeners"""
+        if state == self.state:
+            return
+        self.state = state
+        if self.verbose:
+            print(f"{self.name}: {state}")
+        for listener in self.on_state:
+            listener(self.name, state)
+    # _set_state
+
+    def _open(self) -> Optional["Serial"]:
+        """Find & open the port
+        Returns:
+            Optional[Serial], None if it's not plugged in / can't be opened
+        """
+        import serial
+
+        port = self.device.get("PORT")
+        claimed = port is None
+        if claimed:
+            port = self.scanner.find(self.device["QUERY"])
+            if port is None:
+                return None
+        try:
+            return serial.Serial(port=port, baudrate=self.device["BAUDRATE"], timeout=self.device["TIMEOUT"])
+        except serial.SerialException as e:
+            if self.verbose:
+                print(f"{self.name}: {e}")
+            if claimed:
+                self.scanner.release(port)
+            return None
+    # _open
+
+    def _supervise(self) -> None:
+        """Connect, read until unplugged, back off, repeat until stop()"""
+        backoff = self.min_backoff
+        while not self._stop.is_set():
+            self._set_state("CONNECTING")
+            arduino = self._open()
+            if arduino is None:
+                self._set_state("WAITING")
+                self._stop.wait(backoff)
+                backoff = min(backoff * 2, self.max_backoff)
+                continue
+
+            backoff = self.min_backoff
+            self.arduino = arduino
+            if self._stop.is_set():
+                # stop() came in while opening
+                arduino.close()
+                break
+            self._set_state("CONNECTED")
+            # Returns once the device is unplugged (or stop() closed it)
+            arduino_listen_loop(arduino, self.macro_manager, self.action_queue,
+                                on_close=lambda: None, device=self.device)
+            self.arduino = None
+            self._close(arduino)
+            if not self._stop.is_set():
+                print(f"{self.name}: disconnected, looking for it again")
+                self._set_state("WAITING")
+                self._stop.wait(backoff)
+        self._set_state("STOPPED")
+    # _supervise
+
+    def _close(self, arduino: "Serial") -> None:
+        """Close the port & let the scanner hand it out again"""
+        try:
+            arduino.close()
+        except Exception:
+            pass
+        if not self.device.get("PORT"):
+            self.scanner.release(arduino.port)
+    # _close
+
+    async def supervise_async(self) -> None:
+        """_supervise for the asyncio engine, run it as a task & cancel the task to stop.
+        Looking for / opening the port runs in the loop's default executor so it never blocks the loop
+        """
+        backoff = self.min_backoff
+        try:
+            while True:
+                self._set_state("CONNECTING")
+                arduino = await self._open_async()
+                if arduino is None:
+                    self._set_state("WAITING")
+                    await asyncio.sleep(backoff)
+                    backoff = min(backoff * 2, self.max_backoff)
+                    continue
+
+                backoff = self.min_backoff
+                self.arduino = arduino
+                self._set_state("CONNECTED")
+                try:
+                    await self._read_async(arduino)
+                except Exception as e:
+                    # SerialException / OSError, unplugged
+                    print("Device disconnected?")
+                    print(e)
+                finally:
+                    self.arduino = None
+                    self._close(arduino)
+                print(f"{self.name}: disconnected, looking for it again")
+                self._set_state("WAITING")
+                await asyncio.sleep(backoff)
+        finally:
+            self._set_state("STOPPED")
+    # supervise_async
+
+    async def _open_async(self) -> Optional["Serial"]:
+        """_open in the default executor. If the task is cancelled meanwhile, the port is closed once it's open"""
+        future = asyncio.get_running_loop().run_in_executor(None, self._open)
+        try:
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            def _close_late(done: asyncio.Future):
+                if not done.cancelled() and done.exception() is None and done.result() is not None:
+                    self._close(done.result())
+            future.add_done_callback(_close_late)
+            raise
+    # _open_async
+
+    async def _read_async(self, arduino: "Serial") -> None:
+        """Read & submit presses until the port fails (raises)"""
+        loop = asyncio.get_running_loop()
+        decoder = SerialDecoder(framing=self.device.get("FRAMING", "AUTO"), verbose=self.verbose)
+        # Gesture deadlines are loop timers, so they run on the loop like everything else
+        gestures = GestureRecognizer(
+            lambda: self.macro_manager.gestures, partial(self.macro_manager.submit_gesture, self.action_queue),
+            call_later=loop.call_later, verbose=self.verbose
+        )
+        try:
+            await self._read_chunks(arduino, decoder, gestures)
+        finally:
+            gestures.reset()
+    # _read_async
+
+    async def _read_chunks(self, arduino: "Serial", decoder: SerialDecoder, gestures: GestureRecognizer) -> None:
+        """The read loop of _read_async.
+        On POSIX the loop waits on the port's fd (add_reader), no thread needed.
+        Windows ports can't be waited on like that, so each read runs in the default executor there
+        """
+        loop = asyncio.get_running_loop()
+        if sys.platform.startswith("win") or not hasattr(arduino, "fileno"):
+            while True:
+                # Blocks (in the executor) until at least 1 byte shows up (or TIMEOUT)
+                chunk = await loop.run_in_executor(None, lambda: arduino.read(arduino.in_waiting or 1))
+                if chunk:
+                    handle_chunk(chunk, decoder, self.macro_manager, self.action_queue, self.device, gestures)
+
+        ready = asyncio.Event()
+        fd = arduino.fileno()
+        loop.add_reader(fd, ready.set)
+        try:
+            while True:
+                await ready.wait()
+                ready.clear()
+                # Readable with nothing waiting = unplugged, read() raises
+                chunk = arduino.read(arduino.in_waiting or 1)
+                if chunk:
+                    handle_chunk(chunk, decoder, self.macro_manager, self.action_queue, self.device, gestures)
+        finally:
+            loop.remove_reader(fd)
+    # _read_chunks
+
+# SerialSupervisor
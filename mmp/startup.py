@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+# startup.py - Startup timing broken down by mmp phase (like -X importtime, but per phase)
+import sys
+import time
+
+from contextlib import contextmanager
+from typing import Iterator, List, Tuple
+
+
+class StartupTimer():
+    """Times each startup phase & which top level modules got imported during it.
+    Methods:
+        phase
+        report
+    """
+
+    def __init__(self):
+        """Create StartupTimer, the clock starts now (when mmp.startup is first imported)"""
+        self.start: float = time.perf_counter()
+        # (phase name, seconds, new top level modules)
+        self.phases: List[Tuple[str, float, List[str]]] = []
+    # __init__
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        """Time the code in the with block as phase name
+        Params:
+            name - str, name of the phase (e.g. "gui import")
+        """
+        before = set(sys.modules)
+        t_start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - t_start
+            new_modules = sorted({m.split(".")[0] for m in set(sys.modules) - before})
+            self.phases.append((name, elapsed, new_modules))
+    # phase
+
+    def report(self) -> str:
+        """Get the timing report
+        Returns:
+            str, 1 line per phase with ms, cumulative ms & the top level modules it imported
+        """
+        lines = ["mmp startup:", f"  {'phase':<16} {'ms':>9} {'total ms':>9}  modules imported"]
+        total = 0.0
+        for name, elapsed, modules in self.phases:
+            total += elapsed
+            _mods = ", ".join(modules[:8]) + (f" (+{len(modules) - 8})" if len(modules) > 8 else "")
+            lines.append(f"  {name:<16} {elapsed * 1000:>9.1f} {total * 1000:>9.1f}  {_mods}")
+        lines.append(f"  {'since start':<16} {(time.perf_counter() - self.start) * 1000:>9.1f}")
+        return "\n".join(lines)
+    # report
+
+# StartupTimer
+
+
+# Shared timer, the report is printed with --startup-timing
+STARTUP: StartupTimer = StartupTimer()
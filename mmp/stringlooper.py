@@ -1,21 +1,67 @@
 #!/usr/bin/env python3
 # stringlooper.py - StringLooper class
 import random
-from typing import List
+from array import array
+from collections import deque
+from typing import Deque, List, Optional, Sequence
+
+from mmp.mappedlines import MappedLines
 
 
 class StringLooper():
-    """Manages the state of looping thru a list"""
+    """Manages the state of looping thru a list
+    loop_up / loop_down go thru the list in order, loop_rand picks a string depending on mode (RANDOM_MODES).
+    Every pick is O(1) no matter how long the list is. The tables the random modes need are built by prepare(),
+    ActionManager.build_loopers calls it right after loading so no press waits on them (else the 1st loop_rand does).
+    """
+    # UNIFORM - any string, every time
+    # SHUFFLE - every string once (in random order) before any string comes up again
+    # WEIGHTED - strings with a bigger weight come up more often (alias table)
+    RANDOM_MODES: List[str] = ["UNIFORM", "SHUFFLE", "WEIGHTED"]
+    # Redraws before a WEIGHTED pick gives up on no_repeat (when the weights make the recent strings very likely)
+    MAX_REDRAWS: int = 32
 
-    def __init__(self, strings: List[str]):
+    def __init__(self, strings: Sequence[str], name: str = None, mode: str = "UNIFORM", no_repeat: int = 0,
+                 weights: Optional[Sequence[float]] = None):
         """Manages the state of looping thru a list
         Params:
-            strings - list[str], List of strings to loop thru
+            strings - Sequence[str], List of strings to loop thru (or a MappedLines for a DATA FILE)
+            name - str [None], name of the DATA list
+            mode - str ["UNIFORM"], how loop_rand picks, one of RANDOM_MODES
+            no_repeat - int [0], loop_rand never picks any of the last no_repeat strings again (UNIFORM / WEIGHTED)
+            weights - Optional[Sequence[float]] [None], 1 weight per string for WEIGHTED
+        Raises:
+            ValueError if mode, no_repeat or weights are invalid
         """
-        self.strings: List[str] = strings
+        self.name: str = name
+        self.strings: Sequence[str] = strings
         self.max: int = len(strings) - 1
         self.min: int = 0
         self.pos: int = 0
+
+        if mode not in StringLooper.RANDOM_MODES:
+            raise ValueError(f"Unknown mode {mode!r}, expected one of {StringLooper.RANDOM_MODES}")
+        if isinstance(no_repeat, bool) or not isinstance(no_repeat, int) or no_repeat < 0:
+            raise ValueError(f"Expected NO_REPEAT to be an int >= 0, got {no_repeat!r}")
+        if mode == "WEIGHTED" and (weights is None or len(weights) != len(strings)):
+            raise ValueError(f"WEIGHTED needs 1 weight per string ({len(strings)})")
+        self.mode: str = mode
+        # Can't leave out more than all but 1
+        self.no_repeat: int = min(no_repeat, self.max)
+        self.weights: Optional[Sequence[float]] = weights
+
+        self._random: random.Random = random.Random()
+        # Built by prepare() (see _build_tables)
+        # UNIFORM with no_repeat: permutation of the indexes, the last no_repeat slots are a ring of the recent picks
+        # SHUFFLE: the bag, the first _left slots haven't been picked this cycle
+        self._perm: Optional[array] = None
+        self._left: int = 0
+        self._ring: int = 0
+        # WEIGHTED: alias table
+        self._prob: Optional[array] = None
+        self._alias: Optional[array] = None
+        # WEIGHTED with no_repeat: the recent picks
+        self._recent: Deque[int] = deque(maxlen=self.no_repeat or 1)
     # __init__
 
     def get_str(self) -> str:
@@ -43,10 +89,138 @@ class StringLooper():
     # loop_down
 
     def loop_rand(self):
-        """Randomly change self.pos for looping thru self.strings"""
-        self.pos = random.randint(self.min, self.max)
+        """Randomly change self.pos for looping thru self.strings, depending on self.mode"""
+        if self.max <= 0:
+            self.pos = 0
+            return
+        if self._perm is None and self._prob is None:
+            self.prepare()
+        if self.mode == "SHUFFLE":
+            self.pos = self._draw_shuffle()
+        elif self.mode == "WEIGHTED":
+            self.pos = self._draw_weighted()
+        elif self.no_repeat:
+            self.pos = self._draw_no_repeat()
+        else:
+            self.pos = self._random.randint(self.min, self.max)
     # loop_rand
 
+    def prepare(self) -> None:
+        """Build the tables loop_rand needs for self.mode (O(len) once), if it needs any & they're not built yet.
+        Set pos before, UNIFORM with no_repeat counts it as the last pick
+        Raises:
+            ValueError if the weights are invalid
+        """
+        if self.max <= 0 or self._perm is not None or self._prob is not None:
+            return
+        if self.mode != "UNIFORM" or self.no_repeat:
+            self._build_tables()
+    # prepare
+
+    def _build_tables(self) -> None:
+        """Build what self.mode needs to pick in O(1), O(len) once"""
+        size = self.max + 1
+        if self.mode == "WEIGHTED":
+            self._build_alias()
+            return
+        self._perm = array("I" if size < 2 ** 32 else "Q", range(size))
+        self._left = size
+        self._ring = 0
+        if self.mode == "UNIFORM":
+            # Start with the recent ring holding the current position, like it was just picked
+            perm = self._perm
+            perm[self.pos], perm[size - 1] = perm[size - 1], perm[self.pos]
+            self._ring = size - self.no_repeat
+    # _build_tables
+
+    def _build_alias(self) -> None:
+        """Build the alias table for self.weights (Vose's method)"""
+        size = self.max + 1
+        weights = [float(w) for w in self.weights]
+        total = sum(weights)
+        if any(w < 0 for w in weights) or total <= 0:
+            raise ValueError(f"{self.name}: WEIGHTS must be >= 0 & add up to more than 0")
+        scaled = [w * size / total for w in weights]
+        prob = array("d", [1.0]) * size
+        alias = array("I" if size < 2 ** 32 else "Q", range(size))
+        small = [i for i, p in enumerate(scaled) if p < 1.0]
+        large = [i for i, p in enumerate(scaled) if p >= 1.0]
+        while small and large:
+            s = small.pop()
+            g = large[-1]
+            prob[s] = scaled[s]
+            alias[s] = g
+            scaled[g] -= 1.0 - scaled[s]
+            if scaled[g] < 1.0:
+                large.pop()
+                small.append(g)
+        # Whatever is left is ~1.0 (float rounding)
+        self._prob = prob
+        self._alias = alias
+    # _build_alias
+
+    def _draw_shuffle(self) -> int:
+        """Pick from the bag (Fisher-Yates, 1 step per pick), refill it once it's empty"""
+        perm = self._perm
+        if self._left == 0:
+            self._left = self.max + 1
+        idx = self._random.randrange(self._left)
+        if self._left == self.max + 1 and perm[idx] == self.pos:
+            # 1st pick of a new cycle, don't repeat the last pick of the previous one
+            idx = (idx + 1 + self._random.randrange(self.max)) % self._left
+        self._left -= 1
+        perm[idx], perm[self._left] = perm[self._left], perm[idx]
+        return perm[self._left]
+    # _draw_shuffle
+
+    def _draw_no_repeat(self) -> int:
+        """Uniform pick, leaving out the last no_repeat picks.
+        They're kept at the end of self._perm (a ring), a pick swaps in for the oldest one
+        """
+        perm = self._perm
+        size = self.max + 1
+        start = size - self.no_repeat
+        idx = self._random.randrange(start)
+        picked = perm[idx]
+        perm[idx] = perm[self._ring]
+        perm[self._ring] = picked
+        self._ring = self._ring + 1 if self._ring + 1 < size else start
+        return picked
+    # _draw_no_repeat
+
+    def _draw_weighted(self) -> int:
+        """Weighted pick from the alias table, redrawing picks that are in the no_repeat window"""
+        rand = self._random.random
+        size = self.max + 1
+        prob = self._prob
+        alias = self._alias
+        recent = self._recent
+        for _ in range(StringLooper.MAX_REDRAWS):
+            idx = int(rand() * size)
+            if rand() >= prob[idx]:
+                idx = alias[idx]
+            if idx not in recent:
+                break
+        if self.no_repeat:
+            recent.append(idx)
+        return idx
+    # _draw_weighted
+
+    def get_mapped(self) -> List[MappedLines]:
+        """Get the memory-mapped files (DATA / WEIGHTS FILE) this looper reads, e.g. to close them once it's replaced"""
+        return [data for data in (self.strings, self.weights) if isinstance(data, MappedLines)]
+    # get_mapped
+
+    def same_options(self, other: "StringLooper") -> bool:
+        """Check if other picks the same way (mode, no_repeat & weights), e.g. to keep this one when the config reloads
+        Params:
+            other - StringLooper, e.g. built from a reloaded config
+        Returns:
+            bool
+        """
+        return self.mode == other.mode and self.no_repeat == other.no_repeat and self.weights == other.weights
+    # same_options
+
     def __repr__(self) -> None:
         """Print all relevant data for this looper to stdout"""
         print(self.__str__)
@@ -57,7 +231,7 @@ class StringLooper():
         Returns:
             str, list of strings, positional info as 1 string.
         """
-        return f"{str(self.strings)}, pos: {self.pos}, min: {self.min}, max: {self.max}"
+        return f"{str(self.strings)}, pos: {self.pos}, min: {self.min}, max: {self.max}, mode: {self.mode}"
     # __str__
 
 # StringLooper
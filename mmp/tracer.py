@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+# tracer.py - Opt-in latency tracing & histograms for the press -> keystroke path
+import csv
+import json
+import threading
+import time
+
+from typing import Dict, List
+
+
+class LatencyHistogram():
+    """Log bucketed latency histogram (8 buckets per power of 2, so ~10% resolution) in nanoseconds.
+    Fixed memory no matter how many samples are recorded.
+    Methods:
+        record
+        percentile
+        summary
+    """
+    SUB_BITS: int = 3
+
+    def __init__(self):
+        """Create an empty LatencyHistogram"""
+        self.counts: Dict[int, int] = {}
+        self.count: int = 0
+        self.total: int = 0
+        self.min: int = 0
+        self.max: int = 0
+    # __init__
+
+    def _bucket(self, ns: int) -> int:
+        """Get the bucket index for ns"""
+        bits = ns.bit_length()
+        if bits <= LatencyHistogram.SUB_BITS + 1:
+            return ns
+        shift = bits - LatencyHistogram.SUB_BITS - 1
+        return (shift << LatencyHistogram.SUB_BITS) + (ns >> shift)
+    # _bucket
+
+    def _bucket_value(self, bucket: int) -> int:
+        """Get the upper bound in ns of a bucket index (inverse of _bucket)"""
+        top = 1 << (LatencyHistogram.SUB_BITS + 1)
+        if bucket < top:
+            return bucket
+        shift = (bucket >> LatencyHistogram.SUB_BITS) - 1
+        mantissa = bucket - (shift << LatencyHistogram.SUB_BITS)
+        return ((mantissa + 1) << shift) - 1
+    # _bucket_value
+
+    def record(self, ns: int) -> None:
+        """Add a sample
+        Params:
+            ns - int, latency in nanoseconds
+        """
+        ns = max(0, ns)
+        bucket = self._bucket(ns)
+        self.counts[bucket] = self.counts.get(bucket, 0) + 1
+        if self.count == 0 or ns < self.min:
+            self.min = ns
+        if ns > self.max:
+            self.max = ns
+        self.count += 1
+        self.total += ns
+    # record
+
+    def percentile(self, pct: float) -> int:
+        """Get the latency (ns) that pct percent of the samples are at or below
+        Params:
+            pct - float, 0 - 100
+        Returns:
+            int, ns. 0 if there are no samples
+        """
+        if self.count == 0:
+            return 0
+        target = max(1, int(round(self.count * pct / 100.0)))
+        seen = 0
+        for bucket in sorted(self.counts):
+            seen += self.counts[bucket]
+            if seen >= target:
+                return min(self._bucket_value(bucket), self.max)
+        return self.max
+    # percentile
+
+    def summary(self) -> Dict[str, float]:
+        """Get count, mean, min, max, p50, p95, p99 (all in ms)
+        Returns:
+            Dict[str, float]
+        """
+        ms = 1e6
+        return {
+            "count": self.count,
+            "mean_ms": (self.total / self.count / ms) if self.count else 0.0,
+            "min_ms": self.min / ms,
+            "p50_ms": self.percentile(50) / ms,
+            "p95_ms": self.percentile(95) / ms,
+            "p99_ms": self.percentile(99) / ms,
+            "max_ms": self.max / ms,
+        }
+    # summary
+
+# LatencyHistogram
+
+
+class Tracer():
+    """Opt-in tracing of the press path. Everything is a no-op until enable() is called,
+    call sites check `TRACER.enabled` first so a disabled tracer costs 1 attribute lookup.
+    Spans recorded (histogram names):
+        decode - serial bytes received -> press decoded
+        queue_wait - press decoded -> macro started on a worker
+        macro - macro started -> last step done
+        step:<ACTION_NAME> - 1 action step (e.g. step:KB_SEND_STR)
+        end_to_end - serial bytes received -> last step done
+        gui_highlight - last step done -> press shown on the GUI
+    Methods:
+        enable
+        now
+        record
+        done
+        highlight
+        summary
+        dump
+    """
+
+    def __init__(self):
+        """Create a disabled Tracer"""
+        self.enabled: bool = False
+        self.live: bool = False
+        self.histograms: Dict[str, LatencyHistogram] = {}
+        self._lock: threading.Lock = threading.Lock()
+        # position -> when its last macro finished, for the gui_highlight span
+        self._done_at: Dict[int, int] = {}
+    # __init__
+
+    def enable(self, live: bool = False) -> None:
+        """Start tracing
+        Params:
+            live - bool [False], print a line for every press (e.g. with --verbose)
+        """
+        self.enabled = True
+        self.live = live
+    # enable
+
+    @staticmethod
+    def now() -> int:
+        """Monotonic timestamp in ns"""
+        return time.perf_counter_ns()
+    # now
+
+    def record(self, name: str, ns: int) -> None:
+        """Add a sample to the name histogram
+        Params:
+            name - str, span name
+            ns - int, duration in ns
+        """
+        with self._lock:
+            hist = self.histograms.get(name)
+            if hist is None:
+                hist = self.histograms[name] = LatencyHistogram()
+            hist.record(ns)
+    # record
+
+    def done(self, position: int, t_recv: int, t_decode: int, t_dispatch: int) -> None:
+        """Record the spans of 1 press once its macro finished
+        Params:
+            position - int, button position
+            t_recv - int, when the serial bytes were read. 0 if not from serial (e.g. GUI click)
+            t_decode - int, when the press was decoded. 0 if not from serial
+            t_dispatch - int, when the macro started
+        """
+        t_done = self.now()
+        self.record("macro", t_done - t_dispatch)
+        if t_recv:
+            self.record("decode", t_decode - t_recv)
+            self.record("queue_wait", t_dispatch - t_decode)
+            self.record("end_to_end", t_done - t_recv)
+        self._done_at[position] = t_done
+        if self.live:
+            _ms = 1e6
+            if t_recv:
+                print(
+                    f"trace pos: {position} decode: {(t_decode - t_recv) / _ms:.3f}ms "
+                    f"queue: {(t_dispatch - t_decode) / _ms:.3f}ms macro: {(t_done - t_dispatch) / _ms:.3f}ms "
+                    f"total: {(t_done - t_recv) / _ms:.3f}ms"
+                )
+            else:
+                print(f"trace pos: {position} macro: {(t_done - t_dispatch) / _ms:.3f}ms")
+    # done
+
+    def highlight(self, position: int) -> None:
+        """Record the gui_highlight span for position
+        Params:
+            position - int, button position that is being shown as pressed
+        """
+        t_done = self._done_at.pop(position, None)
+        if t_done is not None:
+            self.record("gui_highlight", self.now() - t_done)
+    # highlight
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        """Get the summary of every histogram
+        Returns:
+            Dict[str, Dict[str, float]], span name -> LatencyHistogram.summary()
+        """
+        with self._lock:
+            return {name: hist.summary() for name, hist in sorted(self.histograms.items())}
+    # summary
+
+    def dump(self, path: str) -> None:
+        """Write the summary to path, as CSV if it ends with .csv, otherwise JSON
+        Params:
+            path - str, file to write
+        """
+        _summary = self.summary()
+        try:
+            with open(path, "w", newline="") as f:
+                if path.lower().endswith(".csv"):
+                    fields: List[str] = ["span", "count", "mean_ms", "min_ms", "p50_ms", "p95_ms", "p99_ms", "max_ms"]
+                    writer = csv.DictWriter(f, fieldnames=fields)
+                    writer.writeheader()
+                    for name, row in _summary.items():
+                        writer.writerow({"span": name, **row})
+                else:
+                    f.write(json.dumps(_summary, indent=4))
+        except Exception as e:
+            print(f"Failed to write trace to {path}")
+            print(e)
+    # dump
+
+# Tracer
+
+
+# Shared tracer, enabled from the CLI (--trace-out)
+TRACER: Tracer = Tracer()
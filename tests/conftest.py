@@ -0,0 +1,34 @@
+#!/usr/bin/env python3
+# conftest.py - Shared fixtures for the tests
+import json
+
+import pytest
+
+
+@pytest.fixture
+def write_config(tmp_path):
+    """Write a config file to a temp dir & return its path.
+    Call it with the ACTIONS and any other top level / CONFIG keys to use
+    """
+    def _write_config(actions: dict, data: dict = None, config: dict = None, **sections) -> str:
+        _config = {
+            "CONFIG": {
+                "SIZE": {"x": 2, "y": 2},
+                "GUI_SIZE": "400x300",
+                "MONITOR": 1,
+                "SERIAL": {"QUERY": "test", "BAUDRATE": 9600, "TIMEOUT": 0.1},
+                "RETRY_COUNT": 1,
+                "RELOAD_INTERVAL": 0,
+                "CONFIG_CACHE": False,
+                "LOOPER_STATE": False,
+                **(config or {}),
+            },
+            "DATA": data or {},
+            "ACTIONS": actions,
+            **sections,
+        }
+        path = tmp_path / "config.json"
+        path.write_text(json.dumps(_config))
+        return str(path)
+    return _write_config
+# write_config
@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+# test_gestures.py - Gesture state machine (with timers fired by hand) & the shared timer thread
+import threading
+
+from mmp.gestures import GestureRecognizer, GestureTable, TimerScheduler
+
+
+def make_table(double_tap: dict = None, long_press: dict = None, chords: dict = None) -> GestureTable:
+    chords = {frozenset(buttons): position for buttons, position in (chords or {}).items()}
+    return GestureTable(
+        double_tap=double_tap or {}, long_press=long_press or {}, chords=chords,
+        chord_buttons=frozenset().union(*chords), repeat=0.2, double_window=0.4, long_press_time=0.6, chord_window=0.3,
+    )
+# make_table
+
+
+class ManualTimers():
+    """call_later stand in, the test fires the timers"""
+
+    class Handle():
+        def __init__(self, delay, func):
+            self.delay = delay
+            self.func = func
+            self.cancelled = False
+
+        def cancel(self):
+            self.cancelled = True
+
+    def __init__(self):
+        self.handles = []
+
+    def __call__(self, delay, func):
+        handle = ManualTimers.Handle(delay, func)
+        self.handles.append(handle)
+        return handle
+
+    def fire_all(self):
+        """Fire every timer that's armed now (not the ones they arm)"""
+        handles, self.handles = self.handles, []
+        for handle in handles:
+            if not handle.cancelled:
+                handle.func()
+
+    def fire(self, delay):
+        """Fire the timers that are armed now with this delay, e.g. just the release timers"""
+        handles = [handle for handle in self.handles if handle.delay == delay]
+        self.handles = [handle for handle in self.handles if handle.delay != delay]
+        for handle in handles:
+            if not handle.cancelled:
+                handle.func()
+# ManualTimers
+
+
+def make_recognizer(table: GestureTable):
+    emitted = []
+    timers = ManualTimers()
+    tables = [table]
+    recognizer = GestureRecognizer(lambda: tables[0], emitted.append, call_later=timers)
+    return recognizer, emitted, timers, tables
+# make_recognizer
+
+
+def test_tap_and_double_tap():
+    recognizer, emitted, timers, _ = make_recognizer(make_table(double_tap={1: 5}))
+    # Times in the past, so every deadline is already up when its timer fires
+    recognizer.press(1, now=0.0)
+    timers.fire_all()
+    timers.fire_all()
+    assert emitted == [1]
+
+    recognizer.press(1, now=1.0)
+    timers.fire_all()
+    recognizer.press(1, now=1.1)
+    assert emitted == [1, 5]
+
+
+def test_double_tap_removed_by_reload_is_a_tap():
+    recognizer, emitted, timers, tables = make_recognizer(make_table(double_tap={1: 5}))
+    recognizer.press(1, now=0.0)
+    timers.fire_all()
+    # Waiting for a 2nd press, the reload takes the DOUBLE_TAP away
+    tables[0] = make_table(long_press={1: 6})
+    recognizer.press(1, now=0.1)
+    assert emitted == [1]
+    # The 2nd press goes on as a new press
+    timers.fire_all()
+    assert emitted == [1, 6]
+
+
+def test_long_press():
+    recognizer, emitted, timers, _ = make_recognizer(make_table(long_press={1: 6}))
+    recognizer.press(1, now=0.0)
+    # Held (repeating) past LONG_PRESS, it runs right away instead of on release
+    recognizer.press(1, now=0.15)
+    timers.fire(0.6)
+    assert emitted == [6]
+    # Releasing it doesn't tap too
+    timers.fire_all()
+    assert emitted == [6]
+
+
+def test_short_press_with_long_press_taps_on_release():
+    recognizer, emitted, timers, _ = make_recognizer(make_table(long_press={1: 6}))
+    recognizer.press(1, now=0.0)
+    # Could still be a long press, nothing runs until it's released (REPEAT without a digit)
+    assert emitted == []
+    timers.fire(0.2)
+    assert emitted == [1]
+    # Its long press timer was cancelled
+    timers.fire_all()
+    assert emitted == [1]
+
+
+def test_chord_runs_once():
+    recognizer, emitted, timers, _ = make_recognizer(make_table(chords={(1, 2): 7}))
+    recognizer.press(1, now=0.0)
+    recognizer.press(2, now=0.05)
+    assert emitted == [7]
+    # Both held, their repeats don't run it (or their own taps) again
+    recognizer.press(1, now=0.15)
+    recognizer.press(2, now=0.2)
+    timers.fire_all()
+    timers.fire_all()
+    assert emitted == [7]
+
+
+def test_chord_button_alone_is_a_tap():
+    recognizer, emitted, timers, _ = make_recognizer(make_table(chords={(1, 2): 7}))
+    recognizer.press(1, now=0.0)
+    # The rest of the chord didn't come within CHORD
+    timers.fire(0.3)
+    assert emitted == [1]
+    timers.fire_all()
+    assert emitted == [1]
+
+
+def test_scheduler_runs_in_deadline_order_and_skips_cancelled():
+    scheduler = TimerScheduler(name="test-timers")
+    ran = []
+    done = threading.Event()
+    scheduler.call_later(0.06, lambda: (ran.append("late"), done.set()))
+    cancelled = scheduler.call_later(0.02, lambda: ran.append("cancelled"))
+    scheduler.call_later(0.04, lambda: ran.append("mid"))
+    scheduler.call_later(0.0, lambda: ran.append("now"))
+    cancelled.cancel()
+    assert done.wait(2.0)
+    assert ran == ["now", "mid", "late"]
+
+
+def test_scheduler_uses_1_thread():
+    scheduler = TimerScheduler(name="test-timers")
+    threads = set()
+    done = threading.Event()
+    for i in range(50):
+        scheduler.call_later(0.001 * i, lambda: threads.add(threading.current_thread()))
+    scheduler.call_later(0.1, done.set)
+    assert done.wait(2.0)
+    assert len(threads) == 1
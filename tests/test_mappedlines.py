@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+# test_mappedlines.py - Memory-mapped DATA FILEs, & closing them when a reload replaces them
+import os
+
+from mmp import actionmanager
+from mmp.canceltoken import CancelToken
+from mmp.config import Config
+from mmp.macromanager import MacroManager
+from mmp.mappedlines import MappedLines
+from mmp.outputbackend import RecordingBackend
+
+ACTIONS = {"Phrase": [{"KB_SEND_LOOP_UP": "PHRASES"}]}
+DATA = {"PHRASES": {"FILE": "phrases.txt"}}
+
+
+def write_lines(path, lines) -> None:
+    """Save a new file over path, like CONFIG.md says to"""
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", newline="") as f:
+        f.write(lines)
+    os.replace(tmp, path)
+# write_lines
+
+
+def test_lines(tmp_path):
+    path = tmp_path / "lines.txt"
+    write_lines(path, "one\r\n\ntwo\nthree")
+    lines = MappedLines(str(path))
+    assert list(lines) == ["one", "two", "three"]
+    assert lines[-1] == "three"
+    assert lines.is_same_file(str(path))
+    lines.close()
+
+
+def test_reload_closes_replaced_file(write_config, tmp_path):
+    write_lines(tmp_path / "phrases.txt", "a\nb\n")
+    path = write_config(ACTIONS, data=DATA)
+    macro_manager = MacroManager(None, config_path=path, output=RecordingBackend())
+    old = macro_manager.action_manager.loopers["PHRASES"].strings
+
+    write_lines(tmp_path / "phrases.txt", "c\nd\n")
+    assert "DATA" in macro_manager.reload_config(Config(config_path=path))
+    assert old._map.closed
+    assert macro_manager.action_manager.loopers["PHRASES"].get_str() == "c"
+
+    new = macro_manager.action_manager.loopers["PHRASES"].strings
+    macro_manager.close()
+    assert new._map.closed
+
+
+def test_reload_waits_for_running_presses(write_config, tmp_path):
+    write_lines(tmp_path / "phrases.txt", "a\nb\n")
+    path = write_config(ACTIONS, data=DATA)
+    macro_manager = MacroManager(None, config_path=path, output=RecordingBackend())
+    old = macro_manager.action_manager.loopers["PHRASES"].strings
+
+    # A press that started before the reload
+    running = CancelToken()
+    macro_manager._active_tokens.add(running)
+    write_lines(tmp_path / "phrases.txt", "c\nd\n")
+    macro_manager.reload_config(Config(config_path=path))
+    assert not old._map.closed
+
+    # Another press finishing doesn't close it, the 1st one does
+    assert macro_manager.run_action(position=1)
+    assert not old._map.closed
+    macro_manager._finish_token(running)
+    assert old._map.closed
+    macro_manager.close()
+
+
+def test_bad_options_close_new_file(write_config, tmp_path, monkeypatch):
+    write_lines(tmp_path / "phrases.txt", "a\nb\n")
+    path = write_config(ACTIONS, data=DATA)
+    macro_manager = MacroManager(None, config_path=path, output=RecordingBackend())
+    old = macro_manager.action_manager.loopers["PHRASES"].strings
+
+    # The file changed & its new WEIGHTS are bad, the looper is skipped
+    loaded = []
+    load_data = actionmanager.load_data
+    monkeypatch.setattr(actionmanager, "load_data", lambda *args: loaded.append(load_data(*args)) or loaded[-1])
+    write_lines(tmp_path / "phrases.txt", "c\nd\n")
+    data = {"PHRASES": {"FILE": "phrases.txt", "RANDOM": "WEIGHTED", "WEIGHTS": [1, -1]}}
+    loopers = macro_manager.action_manager.build_loopers(
+        Config(config_path=write_config(ACTIONS, data=data)), keep=macro_manager.action_manager.loopers
+    )
+    assert "PHRASES" not in loopers
+    assert len(loaded) == 1 and loaded[0]._map.closed
+    assert not old._map.closed
+    macro_manager.close()
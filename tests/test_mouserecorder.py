@@ -0,0 +1,34 @@
+#!/usr/bin/env python3
+# test_mouserecorder.py - MOUSE_PLAYBACK timeline encoding
+import pytest
+
+from mmp.mouserecorder import DOWN, MOVE, UP, WHEEL, decode_timeline, encode_timeline
+
+
+def test_round_trip():
+    events = [
+        (1_000_000, MOVE, 10, 20),
+        (1_500_000, DOWN, 0, 0),
+        (2_000_000, MOVE, 5, 25),
+        (3_000_000, UP, 0, 0),
+        (3_250_000, WHEEL, -120, 0),
+    ]
+    times, kinds, xs, ys = decode_timeline(encode_timeline((0, 0), events))
+    assert times == pytest.approx((0.0, 0.0005, 0.001, 0.002, 0.00225))
+    assert kinds == (MOVE, DOWN, MOVE, UP, WHEEL)
+    assert xs == (10, 0, 5, 0, -120)
+    assert ys == (20, 0, 25, 0, 0)
+
+
+def test_rounding_doesnt_add_up():
+    # A minute of 1 kHz movement, each gap 999.9 us
+    events = [(i * 999_900, MOVE, i % 7, 0) for i in range(60_000)]
+    times, _, _, _ = decode_timeline(encode_timeline((0, 0), events))
+    assert times[-1] == pytest.approx((events[-1][0] - events[0][0]) / 1e9, abs=1e-6)
+
+
+def test_cut_off_timeline():
+    value = encode_timeline((0, 0), [(0, MOVE, 1000, 1000)])
+    value["TIMELINE"] = value["TIMELINE"][:-4]
+    with pytest.raises(ValueError):
+        decode_timeline(value)
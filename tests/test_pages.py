@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+# test_pages.py - PAGES: compiled button tables & switching as soon as a button is resolved
+import pytest
+
+from mmp.config import Config
+from mmp.macromanager import MacroManager
+from mmp.outputbackend import RecordingBackend
+
+ACTIONS = {
+    "A": [{"KB_KEY_PRESS": "a"}],
+    "ToMedia": [{"KB_KEY_PRESS": "m"}, {"PAGE_TO": "Media"}],
+    "Toggle": [{"PAGE_TOGGLE": "Media"}],
+    "Hold": [{"PAGE_MOMENTARY": "Media"}],
+    "Play": [{"KB_KEY_PRESS": "p"}],
+}
+PAGES = {
+    "Main": {"BUTTONS": ["A", "ToMedia", "Toggle", "Hold"]},
+    "Media": {"BUTTONS": ["Play", None, "Toggle", "Hold"]},
+}
+
+
+def make_manager(write_config, **sections) -> MacroManager:
+    return MacroManager(None, config_path=write_config(ACTIONS, PAGES=PAGES, **sections), output=RecordingBackend())
+# make_manager
+
+
+def test_switches_are_compiled_per_page(write_config):
+    macro_manager = make_manager(write_config)
+    pages = macro_manager.pages.pages
+    assert pages["Main"].switches == {2: ("PAGE_TO", "Media"), 3: ("PAGE_TOGGLE", "Media"), 4: ("PAGE_MOMENTARY", "Media")}
+    assert pages["Media"].switches == {3: ("PAGE_TOGGLE", "Media"), 4: ("PAGE_MOMENTARY", "Media")}
+    macro_manager.close()
+
+
+def test_page_to_switches_on_resolve(write_config):
+    macro_manager = make_manager(write_config)
+    pages = macro_manager.pages
+    assert macro_manager.resolve(2) == 2
+    # Before its macro even ran
+    assert pages.current().name == "Media"
+    assert macro_manager.resolve(1) == 5
+    # Running the macro doesn't switch again
+    pages.switch("Main")
+    assert macro_manager.run_action(position=2)
+    assert pages.current().name == "Main"
+    macro_manager.close()
+
+
+def test_page_toggle_switches_once_per_press(write_config):
+    macro_manager = make_manager(write_config)
+    pages = macro_manager.pages
+    assert macro_manager.resolve(3) == 3
+    assert macro_manager.run_action(position=3)
+    assert pages.current().name == "Media"
+    assert macro_manager.resolve(3) == 3
+    assert macro_manager.run_action(position=3)
+    assert pages.current().name == "Main"
+    macro_manager.close()
+
+
+def test_page_momentary_holds_until_release(write_config):
+    macro_manager = make_manager(write_config)
+    pages = macro_manager.pages
+    pages.resolve(4, now=100.0)
+    assert pages.current(now=100.1).name == "Media"
+    # Repeats of the held button keep it
+    pages.resolve(4, now=100.3)
+    assert pages.current(now=100.6).name == "Media"
+    assert pages.current(now=101.0).name == "Main"
+    macro_manager.close()
+
+
+def test_press_switches_for_gui_clicks(write_config):
+    macro_manager = make_manager(write_config)
+    macro_manager.pages.press(2)
+    assert macro_manager.pages.current().name == "Media"
+    macro_manager.close()
+
+
+def test_gesture_buttons_switch_when_decided(write_config):
+    macro_manager = make_manager(write_config, config={"GESTURES": {"BUTTONS": {"ToMedia": {"DOUBLE_TAP": "A"}}}})
+    pages = macro_manager.pages
+
+    class Queue():
+        def __init__(self):
+            self.submitted = []
+
+        def submit(self, position):
+            self.submitted.append(position)
+            return True
+
+    assert macro_manager.resolve(2) == 2
+    assert pages.current().name == "Main"
+    queue = Queue()
+    macro_manager.submit_gesture(queue, 2)
+    assert pages.current().name == "Media"
+    assert queue.submitted == [2]
+    macro_manager.close()
+
+
+def test_reload_keeps_the_page(write_config):
+    macro_manager = make_manager(write_config)
+    macro_manager.pages.switch("Media")
+    path = macro_manager.config.get_path()
+    with open(path) as f:
+        text = f.read()
+    with open(path, "w") as f:
+        f.write(text.replace('"Play", null', '"Play", "A"'))
+    assert "PAGES" in macro_manager.reload_config(Config(config_path=path))
+    assert macro_manager.pages.current().name == "Media"
+    assert macro_manager.resolve(2) == 1
+    macro_manager.close()
+
+
+def test_page_action_on_its_own_switches(write_config):
+    macro_manager = make_manager(write_config)
+    pages = macro_manager.pages
+    assert macro_manager.run_action(action_name="PAGE_TO", value="Media")
+    assert pages.current().name == "Media"
+    assert macro_manager.run_action(action_name="PAGE_TOGGLE", value="Media")
+    assert pages.current().name == "Main"
+    with pytest.raises(ValueError, match="Nope"):
+        macro_manager.run_action(action_name="PAGE_TO", value="Nope")
+    macro_manager.close()
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+# test_profiles.py - PROFILES rules, the focused window cache & page switching, with a stubbed window provider
+import pytest
+
+from mmp.config import Config
+from mmp.macromanager import MacroManager
+from mmp.outputbackend import RecordingBackend
+from mmp.profiles import ProfileManager, WindowInfo, compile_profiles
+from mmp.util import MacroCompileException
+
+ACTIONS = {
+    "A": [{"KB_KEY_PRESS": "a"}],
+    "B": [{"KB_KEY_PRESS": "b"}],
+}
+PAGES = {
+    "Main": {"BUTTONS": ["A", "B"]},
+    "IDE": {"BUTTONS": ["B", "A"]},
+    "Browser": {"BUTTONS": ["B", None]},
+}
+
+
+class StubProvider():
+    """Stands in for a window provider, returns window & counts calls"""
+
+    def __init__(self, window: WindowInfo = None):
+        self.window = window
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        return self.window
+# StubProvider
+
+
+def compile_rules(write_config, rules: list, default: str = None):
+    """Compile PROFILES with rules, against PAGES"""
+    profiles = {"RULES": rules}
+    if default is not None:
+        profiles["DEFAULT"] = default
+    config = Config(config_path=write_config(ACTIONS, config={"PROFILES": profiles}, PAGES=PAGES), use_cache=False)
+    return compile_profiles(config, PAGES)
+
+
+def test_match_class_title_and_order(write_config):
+    rules = compile_rules(write_config, [
+        {"CLASS": "Code", "PAGE": "IDE"},
+        {"TITLE": "Mozilla Firefox$", "PAGE": "Browser"},
+        {"CLASS": "code", "TITLE": "firefox", "PAGE": "Browser"},
+    ], default="Main")
+    assert rules.match(WindowInfo("code", "main.py - Visual Studio Code")) == "IDE"
+    # The 1st matching rule wins, even if a later one matches too
+    assert rules.match(WindowInfo("Code", "about firefox")) == "IDE"
+    assert rules.match(WindowInfo("firefox", "Docs - MOZILLA FIREFOX")) == "Browser"
+    assert rules.match(WindowInfo("firefox", "Mozilla Firefox - Docs")) == "Main"
+
+
+def test_match_without_default(write_config):
+    rules = compile_rules(write_config, [{"CLASS": "Code", "PAGE": "IDE"}])
+    assert rules.match(WindowInfo("xterm", "bash")) is None
+
+
+def test_title_flags_are_scoped(write_config):
+    rules = compile_rules(write_config, [
+        {"TITLE": "(?s)a.b", "PAGE": "IDE"},
+        {"TITLE": "(?x) fire fox  # comment", "PAGE": "Browser"},
+    ])
+    assert rules.match(WindowInfo("", "a\nb")) == "IDE"
+    assert rules.match(WindowInfo("", "Firefox")) == "Browser"
+
+
+@pytest.mark.parametrize("title", [r"(a)\1", r"(a)(?(1)b)", "a(?i)b", "("])
+def test_bad_titles_are_config_errors(write_config, title):
+    with pytest.raises(MacroCompileException):
+        compile_rules(write_config, [{"TITLE": title, "PAGE": "IDE"}])
+
+
+def test_clashing_titles_are_config_errors(write_config):
+    with pytest.raises(MacroCompileException):
+        compile_rules(write_config, [
+            {"TITLE": "(?P<x>a)", "PAGE": "IDE"},
+            {"TITLE": "(?P<x>b)", "PAGE": "Browser"},
+        ])
+
+
+def test_window_is_cached_for_ttl(write_config):
+    rules = compile_rules(write_config, [{"CLASS": "Code", "PAGE": "IDE"}])
+    provider = StubProvider(WindowInfo("Code", "x"))
+    profiles = ProfileManager(rules, provider, ttl=1.0)
+
+    assert profiles.refresh(now=100.0) == WindowInfo("Code", "x")
+    assert profiles.refresh(now=100.5) == WindowInfo("Code", "x")
+    assert provider.calls == 1
+    provider.window = WindowInfo("xterm", "y")
+    assert profiles.refresh(now=101.0) == WindowInfo("xterm", "y")
+    assert provider.calls == 2
+
+    profiles.invalidate()
+    profiles.refresh(now=101.1)
+    assert provider.calls == 3
+
+
+def test_get_page_only_reads_the_cache(write_config):
+    rules = compile_rules(write_config, [{"CLASS": "Code", "PAGE": "IDE"}], default="Main")
+    provider = StubProvider(WindowInfo("Code", "x"))
+    profiles = ProfileManager(rules, provider, ttl=1.0)
+
+    assert profiles.get_page() is None
+    profiles.refresh(now=100.0)
+    assert profiles.get_page() == "IDE"
+    # Same profile, stays on whatever page is on
+    assert profiles.get_page() is None
+    assert provider.calls == 1
+
+
+def test_focused_window_switches_pages(write_config):
+    path = write_config(ACTIONS, config={"PROFILES": {
+        "DEFAULT": "Main",
+        "RULES": [{"CLASS": "Code", "PAGE": "IDE"}, {"TITLE": "Firefox$", "PAGE": "Browser"}],
+    }}, PAGES=PAGES)
+    provider = StubProvider(WindowInfo("xterm", "bash"))
+    macro_manager = MacroManager(None, config_path=path, output=RecordingBackend(), window_provider=provider)
+    profiles = macro_manager.profiles
+    profiles.stop()
+
+    try:
+        profiles.refresh(now=1e9)
+        assert macro_manager.resolve(1) == 1
+        provider.window = WindowInfo("Code", "main.py")
+        profiles.refresh(now=2e9)
+        assert macro_manager.resolve(1) == 2
+        assert macro_manager.resolve(2) == 1
+        # A PAGE_TO / manual switch sticks while the focused app stays the same
+        macro_manager.pages.switch("Main")
+        assert macro_manager.resolve(1) == 1
+        provider.window = WindowInfo("firefox", "Docs - Mozilla Firefox")
+        profiles.refresh(now=3e9)
+        assert macro_manager.resolve(1) == 2
+        assert macro_manager.resolve(2) == 0
+    finally:
+        macro_manager.close()
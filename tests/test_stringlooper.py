@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+# test_stringlooper.py - StringLooper picking: shuffle bag, no repeat window & weighted alias table
+import random
+from collections import Counter, deque
+
+import pytest
+
+from mmp.macromanager import MacroManager
+from mmp.outputbackend import RecordingBackend
+from mmp.stringlooper import StringLooper
+from mmp.util import MacroCompileException
+
+
+def make_looper(size: int, seed: int = 0, **options) -> StringLooper:
+    """StringLooper over size strings, with a seeded random & its tables built"""
+    looper = StringLooper([str(i) for i in range(size)], name="TEST", **options)
+    looper._random = random.Random(seed)
+    looper.prepare()
+    return looper
+# make_looper
+
+
+def test_shuffle_picks_every_string_once_per_cycle():
+    looper = make_looper(50, mode="SHUFFLE")
+    last = None
+    for _ in range(20):
+        cycle = []
+        for _ in range(50):
+            looper.loop_rand()
+            cycle.append(looper.pos)
+        assert sorted(cycle) == list(range(50))
+        # A new cycle never starts with the last pick of the one before
+        assert cycle[0] != last
+        last = cycle[-1]
+
+
+@pytest.mark.parametrize("mode,weights", [("UNIFORM", None), ("WEIGHTED", [1, 5, 1, 1, 10, 1, 1, 2, 1, 1])])
+def test_no_repeat_window(mode, weights):
+    looper = make_looper(10, mode=mode, no_repeat=4, weights=weights)
+    recent = deque([looper.pos] if mode == "UNIFORM" else [], maxlen=4)
+    for _ in range(5000):
+        looper.loop_rand()
+        assert looper.pos not in recent
+        recent.append(looper.pos)
+
+
+def test_no_repeat_is_capped_at_all_but_1():
+    looper = make_looper(3, no_repeat=10)
+    assert looper.no_repeat == 2
+    picks = []
+    for _ in range(30):
+        looper.loop_rand()
+        picks.append(looper.pos)
+    # Only 1 string is ever allowed, so it goes round in a fixed order
+    assert picks[:3] * 10 == picks
+
+
+def test_weighted_follows_the_weights():
+    weights = [1, 2, 0, 7]
+    looper = make_looper(4, mode="WEIGHTED", weights=weights)
+    counts = Counter()
+    draws = 100_000
+    for _ in range(draws):
+        looper.loop_rand()
+        counts[looper.pos] += 1
+    assert counts[2] == 0
+    for idx, weight in enumerate(weights):
+        assert counts[idx] / draws == pytest.approx(weight / sum(weights), abs=0.01)
+
+
+def test_alias_table_probabilities():
+    weights = [3, 1, 4, 1, 5, 9, 2, 6]
+    looper = make_looper(len(weights), mode="WEIGHTED", weights=weights)
+    size = len(weights)
+    # Probability of each index = (its own share + the share it gets as an alias) / size
+    chance = [looper._prob[i] / size for i in range(size)]
+    for i in range(size):
+        chance[looper._alias[i]] += (1.0 - looper._prob[i]) / size
+    for idx, weight in enumerate(weights):
+        assert chance[idx] == pytest.approx(weight / sum(weights))
+
+
+@pytest.mark.parametrize("weights", [[1, -1, 1], [0, 0, 0], ["1", "x", "1"]])
+def test_bad_weights_fail_in_prepare(weights):
+    looper = StringLooper(["a", "b", "c"], name="TEST", mode="WEIGHTED", weights=weights)
+    with pytest.raises(ValueError):
+        looper.prepare()
+
+
+def test_build_loopers_prepares_tables(write_config, tmp_path):
+    (tmp_path / "weights.txt").write_text("1\n2\nnope\n")
+    path = write_config(
+        {"Shuffle": [{"KB_SEND_LOOP_RAND": "FRUITS"}], "Weighted": [{"KB_SEND_LOOP_RAND": "VEG"}]},
+        data={
+            "FRUITS": {"ITEMS": ["banana", "apple", "orange"], "RANDOM": "SHUFFLE"},
+            "VEG": {"ITEMS": ["kale", "leek", "okra"], "RANDOM": "WEIGHTED", "WEIGHTS": {"FILE": "weights.txt"}},
+        },
+    )
+    # The bad WEIGHTS line is caught when loading, the looper is left out so ACTIONS can't compile
+    with pytest.raises(MacroCompileException):
+        MacroManager(None, config_path=path, output=RecordingBackend())
+
+    (tmp_path / "weights.txt").write_text("1\n2\n3\n")
+    macro_manager = MacroManager(None, config_path=path, output=RecordingBackend())
+    loopers = macro_manager.action_manager.loopers
+    assert loopers["FRUITS"]._perm is not None
+    assert loopers["VEG"]._prob is not None
+    macro_manager.close()